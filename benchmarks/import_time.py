@@ -0,0 +1,61 @@
+#!/usr/bin/python
+'''
+Tracks the cost of `import mdba_gauge_getter`. Each run imports the package in a fresh
+interpreter with `-X importtime` and reports the median cumulative import time, the slowest
+modules, and any heavy dependency which was imported eagerly.
+
+Usage: python benchmarks/import_time.py [--runs N] [--budget-ms MS]
+'''
+import sys
+import argparse
+import statistics
+from subprocess import run, PIPE
+from typing import Dict, List, Tuple
+
+PACKAGE = 'mdba_gauge_getter'
+
+# Dependencies which must only be imported on first use
+HEAVY_MODULES = ('pandas', 'numpy', 'requests', 'bom_water', 'pyarrow')
+
+
+def import_times() -> Dict[str, int]:
+    '''
+    Returns the cumulative import time in microseconds of every module imported by the package.
+    '''
+    proc = run([sys.executable, '-X', 'importtime', '-c', f'import {PACKAGE}'],
+               stdout=PIPE, stderr=PIPE, check=True)
+    times = {}
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def benchmark(runs: int) -> Tuple[float, List[Tuple[str, int]], List[str]]:
+    totals = []
+    times: Dict[str, int] = {}
+    for _ in range(runs):
+        times = import_times()
+        totals.append(times[PACKAGE])
+    slowest = sorted(times.items(), key=lambda kv: kv[1], reverse=True)[:10]
+    eager = [m for m in HEAVY_MODULES if m in times]
+    return statistics.median(totals) / 1000, slowest, eager
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help='exit non-zero when the median import time exceeds this')
+    args = parser.parse_args()
+
+    median_ms, slowest, eager = benchmark(args.runs)
+    print(f'import {PACKAGE}: {median_ms:.1f} ms (median of {args.runs} runs)')
+    for name, cumulative in slowest:
+        print(f'  {cumulative / 1000:8.1f} ms  {name}')
+    if eager:
+        print(f'Heavy modules imported eagerly: {eager}')
+    if eager or (args.budget_ms is not None and median_ms > args.budget_ms):
+        sys.exit(1)
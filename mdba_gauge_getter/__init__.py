@@ -1,5 +1,12 @@
 from .gauge_getter import gauge_pull
 from .gauge_getter import get_states_for_gauge
 from .gauge_getter import sort_gauges_by_state
+from .gauge_getter import gauge_index
+from .gauge_getter import search_gauges
+from .gauge_getter import transport_stats
+from .planner import plan_gauge_pull, split_plan, execute_plan
+from .latest import gauge_latest
+from .watch import watch_gauges, GaugeWatcher
+from .coalesce import coalescing_stats
 
 from .version import __version__
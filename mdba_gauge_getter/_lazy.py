@@ -0,0 +1,36 @@
+import importlib
+import threading
+import types
+from typing import Any
+
+
+class LazyModule(types.ModuleType):
+    '''
+    Stands in for a module which is only imported the first time one of its attributes is
+    used, keeping heavy dependencies off the package import path.
+    '''
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self.__dict__['_lock'] = threading.Lock()
+        self.__dict__['_module'] = None
+
+    def _load(self) -> types.ModuleType:
+        module = self.__dict__['_module']
+        if module is None:
+            with self.__dict__['_lock']:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f'<lazy module \'{self.__name__}\' ({state})>'
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List
+from ._lazy import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+
+# Low-cardinality string columns, dictionary-encoded in the Arrow output
+DICTIONARY_COLUMNS = ('DATASOURCEID', 'SITEID', 'SUBJECTID', 'VAR')
+
+
+def import_pyarrow() -> Any:
+    '''
+    Imports pyarrow, which is only required for Arrow output.
+    '''
+    try:
+        import pyarrow # pylint: disable=import-outside-toplevel
+    except ImportError as e:
+        raise ImportError("output='arrow' requires pyarrow, install it with "
+                          "`pip install pyarrow`") from e
+    return pyarrow
+
+
+def dictionary_array(pa: Any, values: np.ndarray) -> Any:
+    '''
+    Dictionary-encodes an array of strings without materialising each string in Arrow.
+    '''
+    dictionary, indices = np.unique(np.asarray(values, dtype=object).astype(str),
+                                    return_inverse=True)
+    return pa.DictionaryArray.from_arrays(pa.array(indices.astype('int32')),
+                                          pa.array(dictionary, type=pa.string()))
+
+
+def quality_array(pa: Any, quality: np.ndarray) -> Any:
+    '''
+    Returns quality codes as int64. Missing and non-numeric codes (SA rows carry the unit
+    there) are null; float codes, as pandas holds a column with missing values, are kept.
+    '''
+    quality = np.asarray(quality)
+    if quality.dtype.kind in 'iu':
+        return pa.array(quality.astype('int64', copy=False))
+    numeric = pd.to_numeric(pd.Series(quality, dtype=object), errors='coerce') \
+        .to_numpy(dtype='float64')
+    missing = np.isnan(numeric)
+    return pa.array(np.where(missing, 0, numeric).astype('int64'), mask=missing)
+
+
+class ArrowBuilder:
+    '''
+    Builds a `pyarrow.Table` directly from columnar batches, with dictionary-encoded site and
+    source columns, date32 DATETIME, float64 VALUE and int64 QUALITYCODE.
+    '''
+
+    def __init__(self) -> None:
+        self.pa = import_pyarrow()
+        self._batches: List[Any] = []
+        self.rows = 0
+
+    def schema(self, extra: List[str]) -> Any:
+        pa = self.pa
+        dictionary = pa.dictionary(pa.int32(), pa.string())
+        fields = [pa.field('DATASOURCEID', dictionary), pa.field('SITEID', dictionary),
+                  pa.field('SUBJECTID', dictionary)]
+        fields += [pa.field(name, dictionary) for name in extra]
+        fields += [pa.field('DATETIME', pa.date32()), pa.field('VALUE', pa.float64()),
+                   pa.field('QUALITYCODE', pa.int64())]
+        return pa.schema(fields)
+
+    def append(self, batch: Dict[str, Any], **constants: Any) -> int:
+        '''
+        Converts one batch to an Arrow record batch, adding `constants` as extra
+        dictionary-encoded columns. Returns the number of rows added.
+        '''
+        pa = self.pa
+        n = len(batch['SITEID']) if batch else 0
+        if not n:
+            return 0
+        columns = {name: dictionary_array(pa, batch[name])
+                   for name in ('DATASOURCEID', 'SITEID', 'SUBJECTID')}
+        for name, value in constants.items():
+            columns[name] = pa.DictionaryArray.from_arrays(
+                pa.array(np.zeros(n, dtype='int32')), pa.array([str(value)]))
+        days = np.asarray(batch['DATETIME']).astype('datetime64[D]').astype('int32')
+        columns['DATETIME'] = pa.Array.from_buffers(pa.date32(), n, [None, pa.py_buffer(days)])
+        columns['VALUE'] = pa.array(np.asarray(batch['VALUE'], dtype='float64'))
+        columns['QUALITYCODE'] = quality_array(pa, batch['QUALITYCODE'])
+        schema = self.schema(list(constants))
+        self._batches.append(pa.RecordBatch.from_arrays(
+            [columns[field.name] for field in schema], schema=schema))
+        self.rows += n
+        return n
+
+    def result(self, var_column: bool = False) -> Any:
+        '''
+        Returns the collected batches as one table, without copying them.
+        '''
+        if not self._batches:
+            return self.schema(['VAR'] if var_column else []).empty_table()
+        return self.pa.Table.from_batches(self._batches)
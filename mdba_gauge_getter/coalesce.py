@@ -0,0 +1,87 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class RequestCoalescer:
+    '''
+    Shares one upstream call between every caller that asks for the same key while that call
+    is still in flight. The first caller (the leader) runs the request; later callers, from any
+    thread or coroutine, wait for the leader and receive the same result or exception.
+
+    Results are not kept once the call completes, this is not a cache.
+    '''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+        self.requests = 0
+        self.upstream = 0
+
+    @property
+    def saved(self) -> int:
+        '''Number of requests answered by another caller's in-flight request.'''
+        return self.requests - self.upstream
+
+    def stats(self) -> Dict[str, int]:
+        return {'requests': self.requests, 'upstream': self.upstream, 'saved': self.saved}
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.upstream = 0
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        with self._lock:
+            self.requests += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            future.set_running_or_notify_cancel()
+            self._inflight[key] = future
+            self.upstream += 1
+            return future, True
+
+    def _settle(self, key: Hashable, future: Future, fn: Callable[[], Any]) -> None:
+        try:
+            result = fn()
+        except BaseException as e: # pylint: disable=broad-except
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def call(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        '''
+        Returns `fn()`, or the result of an identical call (same `key`) already in flight.
+        '''
+        future, leader = self._join(key)
+        if leader:
+            self._settle(key, future, fn)
+        return future.result()
+
+    async def acall(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        '''
+        Coroutine version of `call`. The blocking `fn` runs in the event loop's default
+        executor, and waiting callers are suspended rather than blocking the loop.
+        '''
+        import asyncio # pylint: disable=import-outside-toplevel
+        future, leader = self._join(key)
+        if leader:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._settle, key, future, fn)
+        return await asyncio.wrap_future(future)
+
+
+coalescer = RequestCoalescer()
+
+
+def coalescing_stats() -> Dict[str, int]:
+    '''
+    Returns counters for the module-wide coalescer: total requests, upstream calls made,
+    and requests saved by sharing an in-flight call.
+    '''
+    return coalescer.stats()
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import json
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from ._lazy import LazyModule
+
+
+np = LazyModule('numpy')
+
+# Pools are started once and shared by every pull asking for the same number of processes
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def pack_batch(batch: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Packs a columnar batch for transfer between processes. Numeric columns pickle as single
+    buffers already; string columns are dictionary-encoded into their distinct values plus an
+    int32 code array, rather than pickled one Python string at a time.
+    '''
+    packed: Dict[str, Any] = {}
+    for name, column in batch.items():
+        column = np.asarray(column)
+        if column.dtype == object:
+            uniques, codes = np.unique(column.astype(str), return_inverse=True)
+            packed[name] = ('dictionary', uniques.tolist(), codes.astype('int32'))
+        else:
+            packed[name] = ('array', column)
+    return packed
+
+
+def unpack_batch(packed: Dict[str, Any]) -> Dict[str, Any]:
+    batch = {}
+    for name, (kind, *parts) in packed.items():
+        if kind == 'dictionary':
+            uniques, codes = parts
+            batch[name] = np.asarray(uniques, dtype=object)[codes] if len(codes) \
+                else np.empty(0, dtype=object)
+        else:
+            batch[name] = parts[0]
+    return batch
+
+
+def decode_kisters(state: str, content: bytes, quality: Any,
+                   timestamps: str = 'date') -> Tuple[Dict[str, Any], List[Any]]:
+    '''
+    Runs in a worker process: parses a raw `get_ts_traces` response and extracts it to a
+    packed columnar batch under the `quality` policy and `timestamps` mode. Returns the batch
+    and the ((source, code), count) pairs the policy dropped.
+    '''
+    # pylint: disable=import-outside-toplevel
+    from .gauge_getter import PullContext, extract_columns
+    try:
+        data = json.loads(content)
+    except json.decoder.JSONDecodeError:
+        raise json.decoder.JSONDecodeError(
+            f'Unable to parse response from {state}. The server returned invalid JSON data:\n'
+            f'{content[:1000]!r}', content.decode(errors='replace'), 0) from None
+    context = PullContext(quality, timestamps=timestamps)
+    batch = extract_columns(state, data, context)
+    return pack_batch(batch), list(context.quality.dropped.items())
+
+
+def decode_pool(processes: int) -> ProcessPoolExecutor:
+    '''
+    Returns the shared pool of `processes` decoding processes, starting it on first use.
+    '''
+    with _pools_lock:
+        pool = _pools.get(processes)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=processes)
+            _pools[processes] = pool
+        return pool
+
+
+def shutdown_decode_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown()
+        _pools.clear()
+
+
+class Decoder:
+    '''
+    Hands raw Kisters responses to a process pool for JSON decoding and extraction, so the
+    thread doing the network I/O moves straight on to its next request while decoding runs on
+    other cores. Results are collected, in submission order, with `results`; at most
+    `max_pending` responses (twice the pool size by default) are held undecoded at once.
+    '''
+
+    def __init__(self, processes: int, quality: Any, timestamps: str = 'date',
+                 max_pending: Optional[int] = None) -> None:
+        self.pool = decode_pool(processes)
+        self.quality = quality
+        self.timestamps = timestamps
+        self.max_pending = max_pending or 2 * processes
+        self._pending: List[Future] = []
+
+    def submit(self, state: str, content: bytes) -> None:
+        self._pending.append(self.pool.submit(decode_kisters, state, content,
+                                              self.quality.policy, self.timestamps))
+
+    def results(self, block: bool = True) -> List[Dict[str, Any]]:
+        '''
+        Returns decoded batches in submission order, adding the rows they dropped to the
+        pull's quality counts. With `block`, waits for every submitted response; otherwise
+        returns those decoded so far, waiting for the oldest only while more than
+        `max_pending` are outstanding.
+        '''
+        batches = []
+        while self._pending and (block or self._pending[0].done() or
+                                 len(self._pending) > self.max_pending):
+            packed, dropped = self._pending.pop(0).result()
+            self.quality.count(dropped)
+            batches.append(unpack_batch(packed))
+        return batches
+
+
+def batch_rows(batch: Dict[str, Any]) -> List[List[Any]]:
+    '''
+    Converts a decoded batch to `extract_data` style rows, with DATETIME as `datetime.date`,
+    VALUE as float and QUALITYCODE as int.
+    '''
+    dates = np.asarray(batch['DATETIME']).astype('datetime64[D]').tolist()
+    return [list(row) for row in zip(batch['DATASOURCEID'].tolist(), batch['SITEID'].tolist(),
+                                     batch['SUBJECTID'].tolist(), dates,
+                                     batch['VALUE'].tolist(), batch['QUALITYCODE'].tolist())]
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import datetime
+from typing import List, Tuple
+from ._lazy import LazyModule
+
+
+pd = LazyModule('pandas')
+
+# Intervals which can be derived, finest first, with the pandas period each groups by.
+# Hourly pulls are not a source: extraction truncates their timestamps to the day.
+INTERVAL_PERIODS = {
+    'day': 'D',
+    'month': 'M',
+    'year': 'Y',
+}
+
+INTERVAL_ALIASES = {
+    'd': 'day',
+    'm': 'month',
+    'y': 'year',
+}
+
+# How a coarser value is computed from finer values of the same data_type
+AGGREGATES = {
+    'mean': 'mean',
+    'min': 'min',
+    'max': 'max',
+    'tot': 'sum',
+}
+
+DATA_TYPE_ALIASES = {
+    'avg': 'mean',
+    'average': 'mean',
+    'av': 'mean',
+    'a': 'mean',
+    'minimum': 'min',
+    'maximum': 'max',
+}
+
+GROUP_COLUMNS = ['DATASOURCEID', 'SITEID', 'SUBJECTID', 'DATETIME']
+
+
+def normalise(interval: str, data_type: str) -> Tuple[str, str]:
+    interval = interval.lower()
+    data_type = data_type.lower()
+    return INTERVAL_ALIASES.get(interval, interval), DATA_TYPE_ALIASES.get(data_type, data_type)
+
+
+def derivation_sources(interval: str, data_type: str) -> List[Tuple[str, str]]:
+    '''
+    The finer (interval, data_type) series a value of `interval`/`data_type` can be computed
+    from, best first. Only the same aggregate is used (a monthly max is the max of daily
+    maxima), and a yearly mean is not taken from monthly means, which would weight every
+    month equally.
+    '''
+    interval, data_type = normalise(interval, data_type)
+    if interval not in INTERVAL_PERIODS or data_type not in AGGREGATES:
+        return []
+    finer = list(INTERVAL_PERIODS)[:list(INTERVAL_PERIODS).index(interval)]
+    return [(source, data_type) for source in finer
+            if not (data_type == 'mean' and source == 'month')]
+
+
+def whole_periods(start: datetime.date, end: datetime.date, interval: str) -> bool:
+    '''
+    Whether `start`..`end` is made up of whole `interval` periods. Values are only derived for
+    such windows: a period cut by the window would be aggregated from part of its values, and
+    stamped with a first day outside the window.
+    '''
+    interval = normalise(interval, '')[0]
+    if interval not in INTERVAL_PERIODS:
+        return False
+    freq = INTERVAL_PERIODS[interval]
+    return pd.Period(start, freq).start_time.date() == start and \
+        pd.Period(end, freq).end_time.date() == end
+
+
+def resample(frame: pd.DataFrame, interval: str, data_type: str) -> pd.DataFrame:
+    '''
+    Aggregates a long frame of finer values (every gauge at once) to `interval` periods with
+    `data_type`'s aggregate. Each period is stamped with its first day; QUALITYCODE is the
+    highest (worst) code among the values aggregated.
+    '''
+    interval, data_type = normalise(interval, data_type)
+    if frame.empty:
+        return pd.DataFrame(columns=GROUP_COLUMNS + ['VALUE', 'QUALITYCODE'])
+    periods = pd.DatetimeIndex(pd.to_datetime(pd.Series(frame['DATETIME'], dtype=object))) \
+        .to_period(INTERVAL_PERIODS[interval]).to_timestamp()
+    values = frame.assign(DATETIME=periods,
+                          VALUE=pd.to_numeric(frame['VALUE'], errors='coerce'))
+    derived = values.groupby(GROUP_COLUMNS, sort=True, observed=True).agg(
+        VALUE=('VALUE', AGGREGATES[data_type]), QUALITYCODE=('QUALITYCODE', 'max')).reset_index()
+    derived['DATETIME'] = pd.DatetimeIndex(derived['DATETIME']).date
+    return derived
@@ -1,15 +1,31 @@
+from __future__ import annotations
+
 import os
 import json
 import logging
 import datetime
+import threading
 from decimal import Decimal
-from typing import Tuple, List, Dict, TypeVar, Set, Optional, Any
-import requests
-import pandas as pd
-import bom_water
+from typing import Tuple, List, Dict, TypeVar, Set, Optional, Any, Union
+from ._lazy import LazyModule
+from .coalesce import coalescer
+from .hedging import hedged
+from .spill import SpillBuffer, batch_len
+from .arrow import ArrowBuilder
+from .matrix import MatrixBuilder
+from .spatial import GaugeIndex
+from .search import GaugeNameIndex
+from .quality import QualityFilter
+from .decode import Decoder, batch_rows
+from .derive import derivation_sources, resample, whole_periods
+
+# Heavy dependencies are imported on first use, so importing the package stays cheap
+requests = LazyModule('requests')
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+bom_water = LazyModule('bom_water')
 
 
-logging.basicConfig()
 log = logging.getLogger(__name__[:-3])
 log.setLevel(logging.INFO)
 
@@ -18,13 +34,8 @@ T = TypeVar('T')
 gauge_data_uri = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
                               'data/bom_gauge_data.csv')
 gauges: pd.core.frame.DataFrame = None
-
-STATE_URLS = {
-    'NSW': 'realtimedata.waternsw.com.au',
-    'QLD': 'water-monitoring.information.qld.gov.au',
-    'VIC': 'data.water.vic.gov.au'
-}
-
+_gauges_lock = threading.Lock()
+_catalogue_indexes: Dict[str, Tuple[Any, Any]] = {}
 
 STATE_LEVEL_VarFrom = {
     'NSW' : Decimal('100.00'),
@@ -110,14 +121,206 @@ STATE_WATERTEMP_VarTo = {
     'QLD' : Decimal('2080.00')
 }
 
-MAX_SITES_PER_REQUEST = {
-    'NSW': 5,
-    'VIC': 5,
-    'QLD': 5,
-    'SA' : 5 
+# Kisters `varfrom`/`varto` tables for each variable
+KISTERS_VARIABLES = {
+    'L': (STATE_LEVEL_VarFrom, STATE_LEVEL_VarTo),
+    'F': (STATE_FLOW_VarFrom, STATE_FLOW_VarTo),
+    'LL': (STATE_LAKELEVEL_VarFrom, STATE_LAKELEVEL_VarTo),
+    'SV': (STATE_STORAGEVOLUME_VarFrom, STATE_STORAGEVOLUME_VarTo),
+    'P': (STATE_PRECIP_VarFrom, STATE_PRECIP_VarTo),
+    'DO': (STATE_DO_VarFrom, STATE_DO_VarTo),
+    'WT': (STATE_WATERTEMP_VarFrom, STATE_WATERTEMP_VarTo),
+}
+
+# BOM observed property and procedure pattern for each variable
+BOM_VARIABLES = {
+    'F': ('Water_Course_Discharge', 'Pat4'),
+    'L': ('Water_Course_Level', 'Pat3'),
+    'LL': ('Storage_Level', 'Pat7'),
+    'SL': ('Storage_Level', 'Pat7'),
+    'SV': ('Storage_Volume', 'Pat6'),
+    'WT': ('Water_Temperature', 'Pat1'),
+    'P': ('Rainfall', 'Pat2'),
+}
+
+# BOM procedure suffix for each interval, and for daily data each data_type. Rainfall is
+# published as totals rather than means.
+BOM_INTERVAL_PROCEDURES = {
+    'hour': 'HourlyMean',
+    'month': 'MonthlyMean',
+    'year': 'YearlyMean',
 }
+BOM_DAILY_PROCEDURES = {
+    'min': 'DailyMin',
+    'mean': 'DailyMean',
+    'max': 'DailyMax',
+}
+BOM_RAINFALL_PROCEDURES = {
+    'day': 'DailyTot09',
+    'month': 'MonthlyTot24',
+    'year': 'YearlyTot24',
+}
+BOM_INTERVAL_ALIASES = {'h': 'hour', 'd': 'day', 'm': 'month', 'y': 'year'}
+BOM_DATA_TYPE_ALIASES = {
+    'minimum': 'min',
+    'avg': 'mean',
+    'average': 'mean',
+    'av': 'mean',
+    'a': 'mean',
+    'maximum': 'max',
+}
+
+# Aquarius dataset label (the part of the dataset name before '@<location>') for each gauge
+AQUARIUS_DEFAULT_LABEL = 'Discharge.Total barrage flow'
+AQUARIUS_DATASET_LABELS: Dict[str, str] = {}
+
+# Identical requests already in flight (from any thread) share one upstream call
+COALESCE_REQUESTS = True
+
+# Requests of one pull run on up to this many threads, each within its source's rate limits
+PULL_WORKERS = 4
+
+# With `timestamps='datetime'`, every source's timestamps are converted to this zone
+# (Australian Eastern Standard Time, which the Kisters portals report in)
+TIMESTAMP_TIMEZONE = datetime.timezone(datetime.timedelta(hours=10))
+TIMESTAMP_MODES = ('date', 'datetime')
+
+DATA_COLUMNS = ['DATASOURCEID', 'SITEID', 'SUBJECTID', 'DATETIME', 'VALUE', 'QUALITYCODE']
+
+# How `get_ts_traces` requests are sent to each portal: 'get' packs the request into the
+# query string, 'post' sends it as the request body, and 'auto' tries POST and falls back to
+# GET (for the rest of the session) if the portal rejects it
+STATE_TRANSPORT = {
+    'NSW': 'get',
+    'VIC': 'get',
+    'QLD': 'get',
+}
+
+# Answers to a POST which show a portal does not take `get_ts_traces` requests as a body
+POST_REJECTED_STATUSES = {405, 411, 415, 501}
+
+# Response encodings requested from every portal
+ACCEPT_ENCODING = 'gzip, deflate'
+
+_sessions = threading.local()
+_session_generation = 0
+_session_lock = threading.Lock()
+_post_supported: Dict[str, bool] = {}
+_transport_stats = {'get': 0, 'post': 0, 'post_fallbacks': 0, 'compressed': 0,
+                    'wire_bytes': 0, 'decoded_bytes': 0}
+_transport_lock = threading.Lock()
+
+
+def get_session() -> Any:
+    '''
+    Returns the calling thread's HTTP session, so repeated calls from one thread to the same
+    portal reuse pooled connections rather than reconnecting each time. Each thread has its
+    own, as a `requests.Session` is not safe to share between threads.
+    '''
+    session = getattr(_sessions, 'session', None)
+    if session is None or _sessions.generation != _session_generation:
+        session = requests.Session()
+        session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        _sessions.session, _sessions.generation = session, _session_generation
+    return session
+
+
+def reset_sessions() -> None:
+    '''
+    Makes every thread start a new session on its next request, e.g. after replacing
+    `requests`.
+    '''
+    global _session_generation
+    with _session_lock:
+        _session_generation += 1
 
-BARRAGE_GAUGES ={"A4261002"}
+
+def record_transfer(method: str, r: Any) -> None:
+    '''
+    Adds a response to the transport statistics, comparing the bytes sent over the wire
+    (the Content-Length of a compressed response) with the decoded body size.
+    '''
+    decoded = len(r.content)
+    wire = decoded
+    if r.headers.get('Content-Encoding', 'identity') != 'identity' and \
+            'Content-Length' in r.headers:
+        wire = int(r.headers['Content-Length'])
+    with _transport_lock:
+        _transport_stats[method] += 1
+        _transport_stats['compressed'] += wire != decoded
+        _transport_stats['wire_bytes'] += wire
+        _transport_stats['decoded_bytes'] += decoded
+
+
+def transport_stats() -> Dict[str, int]:
+    '''
+    Counts of state portal requests by method (and POST fallbacks to GET), with the bytes
+    received over the wire, after decompression, and saved by compression.
+    '''
+    with _transport_lock:
+        stats = dict(_transport_stats)
+    stats['bytes_saved'] = stats['decoded_bytes'] - stats['wire_bytes']
+    return stats
+
+
+def reset_transport_stats() -> None:
+    with _transport_lock:
+        for key in _transport_stats:
+            _transport_stats[key] = 0
+
+
+class PullContext:
+    '''
+    Settings and counters shared by every request made for one `gauge_pull` call.
+    '''
+
+    def __init__(self, quality: Any = None, decode_processes: Optional[int] = None,
+                 routing: Any = None, negative: Any = None, timestamps: str = 'date') -> None:
+        self.quality = QualityFilter(quality)
+        self.decode_processes = decode_processes
+        self.timestamps = timestamps
+        self.routing = routing
+        self.negative = negative
+        self.skipped: Dict[str, int] = {}
+
+    def decoder(self) -> Optional[Decoder]:
+        '''
+        Returns a `Decoder` when responses are to be decoded in a process pool.
+        '''
+        if not self.decode_processes:
+            return None
+        return Decoder(self.decode_processes, self.quality, self.timestamps)
+
+    def report(self) -> Dict[str, Any]:
+        '''
+        Summary of what the pull filtered or skipped, attached to results as `attrs`.
+        '''
+        report = {}
+        dropped = self.quality.report()
+        if dropped:
+            report['quality_dropped'] = dropped
+        if self.skipped:
+            report['negative_cache_skipped'] = dict(self.skipped)
+        return report
+
+
+def get_source(name: str) -> Any:
+    '''
+    The registered source called `name` (see `sources`), which holds its host, the sites one
+    request may carry and its rate limits.
+    '''
+    from .sources import get_source as registered # pylint: disable=import-outside-toplevel
+    return registered(name)
+
+
+def coalesced(key: Tuple[Any, ...], fn) -> Any:
+    '''
+    Runs `fn`, sharing the call with any identical request (same `key`) already in flight
+    when `COALESCE_REQUESTS` is enabled. Callers must treat the shared result as read-only.
+    '''
+    if not COALESCE_REQUESTS:
+        return fn()
+    return coalescer.call(key, fn)
 
 
 def init() -> None:
@@ -126,11 +329,56 @@ def init() -> None:
     gague data.
     '''
     global gauges
-    gauges = pd.read_csv(gauge_data_uri, skiprows=1, skipfooter=1,
-                         names=['gauge_name', 'gauge_number',
-                                'gauge_owner', 'lat', 'long'], engine='python')
-    gauges['State'] = gauges['gauge_owner'].apply(lambda x: x.strip().split(' ', 1)[0])
-    gauges = gauges.drop(['lat', 'long', 'gauge_owner'], axis=1)
+    # Built in full before it is published, as `load_gauges` readers do not take the lock
+    catalogue = pd.read_csv(gauge_data_uri, skiprows=1, skipfooter=1,
+                            names=['gauge_name', 'gauge_number',
+                                   'gauge_owner', 'lat', 'long'], engine='python')
+    catalogue['State'] = catalogue['gauge_owner'].apply(lambda x: x.strip().split(' ', 1)[0])
+    gauges = catalogue
+
+
+def load_gauges() -> pd.DataFrame:
+    '''
+    Returns the gauge catalogue, loading it from disk exactly once however many threads ask
+    for it at the same time.
+    '''
+    if not hasattr(gauges, "empty") or gauges.empty:
+        with _gauges_lock:
+            if not hasattr(gauges, "empty") or gauges.empty:
+                init()
+    return gauges
+
+
+def catalogue_index(name: str, build) -> Any:
+    '''
+    Returns the index `name` over the gauge catalogue, built once with `build(catalogue)`,
+    shared by every caller, and rebuilt only if the catalogue is reloaded.
+    '''
+    catalogue = load_gauges()
+    cached = _catalogue_indexes.get(name)
+    if cached is None or cached[0] is not catalogue:
+        with _gauges_lock:
+            cached = _catalogue_indexes.get(name)
+            if cached is None or cached[0] is not catalogue:
+                cached = (catalogue, build(catalogue))
+                _catalogue_indexes[name] = cached
+    return cached[1]
+
+
+def gauge_index() -> GaugeIndex:
+    '''
+    Returns the spatial index over the catalogue's gauge coordinates.
+    '''
+    return catalogue_index('spatial', GaugeIndex)
+
+
+def search_gauges(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    '''
+    Finds catalogue gauges by river/site name or gauge number, e.g. 'CULGOA @ WHYENBAH' or
+    'culgoa whyen'. Matches are ranked (exact, then prefix, then misspelt tokens) and returned
+    as dicts with the gauge number, name, state, owner and score.
+    '''
+    return catalogue_index('name', GaugeNameIndex).search(query, limit)
 
 
 def get_states_for_gauge(gauge_number: str) -> Set[str]:
@@ -142,8 +390,7 @@ def get_states_for_gauge(gauge_number: str) -> Set[str]:
     # Return two results in different states, that may create integrity issues and
     # should be investigated. It is caused by the data within bom_gauge_data.csv. not application
     # logic.
-    if not hasattr(gauges, "empty") or gauges.empty:
-        init()
+    load_gauges()
     matching = list(gauges[gauges['gauge_number'] == gauge_number]['State'])
     if len(matching) > 1:
         log.warning(f'Gauge {gauge_number} has {len(matching)} state results: {matching}')
@@ -176,14 +423,49 @@ def sort_gauges_by_state(gauge_numbers: List[str]) -> Dict[str, List[str]]:
     return states
 
 
+def send_kisters(state: str, base_url: str, req_url: str, json_data: str) -> Any:
+    '''
+    Sends one `get_ts_traces` request using the portal's transport in `STATE_TRANSPORT`.
+    In 'auto' mode a POST the portal rejects (see `POST_REJECTED_STATUSES`), or answers
+    with something other than JSON, is retried as a GET and the portal is not sent POSTs
+    again. A POST which fails for any other reason (a timeout, or e.g. a 503) is retried as
+    a GET this once only.
+    '''
+    transport = STATE_TRANSPORT.get(state, 'get')
+    session = get_session()
+    if transport == 'post' or (transport == 'auto' and _post_supported.get(state, True)):
+        rejected = False
+        try:
+            r = session.post(base_url, data=json_data.encode(),
+                             headers={'Content-Type': 'application/json'})
+            if transport == 'post' or (r.status_code == 200 and r.content.lstrip()[:1] == b'{'):
+                _post_supported[state] = True
+                record_transfer('post', r)
+                return r
+            rejected = r.status_code in POST_REJECTED_STATUSES or r.status_code == 200
+        except requests.RequestException as e:
+            if transport == 'post':
+                raise
+            log.info(f'POST to {state} portal failed ({e}), retrying as GET')
+        if rejected:
+            log.info(f'{state} portal does not accept POST requests, using GET')
+            _post_supported[state] = False
+            with _transport_lock:
+                _transport_stats['post_fallbacks'] += 1
+    r = session.get(req_url)
+    record_transfer('get', r)
+    return r
+
+
 def call_state_api(state: str, indicative_sites: List[str], start_time: datetime.date,
                    end_time: datetime.date, data_source: str, var: str,
-                   interval: str, data_type: str) -> Dict[str, Any]:
+                   interval: str, data_type: str, raw: bool = False) -> Dict[str, Any]:
     '''
     Sends a web request with a destination based on `state` of the gauge.
 
     Returns a JSON dict object containing web responses, and will fail if the server returns
-    either a non HTTP-200 error code, or invalid JSON
+    either a non HTTP-200 error code, or invalid JSON. With `raw`, the undecoded response
+    body is returned instead, for decoding elsewhere (see `decode`).
     '''
     if not isinstance(start_time, datetime.date):
         raise TypeError('start_time must be a datetime.date object, but got type '
@@ -191,39 +473,15 @@ def call_state_api(state: str, indicative_sites: List[str], start_time: datetime
     if not isinstance(end_time, datetime.date):
         raise TypeError('end_time must be a datetime.date object, but got type '
                         f'{type(end_time)} (value: \'{end_time}\')')
-    
-    url = STATE_URLS[state]
-
-    if (var=="L"):
-        var_from = STATE_LEVEL_VarFrom[state]
-        var_to = STATE_LEVEL_VarTo[state]
-
-    elif (var=="F"):
-        var_from = STATE_FLOW_VarFrom[state]
-        var_to = STATE_FLOW_VarTo[state]
-
-    elif (var=="LL"):
-        var_from = STATE_LAKELEVEL_VarFrom[state]
-        var_to = STATE_LAKELEVEL_VarTo[state]
-
-    elif (var=="SV"):
-        var_from = STATE_STORAGEVOLUME_VarFrom[state]
-        var_to = STATE_STORAGEVOLUME_VarTo[state]
-
-    elif (var=="P"):
-        var_from = STATE_PRECIP_VarFrom[state]
-        var_to = STATE_PRECIP_VarTo[state]
 
-    elif (var=="DO"):
-        var_from = STATE_DO_VarFrom[state]
-        var_to = STATE_DO_VarTo[state]
+    source = get_source(state)
+    url = source.host
 
-    elif (var=="WT"):
-        var_from = STATE_WATERTEMP_VarFrom[state]
-        var_to = STATE_WATERTEMP_VarTo[state]
-
-    else:
+    if var not in KISTERS_VARIABLES:
         raise AttributeError("The input 'var' takes 'L', 'F', 'LL', 'SV', 'P', 'DO', 'WT' only.") # TODO: Implement a more accurate exception handling
+    var_from_table, var_to_table = KISTERS_VARIABLES[var]
+    var_from = var_from_table[state]
+    var_to = var_to_table[state]
 
     sites = ','.join(indicative_sites)
     data = {
@@ -260,59 +518,128 @@ def call_state_api(state: str, indicative_sites: List[str], start_time: datetime
 
     json_data = json.dumps(data, separators=(',', ':'))
 
- 
-    req_url = f'https://{url}/cgi/webservice.exe?{json_data}'
-
-    if state =="QLD": # replace when QLD upgrades
-        req_url = f'https://{url}/cgi/webservice.pl?{json_data}'
-
-    req_url = req_url.replace(' ', '%20')
+    base_url = source.url
+    req_url = f'{base_url}?{json_data}'.replace(' ', '%20')
     
-    # TODO-idiosyncratic the use of JSON in the query string seems werid, this should be a HTTP POST
-    # but requires endpoints to support it..
+    # The query string form works on every portal; portals set to 'post' or 'auto' in
+    # STATE_TRANSPORT are sent the request as a POST body instead (see `send_kisters`)
     log.debug(f'Sending request to URL \'{req_url}\'')
-    r = requests.get(req_url)
-    if not r.status_code == 200: 
-        raise requests.HTTPError(f'Request to \'{url}\' failed with HTTP Response code '
-                                 f'{r.status_code} and HTTP Response:\n{r.content}')
-    try:
-        return json.loads(r.content)
-    except json.decoder.JSONDecodeError:
-        raise json.decoder.JSONDecodeError(
-            f'Unable to parse response to request to \'{url}\'. The server returned invalid JSON '
-            f' data. Got HTTP Response code {r.status_code} and HTTP Response:\n{r.content}',
-            r.content.decode(), 0)
 
+    def fetch() -> Any:
+        r = hedged(url, lambda: send_kisters(state, base_url, req_url, json_data),
+                   source.limiter)
+        if not r.status_code == 200: 
+            raise requests.HTTPError(f'Request to \'{url}\' failed with HTTP Response code '
+                                     f'{r.status_code} and HTTP Response:\n{r.content}')
+        return r
+
+    if raw:
+        return coalesced(('kisters-raw', req_url), lambda: fetch().content)
+
+    def send() -> Dict[str, Any]:
+        r = fetch()
+        try:
+            return json.loads(r.content)
+        except json.decoder.JSONDecodeError:
+            raise json.decoder.JSONDecodeError(
+                f'Unable to parse response to request to \'{url}\'. The server returned invalid JSON '
+                f' data. Got HTTP Response code {r.status_code} and HTTP Response:\n{r.content}',
+                r.content.decode(), 0)
 
-def extract_data(state: str, data) -> List[List[Any]]:
+    return coalesced(('kisters', req_url), send)
+
+
+def extract_data(state: str, data, context: Optional[PullContext] = None) -> List[List[Any]]:
     """
-    Collects 
+    Collects observations from a Kisters `get_ts_traces` response into rows, built from the
+    columnar batch of `extract_columns`: DATETIME as `datetime.date`, VALUE as float and
+    QUALITYCODE as int. Quality codes are screened as in `extract_columns`; by default codes
+    of 999 and above are dropped.
     """
-    
-    # log.info(f'data keys {data.keys()}')
-    # log.info(f'data is {data}')
-    extracted = []
-    if '_return' in data.keys():
-        
-        data['return'] = data['_return']
-        del data['_return']
-    try:
-        for sample in data['return']['traces']:
-            for obs in sample['trace']:
-                # TODO-Detail - put detail re the purpose of obs['q'] - I don't know what/why this
-                # logic exists, it's obviously to sanitise data but unclear on what/why
-                # TODO-idiosyncratic: was < 999 prior to refactor, this means that 998 is the max
-                # accepted number, this would presumably be 999, but I can't say for sure
-                if int(obs['q']) >= 999:
-                    continue
-                obsdate = datetime.datetime.strptime(str(obs['t']), '%Y%m%d%H%M%S').date()
-                objRow = [state, sample['site'], 'WATER', obsdate, obs['v'], obs['q']]
-                extracted.append(objRow)
+    return batch_rows(extract_columns(state, data, context))
+
 
+def to_float(values: List[Any]) -> np.ndarray:
+    '''
+    Converts raw observation values (numbers or numeric strings) to float64, with
+    unparseable values as NaN.
+    '''
+    return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype='float64')
+
+
+def make_batch(source: str, sites: np.ndarray, dates: np.ndarray, values: np.ndarray,
+               quality: np.ndarray) -> Dict[str, np.ndarray]:
+    '''
+    Assembles a columnar batch with the standard gauge getter columns.
+    '''
+    n = len(sites)
+    return {
+        'DATASOURCEID': np.full(n, source, dtype=object),
+        'SITEID': sites,
+        'SUBJECTID': np.full(n, 'WATER', dtype=object),
+        'DATETIME': dates,
+        'VALUE': values,
+        'QUALITYCODE': quality,
+    }
+
+
+def kisters_days(times: List[Any]) -> np.ndarray:
+    '''
+    Parses Kisters `YYYYMMDDHHMMSS` timestamps (as ints or strings) with integer arithmetic,
+    returning the day of each as datetime64.
+    '''
+    ymd = np.asarray(times).astype('int64') // 1000000
+    years, month_day = np.divmod(ymd, 10000)
+    months, days = np.divmod(month_day, 100)
+    first_of_month = (years - 1970).astype('datetime64[Y]').astype('datetime64[M]') + \
+        (months - 1).astype('timedelta64[M]')
+    return (first_of_month.astype('datetime64[D]') + (days - 1).astype('timedelta64[D]')) \
+        .astype('datetime64[ns]')
+
+
+def kisters_times(times: List[Any]) -> np.ndarray:
+    '''
+    As `kisters_days`, keeping the time of day.
+    '''
+    hours, minute_second = np.divmod(np.asarray(times).astype('int64') % 1000000, 10000)
+    minutes, seconds = np.divmod(minute_second, 100)
+    return kisters_days(times) + (hours * 3600 + minutes * 60 + seconds).astype('timedelta64[s]')
+
+
+def extract_columns(state: str, data, context: Optional[PullContext] = None) -> Dict[str, np.ndarray]:
+    '''
+    Extracts a Kisters `get_ts_traces` response to a batch of arrays, with DATETIME as
+    datetime64 truncated to the day (or to the second, when the pull's `timestamps` is
+    'datetime') and VALUE as float64. Quality codes are screened for each trace as a whole
+    (see `PullContext`) before any timestamp is parsed.
+    '''
+    context = context or PullContext()
+    key = '_return' if '_return' in data.keys() else 'return'
+    sites: List[np.ndarray] = []
+    times: List[Any] = []
+    values: List[Any] = []
+    quality: List[int] = []
+    try:
+        for sample in data[key]['traces']:
+            trace = sample['trace']
+            q = np.fromiter((int(obs['q']) for obs in trace), dtype='int64', count=len(trace))
+            keep = context.quality.mask(state, q)
+            kept = [obs for obs, k in zip(trace, keep) if k]
+            sites.append(np.full(len(kept), sample['site'], dtype=object))
+            times += [obs['t'] for obs in kept]
+            values += [obs['v'] for obs in kept]
+            quality.append(q[keep])
     except KeyError:
         log.error('No valid data contained in response, skipping')
+        return make_batch(state, np.empty(0, dtype=object), np.empty(0, dtype='datetime64[ns]'),
+                          np.empty(0), np.empty(0, dtype='int64'))
 
-    return extracted
+    return make_batch(state,
+                      np.concatenate(sites) if sites else np.empty(0, dtype=object),
+                      kisters_times(times) if context.timestamps == 'datetime'
+                      else kisters_days(times),
+                      to_float(values),
+                      np.concatenate(quality) if quality else np.empty(0, dtype='int64'))
 
 
 def split_into_chunks(input_list: List[T], maxlen: int) -> List[List[T]]:
@@ -337,21 +664,51 @@ def split_into_chunks(input_list: List[T], maxlen: int) -> List[List[T]]:
 def process_gauge_pull(sitelist: List[str], callstate: str, call_data_source: str,
                        start_time_user: datetime.date, end_time_user: datetime.date,
                        var: str, interval: str,
-                       data_type: str) -> List[List[Any]]:
+                       data_type: str, sink=None,
+                       context: Optional[PullContext] = None) -> List[Any]:
     '''
     Intermediate function which splits many gauge_pull records into separate web requests
     and provides user feedback on progress
+
+    With a `sink`, each response is extracted to a columnar batch and passed to `sink` rather
+    than returned; the return value is then the row count of each non-empty batch.
+
+    When the pull decodes in a process pool (`decode_processes`), each raw response is handed
+    to the pool as soon as it arrives and the next request is sent straight away. Batches are
+    passed on as they are decoded, so only a few responses are held at once.
     '''
 
-    max_sites_per_request = MAX_SITES_PER_REQUEST[callstate]
+    max_sites_per_request = get_source(callstate).max_sites_per_request
     site_chunks = split_into_chunks(sitelist, max_sites_per_request)
-    response_data: List[List[str]] = []
+    response_data: List[Any] = []
+    decoder = context.decoder() if context is not None else None
+
+    def take(batch: Dict[str, np.ndarray]) -> None:
+        if sink is None:
+            response_data.extend(batch_rows(batch))
+        elif batch_len(batch):
+            sink(batch)
+            response_data.append(batch_len(batch))
+
     for index, s in enumerate(site_chunks):
         log.info(f'{callstate} - Request {index+1} of {len(site_chunks)}')
+        if decoder is not None:
+            decoder.submit(callstate, call_state_api(callstate, s, start_time_user, end_time_user,
+                                                     call_data_source, var, interval, data_type,
+                                                     raw=True))
+            for batch in decoder.results(block=False):
+                take(batch)
+            continue
         ret = call_state_api(callstate, s, start_time_user, end_time_user,
                              call_data_source, var, interval, data_type)
 
-        response_data += extract_data(callstate, ret)
+        if sink is None:
+            response_data += extract_data(callstate, ret, context)
+            continue
+        take(extract_columns(callstate, ret, context))
+
+    for batch in decoder.results() if decoder is not None else []:
+        take(batch)
 
     return response_data
 
@@ -361,106 +718,129 @@ def fixdate(timestamp):
     #datetime.astimzone('Australia/Sydney',date) #date.tz_localize('Australia/Sydney')   #datetime.datetime.strptime(date, '%Y-%m-%dT%H:%M:%S')
     return date
 
+def bom_procedure(var: str, interval: str, data_type: str) -> Tuple[str, str]:
+    '''
+    Names the BOM observed property and procedure serving `var` at `interval`/`data_type`.
+    '''
+    if var == "DO":
+        raise AttributeError("Var 'DO' not available on the BoM API")
+    if var not in BOM_VARIABLES:
+        raise AttributeError(f"Var '{var}' not available on the BoM API")
+    prop, pattern = BOM_VARIABLES[var]
+    interval = BOM_INTERVAL_ALIASES.get(interval.lower(), interval.lower())
+    data_type = BOM_DATA_TYPE_ALIASES.get(data_type, data_type)
+    if interval == 'hour' and var in ('WT', 'P'):
+        raise NotImplementedError(f'Hourly data not available for '
+                                  f'{"Water Temp" if var == "WT" else "Precipitation"}')
+    if var == 'P' and interval in BOM_RAINFALL_PROCEDURES:
+        suffix = BOM_RAINFALL_PROCEDURES[interval]
+    elif interval == 'day' and data_type in BOM_DAILY_PROCEDURES:
+        suffix = BOM_DAILY_PROCEDURES[data_type]
+    elif interval in BOM_INTERVAL_PROCEDURES:
+        suffix = BOM_INTERVAL_PROCEDURES[interval]
+    else:
+        raise AttributeError(f"BoM API has no '{data_type}' data at interval '{interval}' "
+                             f"for var '{var}'")
+    return prop, f'{pattern}_C_B_1_{suffix}'
+
+
 def bom_params(var, interval, data_type):
     bm = bom_water.BomWater()
-    if var == "F":
-        prop = bm.properties.Water_Course_Discharge
-        if (interval.lower() in ['hour', 'h']):
-            procedure = bm.procedures.Pat4_C_B_1_HourlyMean
-        elif (interval.lower() in ['day', 'd']):
-            if (data_type in ['min', 'minimum']):
-                procedure = bm.procedures.Pat4_C_B_1_DailyMin
-            elif (data_type in ['mean', 'avg', 'average', 'av', 'a']):
-                procedure = bm.procedures.Pat4_C_B_1_DailyMean
-            elif (data_type in ['max', 'maximum']):
-                procedure = bm.procedures.Pat4_C_B_1_DailyMax        
-        elif (interval.lower() in ['month', 'm']):
-            procedure = bm.procedures.Pat4_C_B_1_MonthlyMean
-        elif (interval.lower() in ['year', 'y']):
-            procedure = bm.procedures.Pat4_C_B_1_YearlyMean
-    elif var == "L":
-        prop = bm.properties.Water_Course_Level
-        if (interval.lower() in ['hour', 'h']):
-            procedure = bm.procedures.Pat3_C_B_1_HourlyMean
-        elif (interval.lower() in ['day', 'd']):
-            if (data_type in ['min', 'minimum']):
-                procedure = bm.procedures.Pat3_C_B_1_DailyMin
-            elif (data_type in ['mean', 'avg', 'average', 'av', 'a']):
-                procedure = bm.procedures.Pat3_C_B_1_DailyMean
-            elif (data_type in ['max', 'maximum']):
-                procedure = bm.procedures.Pat3_C_B_1_DailyMax        
-        elif (interval.lower() in ['month', 'm']):
-            procedure = bm.procedures.Pat3_C_B_1_MonthlyMean
-        elif (interval.lower() in ['year', 'y']):
-            procedure = bm.procedures.Pat3_C_B_1_YearlyMean
-    elif var in ["LL", "SL"]:
-        prop = bm.properties.Storage_Level
-        if (interval.lower() in ['hour', 'h']):
-            procedure = bm.procedures.Pat7_C_B_1_HourlyMean
-        elif (interval.lower() in ['day', 'd']):
-            if (data_type in ['min', 'minimum']):
-                procedure = bm.procedures.Pat7_C_B_1_DailyMin
-            elif (data_type in ['mean', 'avg', 'average', 'av', 'a']):
-                procedure = bm.procedures.Pat7_C_B_1_DailyMean
-            elif (data_type in ['max', 'maximum']):
-                procedure = bm.procedures.Pat7_C_B_1_DailyMax        
-        elif (interval.lower() in ['month', 'm']):
-            procedure = bm.procedures.Pat7_C_B_1_MonthlyMean
-        elif (interval.lower() in ['year', 'y']):
-            procedure = bm.procedures.Pat7_C_B_1_YearlyMean
-    elif var == "SV":
-        prop = bm.properties.Storage_Volume
-        if (interval.lower() in ['hour', 'h']):
-            procedure = bm.procedures.Pat6_C_B_1_HourlyMean
-        elif (interval.lower() in ['day', 'd']):
-            if (data_type in ['min', 'minimum']):
-                procedure = bm.procedures.Pat6_C_B_1_DailyMin
-            elif (data_type in ['mean', 'avg', 'average', 'av', 'a']):
-                procedure = bm.procedures.Pat6_C_B_1_DailyMean
-            elif (data_type in ['max', 'maximum']):
-                procedure = bm.procedures.Pat6_C_B_1_DailyMax        
-        elif (interval.lower() in ['month', 'm']):
-            procedure = bm.procedures.Pat6_C_B_1_MonthlyMean
-        elif (interval.lower() in ['year', 'y']):
-            procedure = bm.procedures.Pat6_C_B_1_YearlyMean
-
-    elif var == "WT":
-        prop = bm.properties.Water_Temperature
-        if (interval.lower() in ['hour', 'h']):
-            raise NotImplementedError('Hourly data not available for Water Temp')
-        elif (interval.lower() in ['day', 'd']):
-            if (data_type in ['min', 'minimum']):
-                procedure = bm.procedures.Pat1_C_B_1_DailyMin
-            elif (data_type in ['mean', 'avg', 'average', 'av', 'a']):
-                procedure = bm.procedures.Pat1_C_B_1_DailyMean
-            elif (data_type in ['max', 'maximum']):
-                procedure = bm.procedures.Pat1_C_B_1_DailyMax
-        elif (interval.lower() in ['month', 'm']):
-            procedure = bm.procedures.Pat1_C_B_1_MonthlyMean
-        elif (interval.lower() in ['year', 'y']):
-            procedure = bm.procedures.Pat1_C_B_1_YearlyMean
-
-    elif var == "P":
-        prop = bm.properties.Rainfall
-        if (interval.lower() in ['hour', 'h']):
-            raise NotImplementedError('Hourly data not available for Precipitation')
-        elif (interval.lower() in ['day', 'd']):
-            procedure = bm.procedures.Pat2_C_B_1_DailyTot09
-        elif (interval.lower() in ['month', 'm']):
-            procedure = bm.procedures.Pat2_C_B_1_MonthlyTot24
-        elif (interval.lower() in ['year', 'y']):
-            procedure = bm.procedures.Pat2_C_B_1_YearlyTot24
-
-    elif var == "DO":
-            raise AttributeError("Var 'DO' not available on the BoM API")
-
-    return prop, procedure
+    prop, procedure = bom_procedure(var, interval, data_type)
+    return getattr(bm.properties, prop), getattr(bm.procedures, procedure)
+
+def bom_values(ts: pd.DataFrame, var: str) -> pd.Series:
+    '''
+    Selects the value column of a parsed BOM series for `var`, converting flow from cumecs
+    to ML/day.
+    '''
+    if var.lower() == "f":
+        return 86.4*ts["Value[cumec]"] # Converting it from Cumec to ML/day
+    elif var.lower() in ['l', 'll', 'sl']:
+        return ts["Value[m]"]
+    elif var.lower() == 'sv':
+        return ts["Value[Ml]"]
+    elif var.lower() == 'wt':
+        return ts["Value[°C]"]
+    elif var.lower() == 'p':
+        return ts["Value[mm]"]
+    raise AttributeError(f"Var '{var}' not available on the BoM API")
+
+
+def local_days(index: pd.DatetimeIndex) -> np.ndarray:
+    '''
+    Truncates timestamps to the day in their own (local) timezone, as `fixdate` does, returning
+    naive datetime64 values.
+    '''
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.normalize().to_numpy()
+
+
+def local_times(index: pd.DatetimeIndex) -> np.ndarray:
+    '''
+    Converts timestamps to `TIMESTAMP_TIMEZONE` at full resolution, returning naive
+    datetime64 values. Naive timestamps are taken to be in that zone already.
+    '''
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_convert(TIMESTAMP_TIMEZONE).tz_localize(None)
+    return index.to_numpy(dtype='datetime64[ns]')
+
+
+def source_times(index: pd.DatetimeIndex, context: Optional[PullContext] = None) -> np.ndarray:
+    '''
+    Timestamps of a BOM or Aquarius series as the pull's `timestamps` mode asks.
+    '''
+    context = context or PullContext()
+    return local_times(index) if context.timestamps == 'datetime' else local_days(index)
+
+
+def bom_times(index: pd.DatetimeIndex) -> pd.DatetimeIndex:
+    '''
+    The timestamps of a parsed BOM series as UTC. `bom_water.parse_get_data` returns naive UTC
+    timestamps, which `local_times` would otherwise take to be local already.
+    '''
+    index = pd.DatetimeIndex(index)
+    return index.tz_localize('UTC') if index.tz is None else index
+
+
+def bom_quality(ts: pd.DataFrame, context: Optional[PullContext] = None) -> pd.DataFrame:
+    '''
+    Drops rows of a parsed BOM series whose quality code the pull's policy rejects.
+    '''
+    context = context or PullContext()
+    if ts.empty or context.quality.allowed('BOM') is None:
+        return ts
+    codes = pd.to_numeric(ts["Quality"], errors='coerce').fillna(-1).to_numpy(dtype='int64')
+    return ts[context.quality.mask('BOM', codes)]
+
+
+def bom_columns(gauge: str, ts: pd.DataFrame, var: str,
+                context: Optional[PullContext] = None) -> Dict[str, np.ndarray]:
+    '''
+    Converts a parsed BOM series into a columnar batch.
+    '''
+    context = context or PullContext()
+    ts = bom_quality(ts, context)
+    n = len(ts)
+    if not n:
+        return {}
+    return make_batch('BOM', np.full(n, gauge, dtype=object),
+                      source_times(bom_times(ts.index), context),
+                      bom_values(ts, var).to_numpy(dtype='float64'), ts["Quality"].to_numpy())
+
 
 def gauge_pull_bom(gauge_numbers: List[str], start_time_user: datetime.date, end_time_user: datetime.date,
-               var: str = 'F', interval: str = 'day', data_type: str = 'mean') -> pd.DataFrame:
+               var: str = 'F', interval: str = 'day', data_type: str = 'mean', sink=None,
+               context: Optional[PullContext] = None) -> pd.DataFrame:
     '''
     Given a list of gauge numbers, breaks the list into individual gauges, and uses BomWater to get data, 
     returning as a Pandas dataframe object in a gauge getter format.
+
+    With a `sink`, each gauge's series is passed to `sink` as a columnar batch instead, and the
+    row count of each non-empty batch is returned.
     '''
     bm = bom_water.BomWater()
     
@@ -473,125 +853,627 @@ def gauge_pull_bom(gauge_numbers: List[str], start_time_user: datetime.date, end
     # t_end = "2030-12-31T00:00:00+10"
     collect=[]
     for gauge in gauge_numbers:
-        response = bm.request(bm.actions.GetObservation, gauge, prop, procedure, t_begin, t_end)
-        # response_json = bm.xml_to_json(response.text)  
-        ts = bm.parse_get_data(response)
-        if ts.empty:
-            ts = pd.DataFrame(columns=["DATASOURCEID","SITEID",	"SUBJECTID", "DATETIME", "VALUE", "QUALITYCODE"])
-            collect.append(ts)
+        def fetch(gauge=gauge):
+            response = bm.request(bm.actions.GetObservation, gauge, prop, procedure, t_begin, t_end)
+            # response_json = bm.xml_to_json(response.text)  
+            return bm.parse_get_data(response)
+        ts = coalesced(('bom', gauge, prop, procedure, t_begin, t_end), fetch)
+        batch = bom_columns(gauge, ts, var, context)
+        if not batch_len(batch):
+            continue
+        if sink is not None:
+            sink(batch)
+            collect.append(batch_len(batch))
         else:
-            # move to format DATASOURCEID	SITEID	SUBJECTID	DATETIME	VALUE	QUALITYCODE
-            ts["DATASOURCEID"] = "BOM"
-            ts["SITEID"] = gauge
-            ts["SUBJECTID"] = "WATER"
-            ts["DATETIME"] = ts.index.to_pydatetime()
-            ts["DATETIME"] = pd.to_datetime(ts["DATETIME"])
-            ts["DATETIME"] = ts["DATETIME"].apply(fixdate)
-            if var.lower() == "f":
-                ts["VALUE"] = 86.4*ts["Value[cumec]"] # Converting it from Cumec to ML/day
-            elif var.lower() in ['l', 'll', 'sl']:
-                ts["VALUE"] = ts["Value[m]"]
-            elif var.lower() == 'sv':
-                ts["VALUE"] = ts["Value[Ml]"]
-            elif var.lower() == 'wt':
-                ts["VALUE"] = ts["Value[°C]"]
-            elif var.lower() == 'p':
-                ts["VALUE"] = ts["Value[mm]"]
-            ts["QUALITYCODE"] = ts["Quality"]
-            ts.reset_index(drop=True, inplace=True)
-            collect.append(ts[["DATASOURCEID","SITEID",	"SUBJECTID", "DATETIME", "VALUE", "QUALITYCODE"]])
-            log.info(f'BOM Data DF: {collect}')
-
-    output = pd.concat(collect)
-    # log.info(f'BOM Data DF: {output}')
-    output = output.values.tolist()
-    # log.info(f'BOM Data Dict: {output}')
-    return output
+            collect += batch_rows(batch)
+    return collect
+
+def aquarius_url(gauge_numbers: List[str], start_time_user: datetime.date,
+                 end_time_user: datetime.date) -> str:
+    '''
+    Builds one Aquarius BulkExportJson request covering every gauge in `gauge_numbers`, one
+    `Datasets[i]` entry each.
+    '''
+    head =f"https://{get_source('SA').host}/Export/BulkExportJson?"
+    times ="DateRange=Custom&StartTime=" +start_time_user.strftime('%Y-%m-%d') +"&EndTime="+end_time_user.strftime('%Y-%m-%d') +"&TimeZone=9.5"
+    datasets = ""
+    for i, gauge in enumerate(gauge_numbers):
+        label = AQUARIUS_DATASET_LABELS.get(gauge, AQUARIUS_DEFAULT_LABEL).replace(' ', '%20')
+        datasets += f"&Datasets[{i}].DatasetName={label}%40{gauge}" \
+                    f"&Datasets[{i}].Calculation=Instantaneous&Datasets[{i}].UnitId=241"
+    format = "&ExportFormat=json"
+    return head + times + datasets + format
+
+
+def aquarius_columns(data: Dict[str, Any],
+                     context: Optional[PullContext] = None) -> Dict[str, np.ndarray]:
+    '''
+    Converts a BulkExportJson response, whose rows hold one point per dataset, into a
+    columnar batch with one row per dataset and timestamp, ordered by dataset. Points
+    without a value are left out. Raises ValueError if any row's points do not line up with
+    the datasets.
+    '''
+    context = context or PullContext()
+    datasets = data['Datasets']
+    rows = data['Rows']
+    n, k = len(rows), len(datasets)
+    points = [point for row in rows for point in row['Points']]
+    if len(points) != n * k:
+        raise ValueError(f'Aquarius export has {len(points)} points for {n} rows of {k} datasets')
+    # (timestamps, datasets) matrices, transposed so each dataset's values are contiguous
+    values = to_float([point.get('Value') for point in points]).reshape(n, k).T.ravel()
+    present = np.fromiter(('Value' in point for point in points), dtype=bool,
+                          count=n * k).reshape(n, k).T.ravel()
+    stamps = pd.Series([row['Timestamp'] for row in rows], dtype=object)
+    days = source_times(pd.to_datetime(stamps, utc=context.timestamps == 'datetime'), context)
+    sites = np.repeat(np.array([d['LocationIdentifier'] for d in datasets], dtype=object), n)
+    units = np.repeat(np.array([d['Unit'] for d in datasets], dtype=object), n)
+    return make_batch('SA', sites[present], np.tile(days, k)[present], values[present],
+                      units[present])
+
 
 def gauge_pull_aq(gauge_numbers: List[str], start_time_user: datetime.date, end_time_user: datetime.date,
-               var: str = 'F', interval: str = 'day', data_type: str = 'mean') -> pd.DataFrame:
+               var: str = 'F', interval: str = 'day', data_type: str = 'mean', sink=None,
+               context: Optional[PullContext] = None) -> pd.DataFrame:
+    '''
+    Pulls SA barrage flows from the Aquarius bulk export, requesting up to the SA source's
+    `max_sites_per_request` gauges in each export. An export whose rows do not hold one point
+    per dataset is requested again one dataset at a time. The export carries no quality codes
+    (QUALITYCODE holds the unit), so quality policies do not apply to these rows.
+    '''
 
     log.info(f'AQ gaugepull')
     extracted_gauge=[]
-    for gauge in  gauge_numbers:
-        head ="https://water.data.sa.gov.au/Export/BulkExportJson?"
-        times ="DateRange=Custom&StartTime=" +start_time_user.strftime('%Y-%m-%d') +"&EndTime="+end_time_user.strftime('%Y-%m-%d') +"&TimeZone=9.5"
-        dataset = "&Datasets[0].DatasetName=Discharge.Total%20barrage%20flow%40"+gauge
-        format = "&ExportFormat=json"
-        code = "&Datasets[0].Calculation=Instantaneous&Datasets[0].UnitId=241"
-
-        url = head+ times + dataset + format +code
+    gauge_numbers = list(dict.fromkeys(gauge_numbers))
+
+    def export(gauges: List[str]) -> Dict[str, Any]:
+        url = aquarius_url(gauges, start_time_user, end_time_user)
         log.info(url)
+        return coalesced(('aquarius', url), lambda: get_session().get(url).json())
+
+    for gauges in split_into_chunks(gauge_numbers, get_source('SA').max_sites_per_request):
+        data = export(gauges)
+        try:
+            batches = [aquarius_columns(data, context)]
+        except ValueError as e:
+            if len(gauges) == 1:
+                raise
+            # Rows whose points cannot be matched to datasets: ask for each dataset alone
+            log.warning(f'{e}, requesting its datasets one at a time')
+            batches = [aquarius_columns(export([gauge]), context) for gauge in gauges]
+
+        for batch in batches:
+            if sink is not None:
+                if batch_len(batch):
+                    sink(batch)
+                    extracted_gauge.append(batch_len(batch))
+                continue
+            extracted_gauge += batch_rows(batch)
+    return extracted_gauge
+
+def route_gauges(gauge_numbers: List[str], data_source: str = 'state') -> Dict[str, List[str]]:
+    '''
+    Resolves which endpoints each gauge will be requested from. SA gauges, and every gauge when
+    `data_source` is 'bom', are routed to BOM.
+    '''
+    gauges_by_state = sort_gauges_by_state(gauge_numbers)
+
+    if data_source.lower() == 'bom':
+        gauges_by_state = {'NSW': [], 'QLD': [], 'VIC': [], 'SA': [], 'rest': [],'BOM': gauge_numbers}
+    elif gauges_by_state['SA']:
+        gauges_by_state['BOM'] = gauges_by_state['SA']
+    return gauges_by_state
 
-        x = requests.get(url)
 
-        data = x.json()
+class VarPull:
+    '''
+    One variable's share of a pull: the batches of gauges to ask of each registered source
+    (see `sources`), after the pull's routing table and negative cache have had their say.
+    Tasks from `tasks` are run (on any thread) with `run`, and their results handed back, in
+    task order, to `finish`.
+    '''
 
-        extracted = []
-        for row in data['Rows']:
-            obsdate = datetime.datetime.strptime(str(row['Timestamp']), '%Y-%m-%dT%H:%M:%S%z').date()
-            objRow = ["SA", data["Datasets"][0]["LocationIdentifier"], 'WATER', obsdate, row["Points"][0]["Value"], data["Datasets"][0]["Unit"]]
-            extracted.append(objRow)
-        extracted_gauge.extend(extracted)
-    return extracted_gauge
+    def __init__(self, gauges_by_state: Dict[str, List[str]], start_time_user: datetime.date,
+                 end_time_user: datetime.date, var: str, interval: str, data_type: str,
+                 sink=None, context: Optional[PullContext] = None,
+                 lock: Optional[threading.Lock] = None) -> None:
+        self.gauges_by_state = dict(gauges_by_state)
+        self.args = (start_time_user, end_time_user, var, interval, data_type)
+        self.routing = context.routing if context is not None else None
+        self.probe = None
+        self.context = context
+        if self.routing is not None:
+            self.gauges_by_state = self.routing.apply(self.gauges_by_state, var, interval)
+            if sink is not None:
+                sink = self.routing.recording(sink, var, interval)
+        if context is not None and context.negative is not None:
+            self.probe = context.negative.probe(var, interval, start_time_user, end_time_user,
+                                                context.quality.policy)
+            if sink is not None:
+                sink = self.probe.recording(sink)
+        if sink is not None and lock is not None:
+            sink = locked(sink, lock)
+        self.opts: Dict[str, Any] = {} if sink is None else {'sink': sink}
+        if context is not None:
+            self.opts['context'] = context
+
+    def ask(self, source: str, gauges: List[str]) -> List[str]:
+        return gauges if self.probe is None else self.probe.ask(source, gauges)
+
+    def tasks(self) -> List[Tuple[Any, List[str]]]:
+        '''
+        (source, sites) pairs, one per request, in source registration order.
+        '''
+        from .sources import sources # pylint: disable=import-outside-toplevel
+        var, interval, data_type = self.args[2:]
+        tasks = []
+        for source in sources():
+            gauges = source.route(self.gauges_by_state)
+            if not gauges:
+                continue
+            if not source.supports(var, interval, data_type):
+                log.warning(f'{source.name} does not serve \'{var}\' at {interval} {data_type}, '
+                            f'skipping {gauges}')
+                continue
+            tasks += [(source, sites) for sites in source.batches(self.ask(source.name, gauges))]
+        return tasks
+
+    def run(self, source: Any, sites: List[str]) -> List[Any]:
+        from .sources import fetch_with_fallback # pylint: disable=import-outside-toplevel
+        return fetch_with_fallback(source, sites, *self.args, ask=self.ask, **self.opts)
+
+    def finish(self, results: List[List[Any]]) -> List[Any]:
+        '''
+        Joins the task results, learning routes and recording empty gauges from them.
+        '''
+        var, interval = self.args[2:4]
+        data = [row for result in results for row in result]
+        if self.routing is not None:
+            if 'sink' not in self.opts:
+                self.routing.learn(((row[1], row[0]) for row in data), var, interval)
+            self.routing.save()
+        if self.probe is not None:
+            if 'sink' not in self.opts:
+                self.probe.observe((row[0], row[1]) for row in data)
+            for source, count in self.probe.finish().items():
+                self.context.skipped[source] = self.context.skipped.get(source, 0) + count
+        return data
+
+
+def locked(sink, lock: threading.Lock):
+    '''
+    Wraps a batch sink so that batches from concurrent requests are passed on one at a time.
+    '''
+    def serialised(batch, **constants):
+        with lock:
+            return sink(batch, **constants)
+    return serialised
 
-def gauge_pull(gauge_numbers: List[str], start_time_user: datetime.date, end_time_user: datetime.date,
-               var: str = 'F', interval: str = 'day', data_type: str = 'mean', data_source: str = 'state') -> pd.DataFrame:
+
+def run_pulls(pulls: List[VarPull]) -> List[List[Any]]:
     '''
-    Given a list of gauge numbers, sorts the list into state groups, and queries relevant
-    HTTP endpoints for data, returning as a Pandas dataframe object.
+    Runs the requests of every pull together on up to `PULL_WORKERS` threads, each within its
+    source's rate limits, and returns each pull's result.
+    '''
+    from .sources import schedule # pylint: disable=import-outside-toplevel
+    tasks = [(pull, source, sites) for pull in pulls for source, sites in pull.tasks()]
+    results = schedule(tasks, lambda task: task[1], lambda task: task[0].run(task[1], task[2]),
+                       workers=PULL_WORKERS)
+    return [pull.finish([result for task, result in zip(tasks, results) if task[0] is pull])
+            for pull in pulls]
+
+
+def pull_var(gauges_by_state: Dict[str, List[str]], start_time_user: datetime.date,
+             end_time_user: datetime.date, var: str = 'F', interval: str = 'day',
+             data_type: str = 'mean', sink=None,
+             context: Optional[PullContext] = None) -> List[Any]:
     '''
+    Queries every registered source (see `sources`) for its gauges in `gauges_by_state` (as
+    returned by `route_gauges`) for a single variable. A request which returns nothing is
+    put to the source's fallback (BOM, for the state portals).
+
+    Returns rows, or with a `sink`, passes columnar batches to it as they arrive (see
+    `process_gauge_pull`). With a routing table in `context`, gauges with a known source are
+    sent only there, and the sources which return data are learned. With a negative cache,
+    gauges known to have no data at a source over the window are not asked of it.
+    '''
+    pull = VarPull(gauges_by_state, start_time_user, end_time_user, var, interval, data_type,
+                   sink, context, threading.Lock())
+    return run_pulls([pull])[0]
+
+
+def pull_vars(gauges_by_state: Dict[str, List[str]], start_time_user: datetime.date,
+              end_time_user: datetime.date, var_list: List[str], interval: str = 'day',
+              data_type: str = 'mean', sinks: Optional[Dict[str, Any]] = None,
+              context: Optional[PullContext] = None) -> List[List[Any]]:
+    '''
+    Pulls each variable in `var_list` as `pull_var` does, with the requests of every variable
+    scheduled together, and returns each variable's rows in `var_list` order. A variable with
+    a sink in `sinks` has its batches passed to it instead, one batch at a time whichever
+    variable it belongs to.
+    '''
+    lock = threading.Lock()
+    sinks = sinks or {}
+    return run_pulls([VarPull(gauges_by_state, start_time_user, end_time_user, v, interval,
+                              data_type, sinks.get(v), context, lock) for v in var_list])
+
+
+def to_wide(long_frame: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Pivots a long multi-variable frame (with a VAR column) into one row per site and date,
+    with VALUE_<var>, QUALITYCODE_<var> and DATASOURCEID_<var> columns for each variable, as
+    one site's variables may come from different sources (e.g. flow from a state portal and
+    level from BOM).
+    '''
+    keys = ['SITEID', 'SUBJECTID', 'DATETIME']
+    grouped = long_frame.groupby(keys + ['VAR'], sort=False, observed=True)[
+        ['VALUE', 'QUALITYCODE', 'DATASOURCEID']].first()
+    wide = grouped.unstack('VAR')
+    wide.columns = [f'{col}_{var}' for col, var in wide.columns]
+    return wide.reset_index()
+
+
+def pull_batches(gauges_by_state: Dict[str, List[str]], start_time_user: datetime.date,
+                 end_time_user: datetime.date, var: Union[str, List[str]], interval: str,
+                 data_type: str, append, context: Optional[PullContext] = None) -> None:
+    '''
+    Pulls every variable in `var`, passing columnar batches to `append` as they arrive. For
+    multi-variable pulls each batch is tagged with a VAR column.
+    '''
+    if isinstance(var, str):
+        pull_var(gauges_by_state, start_time_user, end_time_user, var, interval, data_type,
+                 sink=append, context=context)
+        return
+    var_list = list(dict.fromkeys(var))
+    log.info(f'Requesting vars {var_list}')
+    pull_vars(gauges_by_state, start_time_user, end_time_user, var_list, interval, data_type,
+              sinks={v: lambda batch, v=v: append(batch, VAR=v) for v in var_list},
+              context=context)
+
+
+def index_by_time(frame: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Makes DATETIME timezone-aware (`TIMESTAMP_TIMEZONE`) and returns the frame sorted and
+    indexed by (SITEID, DATETIME), so one site's time range is a fast `.loc` slice.
+    '''
+    frame = frame.copy()
+    frame['DATETIME'] = pd.DatetimeIndex(frame['DATETIME']).tz_localize(TIMESTAMP_TIMEZONE)
+    keys = ['SITEID', 'DATETIME'] + (['VAR'] if 'VAR' in frame.columns else [])
+    return frame.sort_values(keys, kind='stable').set_index(['SITEID', 'DATETIME'])
 
+
+def pull_timestamped(gauges_by_state: Dict[str, List[str]], start_time_user: datetime.date,
+                     end_time_user: datetime.date, var: Union[str, List[str]], interval: str,
+                     data_type: str, var_format: str,
+                     context: Optional[PullContext] = None) -> pd.DataFrame:
+    '''
+    Full-resolution variant of the `gauge_pull` body, see `timestamps` in `gauge_pull`. Every
+    source is extracted to columnar batches, which are joined without building row lists.
+    '''
+    batches: List[Dict[str, np.ndarray]] = []
+
+    def append(batch, **constants):
+        n = batch_len(batch)
+        if n:
+            batches.append({**batch, **{name: np.full(n, value, dtype=object)
+                                        for name, value in constants.items()}})
+
+    pull_batches(gauges_by_state, start_time_user, end_time_user, var, interval, data_type,
+                 append, context)
+    columns = DATA_COLUMNS if isinstance(var, str) else \
+        DATA_COLUMNS[:3] + ['VAR'] + DATA_COLUMNS[3:]
+    flow_data_frame = pd.DataFrame({name: np.concatenate([b[name] for b in batches])
+                                    if batches else [] for name in columns}, columns=columns)
+    if not isinstance(var, str) and var_format == 'wide':
+        flow_data_frame = to_wide(flow_data_frame)
+    return index_by_time(flow_data_frame)
+
+
+def pull_bounded(gauges_by_state: Dict[str, List[str]], start_time_user: datetime.date,
+                 end_time_user: datetime.date, var: Union[str, List[str]], interval: str,
+                 data_type: str, var_format: str, max_memory: Union[int, str],
+                 sink=None, context: Optional[PullContext] = None) -> Union[pd.DataFrame, int]:
+    '''
+    Memory-bounded variant of the `gauge_pull` body, see `max_memory` in `gauge_pull`.
+    '''
+    with SpillBuffer(max_memory, sink=sink) as buffer:
+        pull_batches(gauges_by_state, start_time_user, end_time_user, var, interval, data_type,
+                     buffer.append, context)
+        log.info(f'Bounded pull complete: {buffer.stats()}')
+        flow_data_frame = buffer.result()
+    if flow_data_frame is None:
+        return buffer.rows
+    if not isinstance(var, str):
+        flow_data_frame = flow_data_frame.reindex(columns=DATA_COLUMNS[:3] + ['VAR'] + DATA_COLUMNS[3:])
+        if var_format == 'wide':
+            return to_wide(flow_data_frame)
+    return flow_data_frame
+
+
+def pull_arrow(gauges_by_state: Dict[str, List[str]], start_time_user: datetime.date,
+               end_time_user: datetime.date, var: Union[str, List[str]], interval: str,
+               data_type: str, context: Optional[PullContext] = None) -> Any:
+    '''
+    Arrow variant of the `gauge_pull` body, see `output` in `gauge_pull`.
+    '''
+    builder = ArrowBuilder()
+    pull_batches(gauges_by_state, start_time_user, end_time_user, var, interval, data_type,
+                 builder.append, context)
+    return builder.result(var_column=not isinstance(var, str))
+
+
+def pull_matrix(gauge_numbers: List[str], gauges_by_state: Dict[str, List[str]],
+                start_time_user: datetime.date, end_time_user: datetime.date,
+                var: Union[str, List[str]], interval: str, data_type: str,
+                context: Optional[PullContext] = None) -> Any:
+    '''
+    Dense variant of the `gauge_pull` body, see `output` in `gauge_pull`.
+    '''
+    variables = [var] if isinstance(var, str) else list(dict.fromkeys(var))
+    builder = MatrixBuilder(gauge_numbers, start_time_user, end_time_user, interval, variables)
+    pull_batches(gauges_by_state, start_time_user, end_time_user, var, interval, data_type,
+                 builder.append, context)
+    if builder.unplaced:
+        log.warning(f'{builder.unplaced} values fell outside the matrix axes and were dropped')
+    return builder.result()
+
+
+def pull_var_stored(gauge_numbers: List[str], start_time_user: datetime.date,
+                    end_time_user: datetime.date, var: str, interval: str, data_type: str,
+                    data_source: str, store: Any, derive: bool,
+                    context: Optional[PullContext] = None) -> pd.DataFrame:
+    '''
+    Serves one variable from `store` where it holds the whole window, then (with `derive`,
+    for windows of whole periods) by resampling finer series it holds, and pulls the
+    remaining gauges upstream, writing what they return back to the store. Gauges which
+    return nothing are not recorded as covered, so they are asked again by later pulls.
+    Series are stored under the pull's quality policy. With `derive`, a DERIVED column names
+    the series ('<interval>:<data_type>') each derived value was computed from, and is None
+    otherwise.
+    '''
+    sites = list(dict.fromkeys(str(g) for g in gauge_numbers))
+    quality = context.quality.policy if context is not None else None
+    held, covered = store.read(sites, start_time_user, end_time_user, var, interval, data_type,
+                               data_source, quality)
+    parts = [held.assign(DERIVED=None)] if derive else [held]
+    remaining = [site for site in sites if site not in covered]
+    log.info(f'Store holds var \'{var}\' for {len(covered)} of {len(sites)} gauges')
+
+    if derive and not whole_periods(start_time_user, end_time_user, interval):
+        log.info(f'Not deriving {interval} values: {start_time_user} to {end_time_user} is not '
+                 f'a whole number of periods')
+    elif derive:
+        for source_interval, source_type in derivation_sources(interval, data_type):
+            if not remaining:
+                break
+            finer, found = store.read(remaining, start_time_user, end_time_user, var,
+                                      source_interval, source_type, data_source, quality)
+            if not found:
+                continue
+            log.info(f'Deriving {interval} {data_type} for {len(found)} gauges from stored '
+                     f'{source_interval} {source_type} values')
+            parts.append(resample(finer, interval, data_type)
+                         .assign(DERIVED=f'{source_interval}:{source_type}'))
+            remaining = [site for site in remaining if site not in found]
+
+    if remaining:
+        rows = pull_var(route_gauges(remaining, data_source), start_time_user, end_time_user,
+                        var, interval, data_type, context=context)
+        fetched = pd.DataFrame(data=rows, columns=DATA_COLUMNS)
+        returned = set(fetched['SITEID'].astype(str))
+        store.write(fetched, [site for site in remaining if site in returned], start_time_user,
+                    end_time_user, var, interval, data_type, data_source, quality)
+        parts.append(fetched.assign(DERIVED=None) if derive else fetched)
+
+    columns = DATA_COLUMNS + ['DERIVED'] if derive else DATA_COLUMNS
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True)[columns]
+
+
+def pull_stored(gauge_numbers: List[str], start_time_user: datetime.date,
+                end_time_user: datetime.date, var: Union[str, List[str]], interval: str,
+                data_type: str, data_source: str, var_format: str, store: Any, derive: bool,
+                context: Optional[PullContext] = None) -> pd.DataFrame:
+    '''
+    Store-backed variant of the `gauge_pull` body, see `store` in `gauge_pull`.
+    '''
+    if isinstance(var, str):
+        return pull_var_stored(gauge_numbers, start_time_user, end_time_user, var, interval,
+                               data_type, data_source, store, derive, context)
+    frames = []
+    for v in dict.fromkeys(var):
+        frame = pull_var_stored(gauge_numbers, start_time_user, end_time_user, v, interval,
+                                data_type, data_source, store, derive, context)
+        frame.insert(3, 'VAR', v)
+        frames.append(frame)
+    flow_data_frame = pd.concat(frames, ignore_index=True)
+    if var_format == 'wide':
+        return to_wide(flow_data_frame)
+    return flow_data_frame
+
+
+def resolve_gauges(gauge_numbers: Optional[Union[str, List[str]]],
+                   region: Optional[Dict[str, Any]] = None) -> List[str]:
+    '''
+    Returns the gauges a pull covers: `gauge_numbers`, or every gauge in `region`.
+    '''
+    if region is not None:
+        if gauge_numbers:
+            raise ValueError('Pass either gauge_numbers or region, not both')
+        gauge_numbers = gauge_index().region(region)
+        log.info(f'Region resolved to {len(gauge_numbers)} gauges')
     if isinstance(gauge_numbers, str):
         gauge_numbers=[gauge_numbers]
+    return gauge_numbers
 
-    gauges_by_state = sort_gauges_by_state(gauge_numbers)
-    
 
-    if data_source.lower() == 'bom':
-        gauges_by_state = {'NSW': [], 'QLD': [], 'VIC': [], 'SA': [], 'rest': [],'BOM': gauge_numbers}
-    elif gauges_by_state['SA']:
-        gauges_by_state['BOM'] = gauges_by_state['SA']
+def with_report(result: Any, context: PullContext) -> Any:
+    '''
+    Logs the pull's report and attaches it to the result's `attrs` (DataFrame) or schema
+    metadata (Arrow table). Row counts returned in sink mode are passed through unchanged.
+    '''
+    report = context.report()
+    if not report:
+        return result
+    log.info(f'Pull report: {report}')
+    if hasattr(result, 'attrs'):
+        result.attrs.update(report)
+    elif hasattr(result, 'replace_schema_metadata'):
+        metadata = dict(result.schema.metadata or {})
+        metadata.update({key.encode(): json.dumps(value).encode() for key, value in report.items()})
+        result = result.replace_schema_metadata(metadata)
+    return result
+
+
+def gauge_pull(gauge_numbers: List[str], start_time_user: datetime.date, end_time_user: datetime.date,
+               var: Union[str, List[str]] = 'F', interval: str = 'day', data_type: str = 'mean',
+               data_source: str = 'state', var_format: str = 'long',
+               max_memory: Optional[Union[int, str]] = None, sink=None,
+               output: str = 'pandas', region: Optional[Dict[str, Any]] = None,
+               quality: Any = None, dry_run: bool = False,
+               decode_processes: Optional[int] = None, store: Any = None,
+               derive: bool = False, routing: Any = None,
+               negative_cache: Any = None, timestamps: str = 'date') -> pd.DataFrame:
+    '''
+    Given a list of gauge numbers, sorts the list into state groups, and queries relevant
+    HTTP endpoints for data, returning as a Pandas dataframe object.
+
+    `var` may also be a list of variables (e.g. `['F', 'L', 'SV']`). Gauges are then routed once
+    and the requests for every variable are scheduled together. The result is either long, with
+    a VAR column (`var_format='long'`), or one row per site and date with VALUE_<var>,
+    QUALITYCODE_<var> and DATASOURCEID_<var> columns (`var_format='wide'`).
+
+    `max_memory` (bytes, or a string such as '512MB') bounds memory use for large pulls.
+    Responses are extracted straight to columnar batches, spilled to compressed temporary files
+    whenever the buffered batches reach the budget, and merged once the pull completes. DATETIME
+    is then datetime64, VALUE float64, and the string columns categorical. With a `sink` (a
+    callable taking a DataFrame) each spilled part is handed to it instead, nothing is merged,
+    and the total row count is returned.
+
+    `output='arrow'` returns a `pyarrow.Table` (long format only) built directly from the
+    extracted columns: dictionary-encoded DATASOURCEID/SITEID/SUBJECTID, date32 DATETIME,
+    float64 VALUE and int64 QUALITYCODE. Requires pyarrow.
+
+    `output='matrix'` returns a `matrix.GaugeMatrix`: float64 values and int64 quality codes
+    in preallocated (variable, date, gauge) arrays, filled directly from the extracted columns
+    over a date axis covering every period of the window and a gauge axis in the order given.
+    Cells with no data are NaN, with a quality code of -1. Day, month and year intervals only.
+    `GaugeMatrix.to_xarray` and `to_netcdf` write it out as an `xarray.Dataset`, which
+    requires xarray (and a NetCDF engine such as netCDF4).
+
+    `region` may be given in place of `gauge_numbers` (pass None) to pull every catalogued gauge
+    in a bounding box, radius, nearest-k or polygon region; see `GaugeIndex.region`.
+
+    `quality` sets which quality codes to keep: a list of codes and inclusive (low, high) ranges,
+    either applied to every source or given per source in a dict keyed by 'NSW', 'VIC', 'QLD',
+    'BOM', 'state' (all Kisters portals) or 'default', e.g.
+    `{'state': [(None, 150)], 'BOM': [10, 90]}`. Rows are screened as responses are extracted,
+    and counts of dropped rows by source and code are returned in `attrs['quality_dropped']`.
+    Without a policy, Kisters codes of 999 and above are dropped and everything else is kept.
+
+    `decode_processes` moves JSON decoding and extraction of state portal responses into a
+    pool of that many processes, so parsing runs on several cores and does not hold up the
+    downloads. Batches come back dictionary-encoded as numpy buffers.
+
+    `store` (e.g. a `stores.MemoryStore`) keeps pulled series: gauges it already holds for
+    the whole window are served from it, and only the rest are pulled upstream and added to
+    it. With `derive=True`, coarser intervals and aggregates (e.g. monthly means, or monthly
+    maxima) are also computed from finer series held in the store, resampling every gauge
+    at once, and only gauges with no suitable finer series go upstream. Derived values are
+    marked in a DERIVED column. Hourly series are never resampled, as their timestamps are
+    truncated to the day.
+
+    `routing` (a `routing.RoutingTable`) sends gauges straight to the source that last
+    returned data for them, rather than to every portal their catalogue entries name, and
+    learns the source of whatever each pull returns.
+
+    `negative_cache` (a `negative_cache.NegativeCache`) remembers gauges a source returned no
+    data for over a window, and skips asking it again for that window, or any narrower one,
+    until the cache's TTL expires. Skips by source are reported in
+    `attrs['negative_cache_skipped']`.
+
+    `timestamps='datetime'` keeps every source's timestamps at full resolution (the time of
+    day of hourly and instantaneous values, which are otherwise truncated to the date). All
+    sources are converted to `TIMESTAMP_TIMEZONE`, DATETIME is a timezone-aware datetime64
+    column, and the result is sorted and indexed by (SITEID, DATETIME), e.g.
+    `df.loc['410001'].loc['2020-01-01 06:00':'2020-01-02']`. Kisters timestamps are parsed
+    with integer arithmetic rather than `strptime`. Batches passed to a `sink` hold naive
+    datetime64 values in that zone. Not supported with a `store` or `output='arrow'`.
+
+    `dry_run=True` makes no requests and returns the request plan instead, see
+    `planner.plan_gauge_pull`.
+    '''
 
+    if dry_run:
+        from .planner import plan_gauge_pull # pylint: disable=import-outside-toplevel
+        return plan_gauge_pull(gauge_numbers, start_time_user, end_time_user, var, interval,
+                               data_type, data_source, region)
+
+    gauge_numbers = resolve_gauges(gauge_numbers, region)
+    if var_format not in ('long', 'wide'):
+        raise ValueError(f"var_format takes 'long' or 'wide' only, got '{var_format}'")
+
+    if output not in ('pandas', 'arrow', 'matrix'):
+        raise ValueError(f"output takes 'pandas', 'arrow' or 'matrix' only, got '{output}'")
+    if output != 'pandas' and (var_format != 'long' or max_memory is not None):
+        raise ValueError(f"output='{output}' supports neither var_format='wide' nor max_memory")
+    if sink is not None and max_memory is None:
+        raise ValueError('sink requires max_memory to be set')
+    if store is not None and (output != 'pandas' or max_memory is not None):
+        raise ValueError("store supports output='pandas' only, without max_memory")
+    if timestamps not in TIMESTAMP_MODES:
+        raise ValueError(f"timestamps takes {TIMESTAMP_MODES}, got '{timestamps}'")
+    if timestamps == 'datetime' and (store is not None or output != 'pandas'):
+        raise ValueError("timestamps='datetime' supports output='pandas' only, without a store")
+    if derive and store is None:
+        raise ValueError('derive requires a store to derive values from')
+
+    # A routing table only narrows catalogue routing, it is not used for BOM-only pulls
+    context = PullContext(quality, decode_processes,
+                          routing if data_source.lower() != 'bom' else None, negative_cache,
+                          timestamps)
+    if store is not None:
+        return with_report(pull_stored(gauge_numbers, start_time_user, end_time_user, var,
+                                       interval, data_type, data_source, var_format, store,
+                                       derive, context), context)
+
+    gauges_by_state = route_gauges(gauge_numbers, data_source)
     # log.info(f'Gauges by state is: {gauges_by_state}')
-    data: List[List[List[Any]]] = []
-    nsw = process_gauge_pull(gauges_by_state['NSW'], 'NSW', 'CP', start_time_user,
-                               end_time_user, var, interval, data_type)
-    if not len(nsw) and len(gauges_by_state['NSW']) > 0:
-        log.warn(f'Data not available from NSW API, querying BOM...')
-        gauges_by_state['BOM'] = gauges_by_state['NSW']
-        nsw += gauge_pull_bom(gauges_by_state['BOM'], start_time_user, 
-                               end_time_user, var, interval, data_type)   
-    data += nsw
-
-    vic = process_gauge_pull(gauges_by_state['VIC'], 'VIC', 'PUBLISH', start_time_user,
-                               end_time_user, var, interval, data_type)
-    if not len(vic) and len(gauges_by_state['VIC']) > 0:
-        log.warn(f'Data not available from VIC API, querying BOM...')
-        gauges_by_state['BOM'] = gauges_by_state['VIC']
-        vic += gauge_pull_bom(gauges_by_state['BOM'], start_time_user, 
-                               end_time_user, var, interval, data_type)   
-    data += vic
-
-    qld = process_gauge_pull(gauges_by_state['QLD'], 'QLD', 'AT', start_time_user,
-                               end_time_user, var, interval, data_type)
-    if not len(qld) and len(gauges_by_state['QLD']) > 0:
-        log.warn(f'Data not available from QLD API, querying BOM...')
-        gauges_by_state['BOM'] = gauges_by_state['QLD']
-        qld += gauge_pull_bom(gauges_by_state['BOM'], start_time_user, 
-                               end_time_user, var, interval, data_type)   
-    data += qld
-    # log.info(f'State data:{data}')
-    if 'BOM' in gauges_by_state:                          
-        data += gauge_pull_bom(gauges_by_state['BOM'], start_time_user, 
-                               end_time_user, var, interval, data_type)   
-        # log.info(f'BOM data:{data}')
-    barrage_gauges=list(set(gauges_by_state["rest"]) & BARRAGE_GAUGES)
-    if barrage_gauges:
-        data += gauge_pull_aq(barrage_gauges, start_time_user, 
-                               end_time_user, var, interval, data_type)
-   
-    cols = ['DATASOURCEID', 'SITEID', 'SUBJECTID', 'DATETIME', 'VALUE', 'QUALITYCODE']
-    flow_data_frame = pd.DataFrame(data=data, columns=cols)
 
-    return flow_data_frame
+    if output == 'arrow':
+        return with_report(pull_arrow(gauges_by_state, start_time_user, end_time_user, var,
+                                      interval, data_type, context), context)
+    if output == 'matrix':
+        return with_report(pull_matrix(gauge_numbers, gauges_by_state, start_time_user,
+                                       end_time_user, var, interval, data_type, context),
+                           context)
+    if max_memory is not None:
+        result = pull_bounded(gauges_by_state, start_time_user, end_time_user, var, interval,
+                              data_type, var_format, max_memory, sink, context)
+        if timestamps == 'datetime' and sink is None:
+            result = index_by_time(result)
+        return with_report(result, context)
+    if timestamps == 'datetime':
+        return with_report(pull_timestamped(gauges_by_state, start_time_user, end_time_user,
+                                            var, interval, data_type, var_format, context),
+                           context)
+
+    if isinstance(var, str):
+        data = pull_var(gauges_by_state, start_time_user, end_time_user, var, interval, data_type,
+                        context=context)
+        flow_data_frame = pd.DataFrame(data=data, columns=DATA_COLUMNS)
+        return with_report(flow_data_frame, context)
+
+    var_list = list(dict.fromkeys(var))
+    log.info(f'Requesting vars {var_list}')
+    data = []
+    for v, rows in zip(var_list, pull_vars(gauges_by_state, start_time_user, end_time_user,
+                                           var_list, interval, data_type, context=context)):
+        data += [row[:3] + [v] + row[3:] for row in rows]
+    cols = DATA_COLUMNS[:3] + ['VAR'] + DATA_COLUMNS[3:]
+    flow_data_frame = pd.DataFrame(data=data, columns=cols)
+    if var_format == 'wide':
+        return with_report(to_wide(flow_data_frame), context)
+    return with_report(flow_data_frame, context)
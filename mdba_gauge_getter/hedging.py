@@ -0,0 +1,159 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Optional
+
+
+log = logging.getLogger(__name__)
+
+
+class HostLatency:
+    '''
+    Recent request latencies and hedge counts for one host.
+    '''
+
+    def __init__(self, window: int) -> None:
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class RequestHedger:
+    '''
+    Sends a duplicate of a request which has been running longer than its host usually takes,
+    and uses whichever copy answers first.
+
+    The delay before hedging is the `percentile` of the host's last `window` latencies (at
+    least `min_delay` seconds), once `min_samples` have been seen. Hedges per host are capped
+    at `budget` times its requests, so hedging never adds more than that fraction of load.
+    Given the host's rate limiter, a duplicate is only sent if it can take a free slot at
+    once, and holds it until it finishes. A duplicate still queued when the first copy answers is cancelled; one already sent
+    cannot be interrupted, and its response is discarded.
+    '''
+
+    def __init__(self, percentile: float = 0.95, budget: float = 0.05, min_samples: int = 20,
+                 min_delay: float = 0.5, window: int = 200, max_workers: int = 32) -> None:
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.window = window
+        self._hosts: Dict[str, HostLatency] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix='gauge-hedge')
+
+    def _host(self, host: str) -> HostLatency:
+        if host not in self._hosts:
+            self._hosts[host] = HostLatency(self.window)
+        return self._hosts[host]
+
+    def delay(self, host: str) -> Optional[float]:
+        '''
+        Seconds to wait before hedging a request to `host`, or None while too few of its
+        latencies have been seen.
+        '''
+        with self._lock:
+            latency = self._host(host)
+            if len(latency.samples) < self.min_samples:
+                return None
+            return max(latency.percentile(self.percentile), self.min_delay)
+
+    def _timed(self, host: str, fn: Callable[[], Any]) -> Any:
+        started = time.monotonic()
+        result = fn()
+        with self._lock:
+            self._host(host).samples.append(time.monotonic() - started)
+        return result
+
+    def _may_hedge(self, host: str, limiter: Any = None) -> bool:
+        with self._lock:
+            latency = self._host(host)
+            if latency.hedged + 1 > self.budget * latency.requests:
+                return False
+            # Hedges give way to any request waiting on the host's limits
+            if limiter is not None and not limiter.acquire(background=True, blocking=False):
+                return False
+            latency.hedged += 1
+            return True
+
+    def call(self, host: str, fn: Callable[[], Any], limiter: Any = None) -> Any:
+        '''
+        Returns `fn()`, hedged with a second call of `fn` if the first is slow. The caller
+        holds a slot of `limiter` for the first call; a hedge takes its own.
+        '''
+        with self._lock:
+            self._host(host).requests += 1
+        delay = self.delay(host)
+        first = self._pool.submit(self._timed, host, fn)
+        if delay is None:
+            return first.result()
+        done, _ = wait([first], timeout=delay)
+        if done or not self._may_hedge(host, limiter):
+            return first.result()
+        log.info(f'Request to {host} running over {delay:.2f}s, sending a hedged request')
+        second = self._pool.submit(self._timed, host, fn)
+        if limiter is not None:
+            second.add_done_callback(lambda _: limiter.release())
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                for other in pending:
+                    other.cancel()
+                if future is second:
+                    with self._lock:
+                        self._host(host).hedge_wins += 1
+                return future.result()
+        raise error
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        '''
+        Per host: requests, hedges sent, hedges which answered first, and the current delay.
+        '''
+        with self._lock:
+            hosts = list(self._hosts)
+        return {host: {'requests': self._hosts[host].requests,
+                       'hedged': self._hosts[host].hedged,
+                       'hedge_wins': self._hosts[host].hedge_wins,
+                       'delay': self.delay(host)}
+                for host in hosts}
+
+
+hedger: Optional[RequestHedger] = None
+
+
+def enable_hedging(**kwargs: Any) -> RequestHedger:
+    '''
+    Hedges every state portal request from now on; keyword arguments are passed to
+    `RequestHedger`. Returns the hedger, whose `stats` report hedging per host.
+    '''
+    global hedger # pylint: disable=global-statement
+    hedger = RequestHedger(**kwargs)
+    return hedger
+
+
+def disable_hedging() -> None:
+    global hedger # pylint: disable=global-statement
+    hedger = None
+
+
+def hedged(host: str, fn: Callable[[], Any], limiter: Any = None) -> Any:
+    '''
+    Returns `fn()`, through the module's hedger when hedging is enabled, with any hedge sent
+    within `limiter` (see `RequestHedger`).
+    '''
+    if hedger is None:
+        return fn()
+    return hedger.call(host, fn, limiter)
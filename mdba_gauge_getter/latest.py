@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import time
+import logging
+import datetime
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from ._lazy import LazyModule
+from . import gauge_getter
+from .quality import policy_key
+
+
+pd = LazyModule('pandas')
+
+log = logging.getLogger(__name__)
+
+# Windows (days back from today) tried in turn, each only for gauges still without a value
+LATEST_WINDOWS = (3, 14, 60)
+
+LATEST_TTL = 300
+
+# (gauge, var, interval, data_type, data_source, `policy_key` of the quality policy) ->
+# (expiry, row)
+_cache: Dict[Tuple[str, ...], Tuple[float, List[Any]]] = {}
+_cache_lock = threading.Lock()
+
+
+def clear_latest_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+
+
+def cached_rows(keys: Dict[str, Tuple[str, ...]]) -> Dict[str, List[Any]]:
+    '''
+    The cached rows still within their TTL, by gauge.
+    '''
+    now = time.monotonic()
+    with _cache_lock:
+        held = {gauge: _cache.get(key) for gauge, key in keys.items()}
+    return {gauge: entry[1] for gauge, entry in held.items()
+            if entry is not None and entry[0] > now}
+
+
+def last_rows(frame: pd.DataFrame) -> Dict[str, List[Any]]:
+    '''
+    The latest row with a value for each site in a `gauge_pull` frame.
+    '''
+    if frame is None or not len(frame):
+        return {}
+    frame = frame[pd.notna(frame['VALUE'])]
+    frame = frame.assign(SITEID=frame['SITEID'].astype(str)) \
+        .sort_values(['SITEID', 'DATETIME'], kind='stable')
+    latest = frame.groupby('SITEID', sort=False).tail(1)
+    return {row[1]: list(row) for row in latest[gauge_getter.DATA_COLUMNS].itertuples(index=False)}
+
+
+def gauge_latest(gauge_numbers: Sequence[str], var: str = 'F', interval: str = 'day',
+                 data_type: str = 'mean', data_source: str = 'state',
+                 windows: Sequence[int] = LATEST_WINDOWS, ttl: float = LATEST_TTL,
+                 quality: Any = None, today: Optional[datetime.date] = None) -> pd.DataFrame:
+    '''
+    Returns the most recent value of `var` at each gauge, one row per gauge, with DATETIME the
+    date of the observation.
+
+    Gauges are first requested over the shortest of `windows` (days back from today), which
+    `gauge_pull` routes by source and batches as many sites per request as each host allows.
+    Only the gauges without a value in that window are asked for again over the next, longer
+    window, and so on. Gauges with no value in the longest window are left out. Results are
+    cached in memory for `ttl` seconds, so repeated calls within that time skip the network.
+    '''
+    today = today or datetime.date.today()
+    gauges = list(dict.fromkeys(str(g) for g in gauge_numbers))
+    keys = {gauge: (gauge, var, interval, data_type, data_source, policy_key(quality))
+            for gauge in gauges}
+    found = cached_rows(keys)
+    missing = [gauge for gauge in gauges if gauge not in found]
+    if missing:
+        log.info(f'{len(gauges) - len(missing)} of {len(gauges)} latest values cached')
+    for days in sorted(windows):
+        if not missing:
+            break
+        start = today - datetime.timedelta(days=days)
+        log.info(f'Requesting latest values for {len(missing)} gauges since {start}')
+        rows = last_rows(gauge_getter.gauge_pull(missing, start, today, var, interval, data_type,
+                                                 data_source, quality=quality))
+        expiry = time.monotonic() + ttl
+        with _cache_lock:
+            for gauge, row in rows.items():
+                if gauge in keys:
+                    _cache[keys[gauge]] = (expiry, row)
+        found.update((gauge, row) for gauge, row in rows.items() if gauge in keys)
+        missing = [gauge for gauge in missing if gauge not in rows]
+    if missing:
+        log.warning(f'No value in the last {max(windows)} days for gauges {missing}')
+    return pd.DataFrame([found[gauge] for gauge in gauges if gauge in found],
+                        columns=gauge_getter.DATA_COLUMNS)
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import datetime
+from typing import Any, Dict, List, Optional, Sequence
+from ._lazy import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+# The date axis unit for each interval. Hourly values are extracted per day, so they have no
+# dense axis of their own.
+AXIS_UNITS = {
+    'day': 'D',
+    'd': 'D',
+    'month': 'M',
+    'm': 'M',
+    'year': 'Y',
+    'y': 'Y',
+}
+
+# QUALITYCODE of cells with no observation
+MISSING_QUALITY = -1
+
+
+def import_xarray() -> Any:
+    '''
+    Imports xarray, which is only required for `GaugeMatrix.to_xarray` and `to_netcdf`.
+    '''
+    try:
+        import xarray # pylint: disable=import-outside-toplevel
+    except ImportError as e:
+        raise ImportError('Dataset output requires xarray, install it with '
+                          '`pip install xarray netCDF4`') from e
+    return xarray
+
+
+def date_axis(start: datetime.date, end: datetime.date, interval: str) -> np.ndarray:
+    '''
+    The dates of every period from `start` to `end` at `interval`, each as its first day.
+    '''
+    if interval.lower() not in AXIS_UNITS:
+        raise ValueError(f"output='matrix' supports day, month and year intervals, "
+                         f"got '{interval}'")
+    unit = AXIS_UNITS[interval.lower()]
+    first = np.datetime64(start, unit)
+    last = np.datetime64(end, unit)
+    return np.arange(first, last + 1).astype('datetime64[D]')
+
+
+class GaugeMatrix:
+    '''
+    Dense pull output: `values[v, t, g]` (float64, NaN where nothing was returned) and
+    `quality[v, t, g]` (int64, `MISSING_QUALITY` where nothing was returned) for variable
+    `variables[v]`, date `dates[t]` and gauge `gauges[g]`.
+    '''
+
+    def __init__(self, variables: List[str], dates: np.ndarray, gauges: List[str],
+                 values: np.ndarray, quality: np.ndarray) -> None:
+        self.variables = variables
+        self.dates = dates
+        self.gauges = gauges
+        self.values = values
+        self.quality = quality
+        self.attrs: Dict[str, Any] = {}
+
+    def __repr__(self) -> str:
+        return (f'GaugeMatrix({len(self.variables)} variables x {len(self.dates)} dates x '
+                f'{len(self.gauges)} gauges)')
+
+    def frame(self, var: Optional[str] = None) -> pd.DataFrame:
+        '''
+        One variable's values as a DataFrame indexed by date with a column per gauge.
+        '''
+        index = self.variables.index(var) if var is not None else 0
+        return pd.DataFrame(self.values[index], index=pd.DatetimeIndex(self.dates, name='DATE'),
+                            columns=pd.Index(self.gauges, name='SITEID'))
+
+    def to_xarray(self) -> Any:
+        '''
+        Returns an `xarray.Dataset` with dimensions (time, gauge), holding for each variable
+        `<var>` (values) and `<var>_QUALITYCODE`. Requires xarray.
+        '''
+        xr = import_xarray()
+        data_vars = {}
+        for index, var in enumerate(self.variables):
+            data_vars[var] = (('time', 'gauge'), self.values[index])
+            data_vars[f'{var}_QUALITYCODE'] = (('time', 'gauge'), self.quality[index])
+        dataset = xr.Dataset(data_vars, coords={
+            'time': self.dates.astype('datetime64[ns]'),
+            'gauge': np.asarray(self.gauges, dtype=str)})
+        dataset.attrs.update({key: str(value) for key, value in self.attrs.items()})
+        return dataset
+
+    def to_netcdf(self, path: str, **kwargs: Any) -> None:
+        '''
+        Writes the dataset from `to_xarray` to a NetCDF file; keyword arguments are passed to
+        `xarray.Dataset.to_netcdf`.
+        '''
+        self.to_xarray().to_netcdf(path, **kwargs)
+
+
+class MatrixBuilder:
+    '''
+    Fills a `GaugeMatrix` from columnar batches as they are extracted. Each batch's sites and
+    dates are mapped to axis positions with vectorised lookups and written into the
+    preallocated arrays; dates are floored to their period first, so a monthly value stamped
+    mid-month lands on its month. Observations outside the axes are counted in `unplaced`, and
+    where sources overlap the later batch wins.
+    '''
+
+    def __init__(self, gauges: Sequence[str], start: datetime.date, end: datetime.date,
+                 interval: str, variables: Sequence[str]) -> None:
+        self.gauges = list(dict.fromkeys(str(g) for g in gauges))
+        self.variables = list(variables)
+        self.dates = date_axis(start, end, interval)
+        self.unit = AXIS_UNITS[interval.lower()]
+        shape = (len(self.variables), len(self.dates), len(self.gauges))
+        self.values = np.full(shape, np.nan, dtype='float64')
+        self.quality = np.full(shape, MISSING_QUALITY, dtype='int64')
+        self._gauge_index = pd.Index(self.gauges)
+        self.unplaced = 0
+
+    def append(self, batch: Dict[str, Any], VAR: Optional[str] = None) -> int:
+        # pylint: disable=invalid-name
+        var = self.variables.index(VAR) if VAR is not None else 0
+        columns = self._gauge_index.get_indexer(np.asarray(batch['SITEID']).astype(str))
+        dates = np.asarray(batch['DATETIME']).astype(f'datetime64[{self.unit}]') \
+            .astype('datetime64[D]')
+        rows = np.searchsorted(self.dates, dates)
+        placed = (columns >= 0) & (rows < len(self.dates))
+        placed[placed] = self.dates[rows[placed]] == dates[placed]
+        self.unplaced += int((~placed).sum())
+        self.values[var, rows[placed], columns[placed]] = \
+            np.asarray(batch['VALUE'], dtype='float64')[placed]
+        quality = pd.to_numeric(pd.Series(np.asarray(batch['QUALITYCODE'])), errors='coerce')
+        self.quality[var, rows[placed], columns[placed]] = \
+            quality.fillna(MISSING_QUALITY).to_numpy(dtype='int64')[placed]
+        return int(placed.sum())
+
+    def result(self) -> GaugeMatrix:
+        return GaugeMatrix(self.variables, self.dates, self.gauges, self.values, self.quality)
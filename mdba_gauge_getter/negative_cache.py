@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import logging
+import datetime
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from .quality import policy_key
+
+
+log = logging.getLogger(__name__)
+
+NEGATIVE_TTL = 24 * 60 * 60
+
+
+class NegativeCache:
+    '''
+    Remembers (source, gauge, var, interval) combinations that returned no data over a
+    window, so that for `ttl` seconds any request for them over that window, or a narrower
+    one, is skipped before it is made.
+
+    A gauge counts as empty at a source when the source was asked for it and no rows with
+    that source's DATASOURCEID came back, after quality screening, so entries are kept per
+    quality policy: a gauge emptied by a strict policy is still asked for under another. With
+    a `path`, entries are loaded from and saved to that JSON file.
+    '''
+
+    def __init__(self, ttl: float = NEGATIVE_TTL, path: Optional[str] = None) -> None:
+        self.ttl = ttl
+        self.path = path
+        # 'source|gauge|var|interval[|policy]' -> [start ordinal, end ordinal, expiry (epoch
+        # seconds)], where policy is the `policy_key` of any quality policy but the default
+        self.entries: Dict[str, List[List[float]]] = {}
+        self.skipped: Counter = Counter()
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        now = time.time()
+        with self._lock:
+            entries = {key: [w for w in windows if w[2] > now]
+                       for key, windows in self.entries.items()}
+        partial = f'{self.path}.{os.getpid()}.tmp'
+        with open(partial, 'w', encoding='utf-8') as f:
+            json.dump({key: windows for key, windows in entries.items() if windows}, f)
+        os.replace(partial, self.path)
+
+    @staticmethod
+    def key(source: str, gauge: str, var: str, interval: str, quality: Any = None) -> str:
+        policy = policy_key(quality)
+        return f'{source}|{gauge}|{var}|{interval}' + (f'|{policy}' if policy else '')
+
+    def is_empty(self, source: str, gauge: str, var: str, interval: str,
+                 start: datetime.date, end: datetime.date, quality: Any = None) -> bool:
+        now = time.time()
+        with self._lock:
+            windows = self.entries.get(self.key(source, gauge, var, interval, quality), [])
+            return any(lo <= start.toordinal() and end.toordinal() <= hi and expires > now
+                       for lo, hi, expires in windows)
+
+    def add(self, source: str, gauge: str, var: str, interval: str, start: datetime.date,
+            end: datetime.date, quality: Any = None) -> None:
+        now = time.time()
+        key = self.key(source, gauge, var, interval, quality)
+        with self._lock:
+            windows = [w for w in self.entries.get(key, []) if w[2] > now and
+                       not (start.toordinal() <= w[0] and w[1] <= end.toordinal())]
+            self.entries[key] = windows + [[start.toordinal(), end.toordinal(), now + self.ttl]]
+
+    def count_skips(self, skipped: Counter) -> None:
+        with self._lock:
+            self.skipped.update(skipped)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.skipped.clear()
+
+    def probe(self, var: str, interval: str, start: datetime.date, end: datetime.date,
+              quality: Any = None) -> 'NegativeProbe':
+        return NegativeProbe(self, var, interval, start, end, quality)
+
+
+class NegativeProbe:
+    '''
+    Tracks one variable's pull against a `NegativeCache`: filters the gauges asked of each
+    source, notes which gauges each source returned rows for, and on `finish` records the
+    gauges which came back empty.
+    '''
+
+    def __init__(self, cache: NegativeCache, var: str, interval: str, start: datetime.date,
+                 end: datetime.date, quality: Any = None) -> None:
+        self.cache = cache
+        self.var = var
+        self.interval = interval
+        self.start = start
+        self.end = end
+        self.quality = quality
+        self.asked: Dict[str, Set[str]] = {}
+        self.seen: Set[Tuple[str, str]] = set()
+        self.skipped: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def ask(self, source: str, gauges: Sequence[str]) -> List[str]:
+        '''
+        The gauges of `gauges` not known to be empty at `source`.
+        '''
+        kept = [g for g in gauges if not self.cache.is_empty(
+            source, str(g), self.var, self.interval, self.start, self.end, self.quality)]
+        with self._lock:
+            if len(kept) < len(gauges):
+                log.info(f'Skipping {len(gauges) - len(kept)} gauges known to have no '
+                         f'\'{self.var}\' data at {source}')
+                self.skipped[source] += len(gauges) - len(kept)
+            self.asked.setdefault(source, set()).update(str(g) for g in kept)
+        return kept
+
+    def observe(self, pairs: Iterable[Tuple[str, str]]) -> None:
+        self.seen.update((str(source), str(site)) for source, site in pairs)
+
+    def recording(self, sink: Callable[..., Any]) -> Callable[..., Any]:
+        '''
+        Wraps a batch sink to note the sites each batch holds data for.
+        '''
+        def recorded(batch, **constants):
+            self.observe(zip(batch['DATASOURCEID'].tolist(), batch['SITEID'].tolist()))
+            return sink(batch, **constants)
+        return recorded
+
+    def finish(self) -> Counter:
+        '''
+        Records every gauge a source was asked for and returned nothing for, and returns the
+        number of gauges skipped by source.
+        '''
+        for source, gauges in self.asked.items():
+            for gauge in gauges:
+                if (source, gauge) not in self.seen:
+                    self.cache.add(source, gauge, self.var, self.interval, self.start,
+                                   self.end, self.quality)
+        self.cache.count_skips(self.skipped)
+        self.cache.save()
+        return self.skipped
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import datetime
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from . import gauge_getter
+from .sources import SourceAdapter, fetch_with_fallback, get_source, schedule, sources
+
+
+PLAN_VERSION = 1
+
+
+def periods(start: datetime.date, end: datetime.date, interval: str) -> int:
+    '''
+    Number of `interval` periods from `start` to `end` inclusive, used for row estimates.
+    '''
+    interval = interval.lower()
+    days = (end - start).days + 1
+    if interval in ('hour', 'h'):
+        return days * 24
+    if interval in ('month', 'm'):
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    if interval in ('year', 'y'):
+        return end.year - start.year + 1
+    return days
+
+
+def shard_windows(start: datetime.date, end: datetime.date,
+                  shard_days: Optional[int]) -> List[Tuple[datetime.date, datetime.date]]:
+    '''
+    Splits an inclusive date range into consecutive non-overlapping windows of at most
+    `shard_days` days. Without `shard_days` the range is one window.
+    '''
+    if not shard_days:
+        return [(start, end)]
+    if shard_days < 1:
+        raise ValueError(f'shard_days must be at least 1, got {shard_days}')
+    windows = []
+    window_start = start
+    while window_start <= end:
+        window_end = min(window_start + datetime.timedelta(days=shard_days - 1), end)
+        windows.append((window_start, window_end))
+        window_start = window_end + datetime.timedelta(days=1)
+    return windows
+
+
+def make_unit(source: SourceAdapter, sites: List[str], var: str,
+              window: Tuple[datetime.date, datetime.date], interval: str,
+              data_type: str) -> Dict[str, Any]:
+    rows = len(sites) * periods(window[0], window[1], interval)
+    return {
+        'kind': source.kind,
+        'host': source.host,
+        'source': source.name,
+        'data_source': getattr(source, 'data_source', None),
+        'sites': list(sites),
+        'var': var,
+        'start': window[0].isoformat(),
+        'end': window[1].isoformat(),
+        'interval': interval,
+        'data_type': data_type,
+        'fallback': source.fallback,
+        'estimated_rows': rows,
+        'estimated_bytes': source.estimate_bytes(rows),
+    }
+
+
+def plan_var(gauges_by_state: Dict[str, List[str]], var: str, windows: List[Any],
+             interval: str, data_type: str, unsupported: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''
+    Request units for one variable from every registered source, in registration order.
+    Gauges routed to a source which does not serve `var` at this interval and data type are
+    added to `unsupported` instead.
+    '''
+    units = []
+    for source in sources():
+        sites = source.route(gauges_by_state)
+        if not sites:
+            continue
+        if not source.supports(var, interval, data_type):
+            unsupported.append({'source': source.name, 'var': var, 'sites': list(sites)})
+            continue
+        batches = source.batches(sites)
+        units += [make_unit(source, batch, var, window, interval, data_type)
+                  for window in windows for batch in batches]
+    return units
+
+
+def summarise(units: List[Dict[str, Any]]) -> Dict[str, Any]:
+    hosts: Dict[str, Dict[str, int]] = {}
+    for unit in units:
+        host = hosts.setdefault(unit['host'], {'requests': 0, 'estimated_rows': 0,
+                                               'estimated_bytes': 0})
+        host['requests'] += 1
+        host['estimated_rows'] += unit['estimated_rows']
+        host['estimated_bytes'] += unit['estimated_bytes']
+    return {
+        'requests': len(units),
+        'estimated_rows': sum(unit['estimated_rows'] for unit in units),
+        'estimated_bytes': sum(unit['estimated_bytes'] for unit in units),
+        'hosts': hosts,
+    }
+
+
+def plan_gauge_pull(gauge_numbers: Optional[List[str]], start_time_user: datetime.date,
+                    end_time_user: datetime.date, var: Union[str, List[str]] = 'F',
+                    interval: str = 'day', data_type: str = 'mean', data_source: str = 'state',
+                    region: Optional[Dict[str, Any]] = None,
+                    shard_days: Optional[int] = None) -> Dict[str, Any]:
+    '''
+    Works out the requests a `gauge_pull` with the same arguments would make, without any
+    network I/O. Gauges are routed and chunked exactly as `gauge_pull` does, and with
+    `shard_days` each request is further split into windows of at most that many days.
+
+    Returns a JSON-serialisable plan: `units`, one per HTTP request, each with its kind
+    ('kisters', 'bom' or 'aquarius'), host, sites, var, start/end window, fallback source and
+    estimated rows and bytes; a `summary` of requests, rows and bytes per host; any `unrouted`
+    gauges which no endpoint serves; and gauges left `unsupported` because their source does
+    not declare the var, interval or data type (see `sources`). Run it with `execute_plan`, whole or after
+    dividing it between workers with `split_plan`.
+    '''
+    gauge_numbers = gauge_getter.resolve_gauges(gauge_numbers, region)
+    gauges_by_state = gauge_getter.route_gauges(gauge_numbers, data_source)
+    windows = shard_windows(start_time_user, end_time_user, shard_days)
+    var_list = [var] if isinstance(var, str) else list(dict.fromkeys(var))
+
+    routed = {g for source in sources() for g in source.route(gauges_by_state)}
+    units = []
+    unsupported: List[Dict[str, Any]] = []
+    for v in var_list:
+        units += plan_var(gauges_by_state, v, windows, interval, data_type, unsupported)
+    for index, unit in enumerate(units):
+        unit['id'] = index
+
+    return {
+        'version': PLAN_VERSION,
+        'params': {
+            'var': var if isinstance(var, str) else var_list,
+            'start': start_time_user.isoformat(),
+            'end': end_time_user.isoformat(),
+            'interval': interval,
+            'data_type': data_type,
+            'data_source': data_source,
+            'shard_days': shard_days,
+        },
+        'units': units,
+        'summary': summarise(units),
+        'unrouted': [g for g in gauges_by_state['rest'] if g not in routed],
+        'unsupported': unsupported,
+    }
+
+
+def split_plan(plan: Dict[str, Any], parts: int) -> List[Dict[str, Any]]:
+    '''
+    Divides a plan into `parts` plans of roughly equal estimated size, for separate workers.
+    Units go largest first to whichever part is currently smallest.
+    '''
+    if parts < 1:
+        raise ValueError(f'parts must be at least 1, got {parts}')
+    buckets: List[List[Dict[str, Any]]] = [[] for _ in range(parts)]
+    loads = [0] * parts
+    for unit in sorted(plan['units'], key=lambda u: (-u['estimated_bytes'], u['id'])):
+        smallest = loads.index(min(loads))
+        buckets[smallest].append(unit)
+        loads[smallest] += unit['estimated_bytes']
+    split = []
+    for bucket in buckets:
+        bucket.sort(key=lambda u: u['id'])
+        split.append({**plan, 'units': bucket, 'summary': summarise(bucket)})
+    return split
+
+
+def plan_columns(plan: Dict[str, Any]) -> List[str]:
+    '''
+    Columns of the frame a plan produces: a VAR column is added for multi-variable plans.
+    '''
+    columns = gauge_getter.DATA_COLUMNS
+    if isinstance(plan['params']['var'], str):
+        return columns
+    return columns[:3] + ['VAR'] + columns[3:]
+
+
+def run_unit(unit: Dict[str, Any], opts: Dict[str, Any]) -> List[Any]:
+    '''
+    Makes the request described by one plan unit through its source, asking the unit's
+    fallback source when it returns nothing.
+    '''
+    start = datetime.date.fromisoformat(unit['start'])
+    end = datetime.date.fromisoformat(unit['end'])
+    return fetch_with_fallback(get_source(unit['source']), unit['sites'], start, end,
+                               unit['var'], unit['interval'], unit['data_type'], **opts)
+
+
+def execute_plan(plan: Dict[str, Any], quality: Any = None,
+                 sink: Optional[Callable[..., Any]] = None, workers: int = 1) -> Any:
+    '''
+    Runs the units of a plan from `plan_gauge_pull` (or one part of `split_plan`) and returns
+    a long DataFrame as `gauge_pull` does, with a VAR column when the plan covers several
+    variables. With `workers` above 1, units run concurrently on that many threads, within
+    each source's declared rate limits.
+
+    With a `sink`, each response is instead passed to it as a columnar batch, called as
+    `sink(batch, VAR=var)` for multi-variable plans, and the total row count is returned.
+    '''
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f'Unsupported plan version {plan.get("version")}')
+    multi_var = not isinstance(plan['params']['var'], str)
+    context = gauge_getter.PullContext(quality)
+    sink_lock = threading.Lock()
+
+    def run(unit: Dict[str, Any]) -> List[Any]:
+        gauge_getter.log.info(f'Plan unit {unit["id"]}: {unit["source"]} {unit["var"]} '
+                              f'{len(unit["sites"])} sites {unit["start"]} to {unit["end"]}')
+        opts: Dict[str, Any] = {'context': context}
+        if sink is not None:
+            constants = {'VAR': unit['var']} if multi_var else {}
+            def locked_sink(batch):
+                with sink_lock:
+                    sink(batch, **constants)
+            opts['sink'] = locked_sink
+        return run_unit(unit, opts)
+
+    results = schedule(plan['units'], lambda unit: get_source(unit['source']), run, workers)
+    if sink is not None:
+        return sum(sum(counts) for counts in results)
+    rows: List[Any] = []
+    for unit, data in zip(plan['units'], results):
+        rows += [row[:3] + [unit['var']] + row[3:] for row in data] if multi_var else data
+    return gauge_getter.with_report(
+        gauge_getter.pd.DataFrame(data=rows, columns=plan_columns(plan)), context)
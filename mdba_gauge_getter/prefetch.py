@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import json
+import logging
+import datetime
+import threading
+from typing import Any, Dict, List, Optional, Union
+from . import gauge_getter, planner
+from .sources import get_source, schedule
+
+
+log = logging.getLogger(__name__)
+
+JOB_DEFAULTS = {
+    'var': 'F',
+    'interval': 'day',
+    'data_type': 'mean',
+    'data_source': 'state',
+    'at': [],
+}
+
+
+def load_prefetch_config(config: Union[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''
+    Reads a prefetch config, a JSON file (or the dict it holds) of the form
+
+        {"jobs": [{"name": "morning-report", "gauges": ["410001", "422204A"],
+                   "var": ["F", "L"], "interval": "day", "days": 30,
+                   "at": ["05:30", "12:00"]}]}
+
+    `days` is the trailing window warmed (ending on the day the job runs) and `at` the local
+    times each day the job is due. `var`, `interval`, `data_type` and `data_source` default
+    as in `gauge_pull`. Returns the jobs with defaults filled in.
+    '''
+    if isinstance(config, str):
+        with open(config, encoding='utf-8') as f:
+            config = json.load(f)
+    jobs = []
+    for number, job in enumerate(config.get('jobs', [])):
+        job = {**JOB_DEFAULTS, 'name': f'job-{number}', **job}
+        for key in ('gauges', 'days'):
+            if key not in job:
+                raise ValueError(f'Prefetch job \'{job["name"]}\' has no \'{key}\'')
+        job['gauges'] = [str(g) for g in job['gauges']]
+        job['var'] = [job['var']] if isinstance(job['var'], str) else list(job['var'])
+        job['at'] = [datetime.time.fromisoformat(t) for t in
+                     ([job['at']] if isinstance(job['at'], str) else job['at'])]
+        jobs.append(job)
+    return jobs
+
+
+def warm(job: Dict[str, Any], store: Any, today: Optional[datetime.date] = None,
+         workers: int = 1, quality: Any = None) -> int:
+    '''
+    Pulls a job's gauges over its trailing window into `store`, through the same sources as an
+    interactive pull but within each source's background rate limits. A later `gauge_pull`
+    with the same store, for a window inside this one, is then served locally. Returns the
+    number of rows stored.
+    '''
+    today = today or datetime.date.today()
+    start = today - datetime.timedelta(days=job['days'])
+    stored = 0
+    for var in job['var']:
+        plan = planner.plan_gauge_pull(job['gauges'], start, today, var, job['interval'],
+                                       job['data_type'], job['data_source'])
+        context = gauge_getter.PullContext(quality)
+        results = schedule(plan['units'], lambda unit: get_source(unit['source']),
+                           lambda unit: planner.run_unit(unit, {'context': context,
+                                                                'background': True}),
+                           workers, background=True)
+        rows = [row for data in results for row in data]
+        fetched = gauge_getter.pd.DataFrame(data=rows, columns=gauge_getter.DATA_COLUMNS)
+        # Gauges which returned nothing are left uncovered, so pulls still ask for them
+        returned = set(fetched['SITEID'].astype(str))
+        store.write(fetched, [g for g in job['gauges'] if g in returned], start, today, var,
+                    job['interval'], job['data_type'], job['data_source'], quality)
+        log.info(f'Prefetch {job["name"]}: stored {len(rows)} rows of \'{var}\' for '
+                 f'{len(job["gauges"])} gauges from {start}')
+        stored += len(rows)
+    return stored
+
+
+class PrefetchScheduler:
+    '''
+    Warms a store with the jobs of a prefetch config (see `load_prefetch_config`) at their
+    scheduled times, so that reports asking for the same gauge sets are served from the store
+    instead of all hitting the portals at once.
+    '''
+
+    def __init__(self, config: Union[str, Dict[str, Any]], store: Any, workers: int = 1,
+                 quality: Any = None, check_period: float = 60) -> None:
+        self.jobs = load_prefetch_config(config)
+        self.store = store
+        self.workers = workers
+        self.quality = quality
+        self.check_period = check_period
+        self.last_run: Dict[str, datetime.datetime] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def due(self, now: datetime.datetime) -> List[Dict[str, Any]]:
+        '''
+        Jobs with a scheduled time today, at or before `now`, which have not run since it.
+        '''
+        jobs = []
+        for job in self.jobs:
+            passed = [datetime.datetime.combine(now.date(), t) for t in job['at']]
+            passed = [t for t in passed if t <= now]
+            last = self.last_run.get(job['name'])
+            if passed and (last is None or last < max(passed)):
+                jobs.append(job)
+        return jobs
+
+    def run_job(self, job: Dict[str, Any], now: Optional[datetime.datetime] = None) -> int:
+        now = now or datetime.datetime.now()
+        stored = warm(job, self.store, now.date(), self.workers, self.quality)
+        self.last_run[job['name']] = now
+        return stored
+
+    def run_pending(self, now: Optional[datetime.datetime] = None) -> List[str]:
+        '''
+        Runs every due job, returning their names. A failed job is logged and retried at the
+        next check.
+        '''
+        now = now or datetime.datetime.now()
+        ran = []
+        for job in self.due(now):
+            try:
+                self.run_job(job, now)
+                ran.append(job['name'])
+            except Exception as e: # pylint: disable=broad-except
+                log.error(f'Prefetch {job["name"]} failed: {e}')
+        return ran
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            self.run_pending()
+            self._stop.wait(self.check_period)
+
+    def start(self) -> 'PrefetchScheduler':
+        '''
+        Starts checking for due jobs on a background thread.
+        '''
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='gauge-prefetch', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
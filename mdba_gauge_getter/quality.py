@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import json
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple, Union
+from ._lazy import LazyModule
+
+
+np = LazyModule('numpy')
+
+# An allowed-codes spec: a list of single codes and inclusive (low, high) ranges, where either
+# bound may be None. None (rather than a list) keeps every code.
+AllowedCodes = Optional[Sequence[Union[int, Tuple[Optional[int], Optional[int]]]]]
+
+# Codes kept when no policy is given. Kisters codes of 999 and above mark missing or
+# unusable data; BOM and Aquarius rows are kept regardless.
+DEFAULT_QUALITY: Dict[str, AllowedCodes] = {
+    'state': [(None, 998)],
+    'BOM': None,
+    'SA': None,
+}
+
+
+def quality_mask(codes: np.ndarray, allowed: AllowedCodes) -> np.ndarray:
+    '''
+    Returns a boolean mask of the `codes` permitted by `allowed`.
+    '''
+    codes = np.asarray(codes)
+    if allowed is None:
+        return np.ones(len(codes), dtype=bool)
+    singles = [c for c in allowed if not isinstance(c, (tuple, list))]
+    mask = np.isin(codes, singles) if singles else np.zeros(len(codes), dtype=bool)
+    for low, high in (c for c in allowed if isinstance(c, (tuple, list))):
+        in_range = np.ones(len(codes), dtype=bool)
+        if low is not None:
+            in_range &= codes >= low
+        if high is not None:
+            in_range &= codes <= high
+        mask |= in_range
+    return mask
+
+
+def policy_key(policy: Any) -> str:
+    '''
+    A stable text form of a quality policy, so results screened with different policies can be
+    told apart; '' for the default policy.
+    '''
+    if policy is None:
+        return ''
+    return json.dumps(policy, sort_keys=True, default=list)
+
+
+class QualityFilter:
+    '''
+    Applies a quality policy during extraction and counts the codes it rejects.
+
+    `policy` is either an allowed-codes spec applied to every source, or a dict keyed by source
+    ('NSW', 'VIC', 'QLD', 'BOM', 'SA'), by 'state' for all Kisters portals, or by 'default'.
+    Sources a dict does not mention keep the `DEFAULT_QUALITY` behaviour.
+    '''
+
+    def __init__(self, policy: Any = None) -> None:
+        self.policy = policy
+        self.dropped: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def allowed(self, source: str) -> AllowedCodes:
+        policy = self.policy
+        # Anything other than BOM and SA is extracted from a Kisters response
+        group = source if source in DEFAULT_QUALITY and source != 'state' else 'state'
+        if policy is None:
+            return DEFAULT_QUALITY.get(group)
+        if not isinstance(policy, dict):
+            return policy
+        for key in (source, group, 'default'):
+            if key in policy:
+                return policy[key]
+        return DEFAULT_QUALITY.get(group)
+
+    def mask(self, source: str, codes: np.ndarray) -> np.ndarray:
+        '''
+        Returns which `codes` from `source` to keep, recording the rejected ones.
+        '''
+        codes = np.asarray(codes)
+        keep = quality_mask(codes, self.allowed(source))
+        if not keep.all():
+            rejected, counts = np.unique(codes[~keep], return_counts=True)
+            self.count(((source, code), count)
+                       for code, count in zip(rejected.tolist(), counts.tolist()))
+        return keep
+
+    def count(self, dropped: Iterable[Tuple[Tuple[str, Any], int]]) -> None:
+        '''
+        Adds ((source, code), count) pairs to the dropped counts; a pull's requests may be
+        extracted on several threads at once.
+        '''
+        with self._lock:
+            for key, count in dropped:
+                self.dropped[key] += count
+
+    def report(self) -> Dict[str, Dict[Any, int]]:
+        '''
+        Dropped row counts as `{source: {code: count}}`.
+        '''
+        report: Dict[str, Dict[Any, int]] = {}
+        for (source, code), count in sorted(self.dropped.items(), key=str):
+            report.setdefault(source, {})[code] = count
+        return report
+
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import os
+import json
+import logging
+import datetime
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+log = logging.getLogger(__name__)
+
+# The `route_gauges` group each source is pulled from by `pull_var`. Aquarius (SA) gauges are
+# pulled from the 'rest' group.
+SOURCE_GROUPS = {
+    'NSW': 'NSW',
+    'VIC': 'VIC',
+    'QLD': 'QLD',
+    'BOM': 'BOM',
+    'SA': 'rest',
+}
+
+
+def route_key(gauge: str, var: Optional[str] = None, interval: Optional[str] = None) -> str:
+    return '|'.join(part for part in (str(gauge), var, interval) if part is not None)
+
+
+class RoutingTable:
+    '''
+    Remembers which source returned data for each (gauge, var, interval), so later pulls send
+    the gauge straight there instead of to every state portal its catalogue entries name, or
+    to a portal which only ever answers with nothing before the BOM fallback.
+
+    A learned route is trusted for `reprobe_days`, after which the gauge is routed from the
+    catalogue again and its route relearned. Overrides, set with `override` for a gauge or
+    for one (gauge, var, interval), always win. With a `path`, the table is loaded from and
+    saved to that JSON file.
+    '''
+
+    def __init__(self, path: Optional[str] = None, reprobe_days: int = 30) -> None:
+        self.path = path
+        self.reprobe_days = reprobe_days
+        self.routes: Dict[str, Dict[str, str]] = {}
+        self.overrides: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                saved = json.load(f)
+            self.routes = saved.get('routes', {})
+            self.overrides = saved.get('overrides', {})
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with self._lock:
+            saved = {'routes': dict(self.routes), 'overrides': dict(self.overrides)}
+        partial = f'{self.path}.{os.getpid()}.tmp'
+        with open(partial, 'w', encoding='utf-8') as f:
+            json.dump(saved, f, indent=1, sort_keys=True)
+        os.replace(partial, self.path)
+
+    def override(self, gauge: str, source: Optional[str], var: Optional[str] = None,
+                 interval: Optional[str] = None) -> None:
+        '''
+        Always routes `gauge` (for every variable, or just `var` at `interval`) to `source`,
+        one of 'NSW', 'VIC', 'QLD', 'BOM' or 'SA'. A `source` of None removes the override.
+        '''
+        if source is not None and source not in SOURCE_GROUPS:
+            raise ValueError(f'Unknown source \'{source}\', expected one of {list(SOURCE_GROUPS)}')
+        key = route_key(gauge, var, interval)
+        with self._lock:
+            if source is None:
+                self.overrides.pop(key, None)
+            else:
+                self.overrides[key] = source
+
+    def source_for(self, gauge: str, var: str, interval: str,
+                   today: Optional[datetime.date] = None) -> Optional[str]:
+        '''
+        The source `gauge` is sent to, or None to route it from the catalogue.
+        '''
+        with self._lock:
+            for key in (route_key(gauge, var, interval), route_key(gauge)):
+                if key in self.overrides:
+                    return self.overrides[key]
+            route = self.routes.get(route_key(gauge, var, interval))
+        if route is None:
+            return None
+        age = (today or datetime.date.today()) - datetime.date.fromisoformat(route['learned'])
+        return route['source'] if age.days < self.reprobe_days else None
+
+    def apply(self, gauges_by_state: Dict[str, List[str]], var: str,
+              interval: str) -> Dict[str, List[str]]:
+        '''
+        Moves every gauge with a known route in `gauges_by_state` (from `route_gauges`) into
+        its source's group only.
+        '''
+        routed: Dict[str, List[str]] = {group: [] for group in gauges_by_state if group != 'BOM'}
+        routed['SA'] = list(gauges_by_state.get('SA', []))
+        bom: List[str] = []
+        placed = set()
+        for group, gauges in gauges_by_state.items():
+            if group == 'SA':
+                continue
+            for gauge in gauges:
+                source = self.source_for(gauge, var, interval)
+                if source is None:
+                    (bom if group == 'BOM' else routed[group]).append(gauge)
+                elif gauge not in placed:
+                    placed.add(gauge)
+                    target = SOURCE_GROUPS[source]
+                    (bom if target == 'BOM' else routed.setdefault(target, [])).append(gauge)
+        if placed:
+            log.info(f'Routing table sent {len(placed)} gauges straight to their sources')
+        if bom or 'BOM' in gauges_by_state:
+            routed['BOM'] = list(dict.fromkeys(bom))
+        return routed
+
+    def learn(self, observed: Iterable[Tuple[str, str]], var: str, interval: str,
+              today: Optional[datetime.date] = None) -> None:
+        '''
+        Records, for each gauge in `observed` (site, source) pairs, the source that returned
+        the most rows. A route confirmed while still trusted keeps the date it was learned, so
+        it is still reprobed `reprobe_days` after that.
+        '''
+        counts = Counter((str(site), str(source)) for site, source in observed)
+        best: Dict[str, Tuple[int, str]] = {}
+        for (site, source), count in counts.items():
+            if source in SOURCE_GROUPS and count > best.get(site, (0, ''))[0]:
+                best[site] = (count, source)
+        today = today or datetime.date.today()
+        with self._lock:
+            for site, (_, source) in best.items():
+                key = route_key(site, var, interval)
+                route = self.routes.get(key)
+                if route is not None and route['source'] == source and \
+                        (today - datetime.date.fromisoformat(route['learned'])).days \
+                        < self.reprobe_days:
+                    continue
+                self.routes[key] = {'source': source, 'learned': today.isoformat()}
+
+    def recording(self, sink: Callable[..., Any], var: str,
+                  interval: str) -> Callable[..., Any]:
+        '''
+        Wraps a batch sink to learn routes from each batch passed through it.
+        '''
+        def recorded(batch, **constants):
+            self.learn(zip(batch['SITEID'].tolist(), batch['DATASOURCEID'].tolist()), var,
+                       interval)
+            return sink(batch, **constants)
+        return recorded
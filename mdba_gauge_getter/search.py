@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import re
+from bisect import bisect_left
+from typing import Any, Dict, List, Set
+from ._lazy import LazyModule
+
+
+np = LazyModule('numpy')
+
+TOKEN_PATTERN = re.compile(r'[A-Z0-9]+')
+
+# Weight a query token earns for each kind of match against a name token
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+
+# Minimum trigram similarity for a fuzzy (misspelt) token match
+FUZZY_THRESHOLD = 0.35
+
+
+def tokenize(text: str) -> List[str]:
+    '''
+    Splits a gauge name or query into upper-case alphanumeric tokens, so that
+    'Culgoa @ Whyenbah' and 'CULGOA@WHYENBAH' match the same way.
+    '''
+    return TOKEN_PATTERN.findall(str(text).upper())
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f' {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class GaugeNameIndex:
+    '''
+    Token and prefix index over the catalogue's gauge names and numbers.
+
+    The vocabulary of name tokens is kept sorted, and each token's catalogue rows are stored
+    contiguously in the same order. All tokens sharing a prefix therefore form one range of the
+    vocabulary and one slice of the row postings. Query tokens with no exact or prefix match
+    are matched fuzzily through a trigram index, so typos still find candidates.
+    '''
+
+    def __init__(self, catalogue: Any) -> None:
+        self.catalogue = catalogue.reset_index(drop=True)
+        self.names = self.catalogue['gauge_name'].astype(str).to_numpy(dtype=object)
+        self.numbers = self.catalogue['gauge_number'].astype(str).to_numpy(dtype=object)
+        self.states = self.catalogue['State'].to_numpy(dtype=object)
+        self.owners = self.catalogue['gauge_owner'].to_numpy(dtype=object) \
+            if 'gauge_owner' in self.catalogue else np.full(len(self.catalogue), None)
+
+        postings: Dict[str, List[int]] = {}
+        lengths = []
+        for row, (name, number) in enumerate(zip(self.names, self.numbers)):
+            tokens = tokenize(name)
+            lengths.append(len(tokens))
+            for token in set(tokens) | set(tokenize(number)):
+                postings.setdefault(token, []).append(row)
+        self.vocab = sorted(postings)
+        counts = [len(postings[token]) for token in self.vocab]
+        self.post_start = np.concatenate([[0], np.cumsum(counts)]).astype('int64')
+        self.post_rows = np.fromiter((row for token in self.vocab for row in postings[token]),
+                                     dtype='int64', count=int(self.post_start[-1]))
+        # Shorter names rank first among equal scores
+        self.name_lengths = np.asarray(lengths, dtype='float64')
+
+        grams: Dict[str, List[int]] = {}
+        for vocab_id, token in enumerate(self.vocab):
+            for gram in trigrams(token):
+                grams.setdefault(gram, []).append(vocab_id)
+        self.grams = {gram: np.asarray(ids, dtype='int64') for gram, ids in grams.items()}
+        self.gram_counts = np.asarray([len(trigrams(token)) for token in self.vocab],
+                                      dtype='float64')
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _rows(self, lo: int, hi: int) -> np.ndarray:
+        return self.post_rows[self.post_start[lo]:self.post_start[hi]]
+
+    def _token_scores(self, token: str) -> np.ndarray:
+        scores = np.zeros(len(self))
+        lo = bisect_left(self.vocab, token)
+        hi = bisect_left(self.vocab, token + '\uffff', lo)
+        if hi > lo:
+            scores[self._rows(lo, hi)] = PREFIX_WEIGHT
+            if self.vocab[lo] == token:
+                scores[self._rows(lo, lo + 1)] = EXACT_WEIGHT
+            return scores
+
+        query_grams = trigrams(token)
+        ids = [self.grams[g] for g in query_grams if g in self.grams]
+        if not ids:
+            return scores
+        common = np.bincount(np.concatenate(ids), minlength=len(self.vocab))
+        similarity = common / (len(query_grams) + self.gram_counts - common)
+        for vocab_id in np.flatnonzero(similarity >= FUZZY_THRESHOLD):
+            rows = self._rows(vocab_id, vocab_id + 1)
+            scores[rows] = np.maximum(scores[rows], FUZZY_WEIGHT * similarity[vocab_id])
+        return scores
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        '''
+        Returns up to `limit` catalogue entries best matching `query`, highest score first.
+        A score of 1.0 means every query token exactly matched a token of the name or number.
+        '''
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or not len(self):
+            return []
+        total = np.zeros(len(self))
+        for token in tokens:
+            total += self._token_scores(token)
+        total /= len(tokens)
+        candidates = np.flatnonzero(total > 0)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-total[candidates], limit - 1)[:limit]]
+        ranked = candidates[np.lexsort((self.name_lengths[candidates], -total[candidates]))]
+        return [{
+            'gauge_number': self.numbers[row],
+            'gauge_name': self.names[row],
+            'State': self.states[row],
+            'gauge_owner': self.owners[row],
+            'score': round(float(total[row]), 4),
+        } for row in ranked[:limit]]
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+from ._lazy import LazyModule
+from . import planner
+
+
+pd = LazyModule('pandas')
+
+log = logging.getLogger(__name__)
+
+# Queue layout under the shared root: a shard's task file moves from pending/ to running/ when
+# a worker claims it, then to done/ (its output in parts/) or failed/
+QUEUE_DIRS = ('pending', 'running', 'done', 'failed', 'parts')
+
+DEFAULT_UNITS_PER_SHARD = 8
+
+# Seconds between touches of a running shard's task file, which mark it as still in progress.
+# `requeue_stale` must only be given ages longer than this.
+SHARD_HEARTBEAT = 60
+
+
+def shard_plan(plan: Dict[str, Any],
+               units_per_shard: int = DEFAULT_UNITS_PER_SHARD) -> List[Dict[str, Any]]:
+    '''
+    Divides a plan into shards, first by host and then into runs of at most `units_per_shard`
+    request units, so a shard only ever talks to one portal.
+    '''
+    if units_per_shard < 1:
+        raise ValueError(f'units_per_shard must be at least 1, got {units_per_shard}')
+    by_host: Dict[str, List[Dict[str, Any]]] = {}
+    for unit in plan['units']:
+        by_host.setdefault(unit['host'], []).append(unit)
+    shards = []
+    for units in by_host.values():
+        for i in range(0, len(units), units_per_shard):
+            chunk = units[i:i + units_per_shard]
+            shards.append({**plan, 'units': chunk, 'summary': planner.summarise(chunk)})
+    return shards
+
+
+def queue_path(root: str, state: str, name: str = '') -> str:
+    return os.path.join(root, state, name)
+
+
+def write_atomic(path: str, write) -> None:
+    '''
+    Writes a file through a temporary name in the same directory, so readers on the shared
+    filesystem never see it half written.
+    '''
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def enqueue_plan(plan: Dict[str, Any], root: str,
+                 units_per_shard: int = DEFAULT_UNITS_PER_SHARD) -> List[str]:
+    '''
+    Creates a work queue for `plan` under `root`, a directory every worker can reach, and
+    returns the shard names.
+    '''
+    for state in QUEUE_DIRS:
+        os.makedirs(queue_path(root, state), exist_ok=True)
+    def write_plan(path):
+        with open(path, 'w') as f:
+            json.dump(plan, f)
+    write_atomic(os.path.join(root, 'plan.json'), write_plan)
+    names = []
+    for index, shard in enumerate(shard_plan(plan, units_per_shard)):
+        name = f'shard-{index:05d}'
+        def write(path, shard=shard):
+            with open(path, 'w') as f:
+                json.dump(shard, f)
+        write_atomic(queue_path(root, 'pending', f'{name}.json'), write)
+        names.append(name)
+    log.info(f'Queued {len(names)} shards under \'{root}\'')
+    return names
+
+
+def claim(root: str) -> Optional[str]:
+    '''
+    Claims the next pending shard, returning its name, or None once the queue is empty. A claim
+    is a rename into running/, which only one worker can win even across nodes.
+    '''
+    for filename in sorted(os.listdir(queue_path(root, 'pending'))):
+        if not filename.endswith('.json'):
+            continue
+        running = queue_path(root, 'running', filename)
+        try:
+            os.rename(queue_path(root, 'pending', filename), running)
+        except FileNotFoundError:
+            continue
+        # The claim time, refreshed by the worker's `heartbeat` and read by `requeue_stale`
+        os.utime(running)
+        return filename[:-len('.json')]
+    return None
+
+
+def run_shard(root: str, name: str, quality: Any = None) -> int:
+    '''
+    Executes one claimed shard and writes its partition to parts/. Returns its row count.
+    '''
+    with open(queue_path(root, 'running', f'{name}.json')) as f:
+        shard = json.load(f)
+    frame = planner.execute_plan(shard, quality=quality)
+    write_atomic(queue_path(root, 'parts', f'{name}.pkl'),
+                 lambda path: frame.to_pickle(path, compression='gzip'))
+    return len(frame)
+
+
+@contextmanager
+def heartbeat(path: str, interval: float = SHARD_HEARTBEAT) -> Iterator[None]:
+    '''
+    Touches `path` every `interval` seconds on a background thread while the block runs, so a
+    long-running shard is not taken to be stale. Stops if the file is moved away.
+    '''
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                return
+
+    thread = threading.Thread(target=beat, name='shard-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def finish_shard(root: str, name: str, state: str, worker_id: str) -> bool:
+    '''
+    Moves a shard this worker ran from running/ to `state`. Returns False, leaving it alone, if
+    the shard is no longer in running/: it was requeued as stale and taken over by another
+    worker, whose run will record it.
+    '''
+    try:
+        os.replace(queue_path(root, 'running', f'{name}.json'),
+                   queue_path(root, state, f'{name}.json'))
+    except FileNotFoundError:
+        log.warning(f'Worker {worker_id} finished {name}, but it was requeued and taken over '
+                    f'by another worker')
+        return False
+    return True
+
+
+def run_worker(root: str, quality: Any = None, worker_id: Optional[str] = None,
+               heartbeat_interval: float = SHARD_HEARTBEAT) -> Dict[str, int]:
+    '''
+    Claims and runs shards from the queue under `root` until none are left. Any number of
+    workers, in one process pool or on several nodes, may work through the same queue. A
+    running shard's task file is touched every `heartbeat_interval` seconds, so it is not
+    requeued as stale while it runs.
+    Returns counts of shards done, failed and taken over by another worker after being
+    requeued, and rows written, by this worker.
+    '''
+    worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    stats = {'done': 0, 'failed': 0, 'taken_over': 0, 'rows': 0}
+    while True:
+        name = claim(root)
+        if name is None:
+            break
+        log.info(f'Worker {worker_id} running {name}')
+        try:
+            with heartbeat(queue_path(root, 'running', f'{name}.json'), heartbeat_interval):
+                stats['rows'] += run_shard(root, name, quality)
+        except Exception as e: # pylint: disable=broad-except
+            log.error(f'Worker {worker_id} failed on {name}: {e}')
+            with open(queue_path(root, 'failed', f'{name}.error'), 'w') as f:
+                f.write(f'{worker_id}: {e!r}\n')
+            stats['failed' if finish_shard(root, name, 'failed', worker_id) else 'taken_over'] += 1
+            continue
+        stats['done' if finish_shard(root, name, 'done', worker_id) else 'taken_over'] += 1
+    return stats
+
+
+def requeue_stale(root: str, older_than: float, include_failed: bool = False) -> List[str]:
+    '''
+    Moves shards whose worker has not been heard from for more than `older_than` seconds back
+    to pending, e.g. after a node died mid-shard. Workers touch their shards every
+    `SHARD_HEARTBEAT` seconds, so `older_than` must be longer than that, or shards still
+    running are run twice. With `include_failed`, every failed shard is requeued as well.
+    '''
+    cutoff = time.time() - older_than
+    requeued = []
+    states = ('running', 'failed') if include_failed else ('running',)
+    for state in states:
+        for filename in sorted(os.listdir(queue_path(root, state))):
+            path = queue_path(root, state, filename)
+            if not filename.endswith('.json') or \
+                    (state == 'running' and os.path.getmtime(path) > cutoff):
+                continue
+            try:
+                os.rename(path, queue_path(root, 'pending', filename))
+            except FileNotFoundError:
+                continue
+            requeued.append(filename[:-len('.json')])
+    return requeued
+
+
+def queue_status(root: str) -> Dict[str, int]:
+    '''
+    Number of shards in each queue state.
+    '''
+    return {state: sum(f.endswith('.json') for f in os.listdir(queue_path(root, state)))
+            for state in QUEUE_DIRS if state != 'parts'}
+
+
+def merge_parts(root: str, allow_partial: bool = False) -> pd.DataFrame:
+    '''
+    Concatenates the partitions written by workers, in shard order. Raises if any shard has
+    not finished, unless `allow_partial` is set.
+    '''
+    status = queue_status(root)
+    unfinished = status['pending'] + status['running'] + status['failed']
+    if unfinished and not allow_partial:
+        raise RuntimeError(f'Cannot merge, {unfinished} shards have not completed: {status}')
+    parts = sorted(f for f in os.listdir(queue_path(root, 'parts')) if f.endswith('.pkl'))
+    frames = [pd.read_pickle(queue_path(root, 'parts', f), compression='gzip') for f in parts]
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        with open(os.path.join(root, 'plan.json')) as f:
+            return pd.DataFrame(columns=planner.plan_columns(json.load(f)))
+    return pd.concat(frames, ignore_index=True)
+
+
+def run_sharded(plan: Dict[str, Any], root: Optional[str] = None, processes: Optional[int] = None,
+                units_per_shard: int = DEFAULT_UNITS_PER_SHARD, quality: Any = None,
+                mp_context: Any = None) -> pd.DataFrame:
+    '''
+    Runs a plan from `plan_gauge_pull` across a pool of `processes` worker processes (one per
+    CPU by default, 0 to run in this process), each writing its shards' partitions under
+    `root`, then merges the partitions. `root` defaults to a temporary directory removed
+    afterwards; give a shared directory to let workers on other nodes (see `main`) help.
+    `mp_context` (from `multiprocessing.get_context`) chooses how worker processes start.
+    '''
+    if root is None:
+        with tempfile.TemporaryDirectory(prefix='gauge_getter_shards_') as tmp:
+            return run_sharded(plan, tmp, processes, units_per_shard, quality, mp_context)
+    enqueue_plan(plan, root, units_per_shard)
+    if processes == 0:
+        run_worker(root, quality)
+    else:
+        processes = processes or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=processes, mp_context=mp_context) as pool:
+            futures = [pool.submit(run_worker, root, quality) for _ in range(processes)]
+            stats = [future.result() for future in futures]
+        log.info(f'Sharded pull complete: {stats}')
+    return merge_parts(root)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    '''
+    Command line entry point for working on a shared queue from several nodes:
+
+        python -m mdba_gauge_getter.sharding enqueue ROOT plan.json
+        python -m mdba_gauge_getter.sharding worker ROOT      # on each node
+        python -m mdba_gauge_getter.sharding merge ROOT out.pkl
+    '''
+    parser = argparse.ArgumentParser(prog='python -m mdba_gauge_getter.sharding')
+    parser.add_argument('command', choices=['enqueue', 'worker', 'requeue', 'status', 'merge'])
+    parser.add_argument('root')
+    parser.add_argument('path', nargs='?', help='plan file (enqueue) or output file (merge)')
+    parser.add_argument('--units-per-shard', type=int, default=DEFAULT_UNITS_PER_SHARD)
+    parser.add_argument('--older-than', type=float, default=3600,
+                        help='requeue shards not touched by their worker for this many '
+                             f'seconds; must be longer than the {SHARD_HEARTBEAT}s heartbeat')
+    parser.add_argument('--include-failed', action='store_true',
+                        help='requeue failed shards as well')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'enqueue':
+        with open(args.path) as f:
+            enqueue_plan(json.load(f), args.root, args.units_per_shard)
+    elif args.command == 'worker':
+        print(json.dumps(run_worker(args.root)))
+    elif args.command == 'requeue':
+        print(json.dumps(requeue_stale(args.root, args.older_than, args.include_failed)))
+    elif args.command == 'status':
+        print(json.dumps(queue_status(args.root)))
+    elif args.command == 'merge':
+        merge_parts(args.root).to_pickle(args.path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import time
+import datetime
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, Optional, Sequence
+from . import gauge_getter
+
+
+INTERVALS = frozenset({'hour', 'day', 'month', 'year'})
+
+# Background work (e.g. prefetching) runs one request at a time per source, spaced at least
+# this many times further apart than interactive requests
+BACKGROUND_INTERVAL_FACTOR = 4
+BACKGROUND_MIN_INTERVAL = 0.5
+
+
+class RateLimiter:
+    '''
+    Limits requests to one source: at most `max_concurrency` in flight, and successive
+    requests started at least `min_interval` seconds apart. Background callers
+    (`acquire(background=True)`) only take a slot while no interactive caller is waiting.
+    '''
+
+    def __init__(self, max_concurrency: int, min_interval: float) -> None:
+        self.max_concurrency = max_concurrency
+        self.min_interval = min_interval
+        self._changed = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._next_start = 0.0
+
+    def acquire(self, background: bool = False, blocking: bool = True) -> bool:
+        '''
+        Takes a slot, waiting for one and then for the spacing since the last start. Without
+        `blocking`, returns False instead of waiting for either.
+        '''
+        with self._changed:
+            if not background:
+                self._waiting += 1
+            try:
+                while self._active >= self.max_concurrency or (background and self._waiting):
+                    if not blocking:
+                        return False
+                    self._changed.wait()
+                now = time.monotonic()
+                wait = self._next_start - now
+                if wait > 0 and not blocking:
+                    return False
+                self._active += 1
+                self._next_start = max(now, self._next_start) + self.min_interval
+            finally:
+                if not background:
+                    self._waiting -= 1
+                    self._changed.notify_all()
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def release(self) -> None:
+        with self._changed:
+            self._active -= 1
+            self._changed.notify_all()
+
+    def __enter__(self) -> 'RateLimiter':
+        self.acquire()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release()
+
+
+class SourceAdapter:
+    '''
+    Describes one data backend and fetches batches of sites from it.
+
+    Each adapter declares the variables, intervals and data types it serves, how many sites one
+    request may carry (`max_sites`), its rate limits (`max_concurrency` requests in flight,
+    `min_interval` seconds between request starts) and a cost model (`request_bytes` of
+    overhead per request plus `row_bytes` per observation) used to estimate payloads.
+    `fallback` names the source to ask when a request returns nothing. Background work is held
+    to the stricter limits of `background_limiter` as well, and takes a slot of `limiter` only
+    while no interactive request is waiting for one (see `limits`).
+    '''
+    kind = ''
+    variables: FrozenSet[str] = frozenset()
+    intervals: FrozenSet[str] = INTERVALS
+    data_types: Optional[FrozenSet[str]] = None
+    request_bytes = 0
+    row_bytes = 0
+    fallback: Optional[str] = None
+
+    def __init__(self, name: str, host: str, max_concurrency: int = 2,
+                 min_interval: float = 0.0, max_sites: int = 1) -> None:
+        self.name = name
+        self.host = host
+        self.max_sites_per_request = max_sites
+        self.limiter = RateLimiter(max_concurrency, min_interval)
+        self.background_limiter = RateLimiter(
+            1, max(min_interval * BACKGROUND_INTERVAL_FACTOR, BACKGROUND_MIN_INTERVAL))
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.name!r}, host={self.host!r})'
+
+    def supports(self, var: str, interval: str, data_type: str) -> bool:
+        interval = gauge_getter.BOM_INTERVAL_ALIASES.get(interval.lower(), interval.lower())
+        return var in self.variables and interval in self.intervals and \
+            (self.data_types is None or data_type in self.data_types)
+
+    def route(self, gauges_by_state: Dict[str, List[str]]) -> List[str]:
+        '''
+        The gauges from `route_gauges` this source is asked for.
+        '''
+        raise NotImplementedError
+
+    def batches(self, sites: Sequence[str]) -> List[List[str]]:
+        return gauge_getter.split_into_chunks(list(sites), self.max_sites_per_request)
+
+    def estimate_bytes(self, rows: int) -> int:
+        return self.request_bytes + rows * self.row_bytes
+
+    def fetch(self, sites: List[str], start: datetime.date, end: datetime.date, var: str,
+              interval: str, data_type: str, **opts: Any) -> List[Any]:
+        '''
+        Fetches one batch of sites, returning rows, or with a `sink` in `opts`, passing
+        columnar batches to it and returning their row counts.
+        '''
+        raise NotImplementedError
+
+
+class KistersSource(SourceAdapter):
+    '''
+    A state portal running Kisters Hydstra (`get_ts_traces`).
+    '''
+    kind = 'kisters'
+    variables = frozenset(gauge_getter.KISTERS_VARIABLES)
+    request_bytes = 600
+    row_bytes = 45
+    fallback = 'BOM'
+
+    def __init__(self, state: str, host: str, data_source: str,
+                 path: str = '/cgi/webservice.exe', max_concurrency: int = 4,
+                 min_interval: float = 0.1, max_sites: int = 5) -> None:
+        super().__init__(state, host, max_concurrency, min_interval, max_sites)
+        self.data_source = data_source
+        self.url = f'https://{host}{path}'
+
+    def route(self, gauges_by_state: Dict[str, List[str]]) -> List[str]:
+        return gauges_by_state.get(self.name, [])
+
+    def fetch(self, sites, start, end, var, interval, data_type, **opts):
+        return gauge_getter.process_gauge_pull(sites, self.name, self.data_source, start, end,
+                                               var, interval, data_type, **opts)
+
+
+class BOMSource(SourceAdapter):
+    '''
+    The Bureau of Meteorology Water Data Online SOS2 service, one gauge per request.
+    '''
+    kind = 'bom'
+    variables = frozenset(gauge_getter.BOM_VARIABLES)
+    request_bytes = 4000
+    row_bytes = 260
+
+    def route(self, gauges_by_state: Dict[str, List[str]]) -> List[str]:
+        return gauges_by_state.get('BOM', [])
+
+    def supports(self, var: str, interval: str, data_type: str) -> bool:
+        try:
+            gauge_getter.bom_procedure(var, interval, data_type)
+        except (AttributeError, NotImplementedError):
+            return False
+        return True
+
+    def fetch(self, sites, start, end, var, interval, data_type, **opts):
+        return gauge_getter.gauge_pull_bom(sites, start, end, var, interval, data_type, **opts)
+
+
+class AquariusSource(SourceAdapter):
+    '''
+    The SA Water Data (Aquarius) bulk export, which serves the uncatalogued gauges in `gauges`
+    (the barrage flows), many datasets per request.
+    '''
+    kind = 'aquarius'
+    variables = frozenset({'F'})
+    intervals = frozenset({'day'})
+    request_bytes = 1500
+    row_bytes = 110
+
+    def __init__(self, name: str, host: str, gauges: Sequence[str], max_concurrency: int = 2,
+                 min_interval: float = 0.0, max_sites: int = 20) -> None:
+        super().__init__(name, host, max_concurrency, min_interval, max_sites)
+        self.gauges = frozenset(gauges)
+
+    def route(self, gauges_by_state: Dict[str, List[str]]) -> List[str]:
+        barrage = [g for g in gauges_by_state.get('rest', []) if g in self.gauges]
+        return list(dict.fromkeys(barrage))
+
+    def fetch(self, sites, start, end, var, interval, data_type, **opts):
+        return gauge_getter.gauge_pull_aq(sites, start, end, var, interval, data_type, **opts)
+
+
+@contextmanager
+def limits(source: SourceAdapter, background: bool = False) -> Iterator[None]:
+    '''
+    Holds a request slot at `source`. Background work takes a slot of the source's
+    `background_limiter` and then a low-priority slot of its shared `limiter`, so it is counted
+    against the source's limits but gives way to interactive requests.
+    '''
+    if not background:
+        with source.limiter:
+            yield
+        return
+    with source.background_limiter:
+        source.limiter.acquire(background=True)
+        try:
+            yield
+        finally:
+            source.limiter.release()
+
+
+_sources: Dict[str, SourceAdapter] = {}
+
+
+def register_source(adapter: SourceAdapter) -> SourceAdapter:
+    '''
+    Adds (or replaces) a source. Sources are routed in the order they were first registered.
+    '''
+    _sources[adapter.name] = adapter
+    return adapter
+
+
+def get_source(name: str) -> SourceAdapter:
+    if name not in _sources:
+        raise KeyError(f'Unknown source \'{name}\', registered sources are {list(_sources)}')
+    return _sources[name]
+
+
+def sources() -> List[SourceAdapter]:
+    return list(_sources.values())
+
+
+register_source(KistersSource('NSW', 'realtimedata.waternsw.com.au', 'CP'))
+register_source(KistersSource('VIC', 'data.water.vic.gov.au', 'PUBLISH'))
+# replace the path when QLD upgrades
+register_source(KistersSource('QLD', 'water-monitoring.information.qld.gov.au', 'AT',
+                              path='/cgi/webservice.pl'))
+register_source(BOMSource('BOM', 'www.bom.gov.au', max_concurrency=2, min_interval=0.2))
+register_source(AquariusSource('SA', 'water.data.sa.gov.au', {'A4261002'}, max_concurrency=2,
+                               min_interval=0.5))
+
+
+def fetch_with_fallback(source: SourceAdapter, sites: List[str], start: datetime.date,
+                        end: datetime.date, var: str, interval: str, data_type: str,
+                        ask: Optional[Callable[[str, List[str]], List[str]]] = None,
+                        background: bool = False, **opts: Any) -> List[Any]:
+    '''
+    Fetches one batch of sites from `source` and, if it returns nothing, asks the source's
+    fallback for the same sites (when the fallback serves the variable). `ask(source, sites)`
+    may narrow the sites put to the fallback. The caller holds a slot at `source`; the
+    fallback request is made within the fallback's own `limits`, as background work with
+    `background`.
+    '''
+    args = (start, end, var, interval, data_type)
+    data = source.fetch(sites, *args, **opts)
+    if len(data) or not source.fallback:
+        return data
+    fallback = get_source(source.fallback)
+    if not fallback.supports(var, interval, data_type):
+        return data
+    sites = ask(fallback.name, sites) if ask is not None else sites
+    if sites:
+        gauge_getter.log.warning(f'Data not available from {source.name} API for {sites}, '
+                                 f'querying {fallback.name}...')
+        with limits(fallback, background):
+            data += fallback.fetch(sites, *args, **opts)
+    return data
+
+
+def schedule(tasks: Sequence[Any], source_of: Callable[[Any], SourceAdapter],
+             run: Callable[[Any], Any], workers: int = 1,
+             background: bool = False) -> List[Any]:
+    '''
+    Runs `run(task)` for every task on up to `workers` threads, each call made within the
+    rate limits of the task's source (`source_of(task)`), as background work with
+    `background` (see `limits`). Results are returned in task order.
+    '''
+    def limited(task):
+        with limits(source_of(task), background):
+            return run(task)
+
+    if workers <= 1:
+        return [limited(task) for task in tasks]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(limited, tasks))
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Sequence, Tuple
+from ._lazy import LazyModule
+
+
+np = LazyModule('numpy')
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.195
+
+
+def haversine_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    '''
+    Great-circle distances in km from one point to many.
+    '''
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def points_in_polygon(lons: np.ndarray, lats: np.ndarray,
+                      polygon: Sequence[Tuple[float, float]]) -> np.ndarray:
+    '''
+    Even-odd ray casting test of many points against one polygon ring of (lon, lat) vertices.
+    '''
+    ring = np.asarray(polygon, dtype='float64')
+    x1, y1 = ring[:, 0], ring[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    px, py = lons[:, None], lats[:, None]
+    crosses = (y1 > py) != (y2 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_at = (x2 - x1) * (py - y1) / (y2 - y1) + x1
+    return np.count_nonzero(crosses & (px < x_at), axis=1) % 2 == 1
+
+
+class GaugeIndex:
+    '''
+    Uniform grid index over the catalogue's gauge coordinates. Gauges are sorted by grid cell,
+    with cells numbered row by row, so the cells a bounding box covers in one grid row form one
+    contiguous slice of the sorted arrays. Candidates from those slices are then filtered exactly
+    with vectorised numpy operations.
+
+    Bounding boxes and polygons use (lon, lat) order, as in GeoJSON. All queries return gauge
+    numbers, without duplicates, in catalogue order (nearest-k in order of distance).
+    '''
+
+    def __init__(self, catalogue: Any, cell_size: float = 0.5) -> None:
+        located = catalogue.dropna(subset=['lat', 'long'])
+        self.cell_size = cell_size
+        self.lats = located['lat'].to_numpy(dtype='float64')
+        self.lons = located['long'].to_numpy(dtype='float64')
+        self.numbers = located['gauge_number'].to_numpy(dtype=object)
+        self.lat0 = self.lats.min() if len(self.lats) else 0.0
+        self.lon0 = self.lons.min() if len(self.lons) else 0.0
+        ix, iy = self._cell(self.lons, self.lats)
+        self.nx = int(ix.max()) + 1 if len(ix) else 1
+        self.ny = int(iy.max()) + 1 if len(iy) else 1
+        cells = iy * self.nx + ix
+        self.order = np.argsort(cells, kind='stable')
+        self.sorted_cells = cells[self.order]
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def _cell(self, lons: Any, lats: Any) -> Tuple[np.ndarray, np.ndarray]:
+        ix = np.floor((np.asarray(lons) - self.lon0) / self.cell_size).astype('int64')
+        iy = np.floor((np.asarray(lats) - self.lat0) / self.cell_size).astype('int64')
+        return ix, iy
+
+    def _gauges(self, rows: np.ndarray) -> List[str]:
+        return list(dict.fromkeys(self.numbers[np.sort(rows)]))
+
+    def _bbox_rows(self, min_lon: float, min_lat: float, max_lon: float,
+                   max_lat: float) -> np.ndarray:
+        (ix0, ix1), (iy0, iy1) = self._cell([min_lon, max_lon], [min_lat, max_lat])
+        ix0, ix1 = max(ix0, 0), min(ix1, self.nx - 1)
+        iy0, iy1 = max(iy0, 0), min(iy1, self.ny - 1)
+        if ix0 > ix1 or iy0 > iy1:
+            return np.empty(0, dtype='int64')
+        rows_of_cells = np.arange(iy0, iy1 + 1) * self.nx
+        starts = np.searchsorted(self.sorted_cells, rows_of_cells + ix0, side='left')
+        ends = np.searchsorted(self.sorted_cells, rows_of_cells + ix1, side='right')
+        candidates = np.concatenate([self.order[s:e] for s, e in zip(starts, ends)])
+        lons, lats = self.lons[candidates], self.lats[candidates]
+        inside = (lons >= min_lon) & (lons <= max_lon) & (lats >= min_lat) & (lats <= max_lat)
+        return candidates[inside]
+
+    def bbox(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> List[str]:
+        '''
+        Gauges inside a bounding box.
+        '''
+        return self._gauges(self._bbox_rows(min_lon, min_lat, max_lon, max_lat))
+
+    def bbox_many(self, boxes: Sequence[Tuple[float, float, float, float]],
+                  chunk: int = 256) -> List[List[str]]:
+        '''
+        Answers many bounding-box queries at once by broadcasting every box against every
+        gauge, `chunk` boxes at a time. Much cheaper per query than calling `bbox` in a loop
+        when there are thousands of boxes.
+        '''
+        boxes = np.asarray(boxes, dtype='float64').reshape(-1, 4)
+        results: List[List[str]] = []
+        for i in range(0, len(boxes), chunk):
+            b = boxes[i:i + chunk, :, None]
+            inside = (self.lons >= b[:, 0]) & (self.lons <= b[:, 2]) & \
+                (self.lats >= b[:, 1]) & (self.lats <= b[:, 3])
+            results += [list(dict.fromkeys(self.numbers[row])) for row in inside]
+        return results
+
+    def _radius_rows(self, lat: float, lon: float, radius_km: float) -> Tuple[np.ndarray, np.ndarray]:
+        dlat = radius_km / KM_PER_DEGREE
+        dlon = radius_km / (KM_PER_DEGREE * max(np.cos(np.radians(lat)), 1e-6))
+        rows = self._bbox_rows(lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+        distances = haversine_km(lat, lon, self.lats[rows], self.lons[rows])
+        inside = distances <= radius_km
+        return rows[inside], distances[inside]
+
+    def radius(self, lat: float, lon: float, radius_km: float) -> List[str]:
+        '''
+        Gauges within `radius_km` of a point.
+        '''
+        return self._gauges(self._radius_rows(lat, lon, radius_km)[0])
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> List[str]:
+        '''
+        The `k` gauges closest to a point, nearest first. The search radius doubles until it
+        holds `k` gauges, so every gauge nearer than the k-th has been considered.
+        '''
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+        radius_km = self.cell_size * KM_PER_DEGREE
+        while True:
+            rows, distances = self._radius_rows(lat, lon, radius_km)
+            if len(rows) >= k or radius_km > 2 * np.pi * EARTH_RADIUS_KM:
+                break
+            radius_km *= 2
+        closest = np.argsort(distances, kind='stable')[:k]
+        return list(dict.fromkeys(self.numbers[rows[closest]]))
+
+    def polygon(self, polygon: Sequence[Tuple[float, float]]) -> List[str]:
+        '''
+        Gauges inside a polygon given as a ring of (lon, lat) vertices.
+        '''
+        ring = np.asarray(polygon, dtype='float64')
+        rows = self._bbox_rows(ring[:, 0].min(), ring[:, 1].min(),
+                               ring[:, 0].max(), ring[:, 1].max())
+        return self._gauges(rows[points_in_polygon(self.lons[rows], self.lats[rows], ring)])
+
+    def region(self, region: Dict[str, Any]) -> List[str]:
+        '''
+        Resolves a region description to gauge numbers. Accepted forms are:
+
+        - `{'bbox': (min_lon, min_lat, max_lon, max_lat)}`
+        - `{'lat': ..., 'lon': ..., 'radius_km': ...}`
+        - `{'lat': ..., 'lon': ..., 'nearest': k}`
+        - `{'polygon': [(lon, lat), ...]}`, or a GeoJSON Polygon/MultiPolygon geometry
+          (holes are ignored)
+        '''
+        if region.get('type') == 'Polygon':
+            return self.polygon(region['coordinates'][0])
+        if region.get('type') == 'MultiPolygon':
+            found = [g for part in region['coordinates'] for g in self.polygon(part[0])]
+            return list(dict.fromkeys(found))
+        if 'bbox' in region:
+            return self.bbox(*region['bbox'])
+        if 'polygon' in region:
+            return self.polygon(region['polygon'])
+        if 'radius_km' in region:
+            return self.radius(region['lat'], region['lon'], region['radius_km'])
+        if 'nearest' in region:
+            return self.nearest(region['lat'], region['lon'], region['nearest'])
+        raise ValueError(f'Unrecognised region {region}, expected one of bbox, polygon, '
+                         'lat/lon with radius_km, or lat/lon with nearest')
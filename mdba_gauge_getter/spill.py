@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import os
+import shutil
+import logging
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Union
+from ._lazy import LazyModule
+
+
+pd = LazyModule('pandas')
+
+log = logging.getLogger(__name__)
+
+SIZE_UNITS = {
+    'B': 1,
+    'KB': 1024,
+    'MB': 1024 ** 2,
+    'GB': 1024 ** 3,
+}
+
+# Columns holding a handful of distinct strings, stored as categoricals while buffered
+CATEGORICAL_COLUMNS = ('DATASOURCEID', 'SITEID', 'SUBJECTID', 'VAR')
+
+
+def parse_size(size: Union[int, str]) -> int:
+    '''
+    Converts a memory budget such as `536870912`, `'512MB'` or `'2 GB'` into bytes.
+    '''
+    if isinstance(size, int):
+        return size
+    text = str(size).strip().upper().replace(' ', '')
+    for unit in sorted(SIZE_UNITS, key=len, reverse=True):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * SIZE_UNITS[unit])
+    return int(float(text))
+
+
+def batch_len(batch: Dict[str, Any]) -> int:
+    '''
+    Returns the number of rows in a columnar batch (a dict of equal-length arrays).
+    '''
+    for column in batch.values():
+        return len(column)
+    return 0
+
+
+class SpillBuffer:
+    '''
+    Collects columnar batches of extracted observations while keeping no more than
+    `max_memory` bytes of them in memory. When the budget is reached the buffered batches
+    are written out as one compressed part, either to a temporary directory or, when given,
+    handed to `sink` (a callable taking a DataFrame) instead.
+
+    `peak_bytes` records the largest amount of data held in the buffer at once.
+    '''
+
+    def __init__(self, max_memory: Union[int, str],
+                 sink: Optional[Callable[[pd.DataFrame], Any]] = None,
+                 spill_dir: Optional[str] = None, compression: str = 'gzip') -> None:
+        self.max_memory = parse_size(max_memory)
+        if self.max_memory <= 0:
+            raise ValueError(f'max_memory must be positive, got {max_memory}')
+        self.sink = sink
+        self.compression = compression
+        self._spill_dir = spill_dir
+        self._tmpdir: Optional[str] = None
+        self._frames: List[pd.DataFrame] = []
+        self._parts: List[str] = []
+        self.buffered_bytes = 0
+        self.peak_bytes = 0
+        self.rows = 0
+        self.spills = 0
+
+    def __enter__(self) -> 'SpillBuffer':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def append(self, batch: Dict[str, Any], **constants: Any) -> int:
+        '''
+        Buffers one batch, adding any `constants` as extra columns, and spills if the buffer
+        now exceeds its budget. Returns the number of rows added.
+        '''
+        n = batch_len(batch)
+        if not n:
+            return 0
+        frame = pd.DataFrame(batch)
+        for name, value in constants.items():
+            frame[name] = value
+        for name in CATEGORICAL_COLUMNS:
+            if name in frame:
+                frame[name] = frame[name].astype('category')
+        self._frames.append(frame)
+        self.buffered_bytes += int(frame.memory_usage(deep=True).sum())
+        self.peak_bytes = max(self.peak_bytes, self.buffered_bytes)
+        self.rows += n
+        if self.buffered_bytes >= self.max_memory:
+            self.spill()
+        return n
+
+    def _collect(self) -> pd.DataFrame:
+        frame = pd.concat(self._frames, ignore_index=True)
+        self._frames = []
+        self.buffered_bytes = 0
+        return frame
+
+    def spill(self) -> None:
+        '''
+        Writes out everything currently buffered as one part.
+        '''
+        if not self._frames:
+            return
+        frame = self._collect()
+        self.spills += 1
+        if self.sink is not None:
+            self.sink(frame)
+            return
+        if self._tmpdir is None:
+            self._tmpdir = tempfile.mkdtemp(prefix='gauge_getter_', dir=self._spill_dir)
+        path = os.path.join(self._tmpdir, f'part-{len(self._parts):05d}.pkl')
+        frame.to_pickle(path, compression=self.compression)
+        self._parts.append(path)
+        log.debug(f'Spilled {len(frame)} rows to \'{path}\'')
+
+    def result(self) -> Optional[pd.DataFrame]:
+        '''
+        Merges the spilled parts and whatever is still buffered into a single DataFrame.
+        With a `sink`, the remaining rows are flushed to it instead and None is returned.
+        '''
+        if self.sink is not None:
+            self.spill()
+            return None
+        frames = [pd.read_pickle(path, compression=self.compression) for path in self._parts]
+        if self._frames:
+            frames.append(self._collect())
+        if not frames:
+            return pd.DataFrame(columns=['DATASOURCEID', 'SITEID', 'SUBJECTID', 'DATETIME',
+                                         'VALUE', 'QUALITYCODE'])
+        merged = pd.concat(frames, ignore_index=True)
+        del frames
+        for name in CATEGORICAL_COLUMNS:
+            if name in merged and merged[name].dtype != 'category':
+                merged[name] = merged[name].astype('category')
+        self.close()
+        return merged
+
+    def close(self) -> None:
+        '''
+        Removes any temporary spill files.
+        '''
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+        self._parts = []
+
+    def stats(self) -> Dict[str, int]:
+        return {'rows': self.rows, 'spills': self.spills, 'peak_bytes': self.peak_bytes,
+                'max_memory': self.max_memory}
+
@@ -0,0 +1,504 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple, Union
+from ._lazy import LazyModule
+from .quality import policy_key
+from .spill import CATEGORICAL_COLUMNS, parse_size
+
+
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+
+DATA_COLUMNS = ['DATASOURCEID', 'SITEID', 'SUBJECTID', 'DATETIME', 'VALUE', 'QUALITYCODE']
+
+# Identifies one stored series: (site, var, interval, data_type, data_source, quality), where
+# data_source is the `gauge_pull` argument the series was pulled with and quality the
+# `policy_key` of the quality policy it was screened with
+SeriesKey = Tuple[str, str, str, str, str, str]
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    '''
+    Merges overlapping or adjacent inclusive (start, end) day ordinals.
+    '''
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def covers(ranges: List[Tuple[int, int]], start: datetime.date, end: datetime.date) -> bool:
+    start_day, end_day = start.toordinal(), end.toordinal()
+    return any(lo <= start_day and end_day <= hi for lo, hi in ranges)
+
+
+def window(start: datetime.date, end: datetime.date) -> Tuple[Any, Any]:
+    '''
+    The half-open [start, day after end) timestamp bounds of a window, so sub-daily values on
+    its last day fall inside it.
+    '''
+    return pd.Timestamp(start), pd.Timestamp(end + ONE_DAY)
+
+
+def to_rows_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Returns a stored frame in `gauge_pull`'s row format, with DATETIME as `datetime.date`.
+    '''
+    frame = frame.reset_index(drop=True)
+    frame['DATETIME'] = pd.DatetimeIndex(frame['DATETIME']).date
+    return frame
+
+
+class MemoryStore:
+    '''
+    Holds pulled series in memory, with the date ranges each (site, var, interval,
+    data_type) series has been fetched for, so repeated pulls can be served locally.
+
+    A store is passed to `gauge_pull(store=...)`. Stores implement `write`, which records
+    rows along with coverage of the window for the sites it is given (a site given without
+    rows is held as empty), and `read`, which returns rows only for the sites whose coverage
+    includes the whole requested window. Series pulled with different `data_source`
+    arguments, or screened with different `quality` policies, are held apart.
+    '''
+
+    def __init__(self) -> None:
+        self._frames: Dict[Tuple[str, str, str, str, str], pd.DataFrame] = {}
+        self._coverage: Dict[SeriesKey, List[Tuple[int, int]]] = {}
+        self._lock = threading.RLock()
+
+    def coverage(self, site: str, var: str, interval: str, data_type: str,
+                 data_source: str = 'state',
+                 quality: Any = None) -> List[Tuple[datetime.date, datetime.date]]:
+        '''
+        Date ranges held for one series.
+        '''
+        series = (site, var, interval, data_type, data_source, policy_key(quality))
+        with self._lock:
+            ranges = self._coverage.get(series, [])
+        return [(datetime.date.fromordinal(lo), datetime.date.fromordinal(hi))
+                for lo, hi in ranges]
+
+    def covered_sites(self, sites: Sequence[str], start: datetime.date, end: datetime.date,
+                      var: str, interval: str, data_type: str,
+                      data_source: str = 'state', quality: Any = None) -> List[str]:
+        series = (var, interval, data_type, data_source, policy_key(quality))
+        with self._lock:
+            return [site for site in sites
+                    if covers(self._coverage.get((site,) + series, []), start, end)]
+
+    def write(self, frame: pd.DataFrame, sites: Sequence[str], start: datetime.date,
+              end: datetime.date, var: str, interval: str, data_type: str,
+              data_source: str = 'state', quality: Any = None) -> None:
+        '''
+        Stores the rows of `frame` (pulled for `sites` over `start`..`end`), replacing any rows
+        already held for those sites in that window.
+        '''
+        frame = pd.DataFrame(frame, columns=DATA_COLUMNS).copy()
+        frame['SITEID'] = frame['SITEID'].astype(str)
+        frame['DATETIME'] = pd.to_datetime(pd.Series(frame['DATETIME'], dtype=object))
+        frame['VALUE'] = pd.to_numeric(frame['VALUE'], errors='coerce')
+        sites = [str(site) for site in sites]
+        lo, hi = window(start, end)
+        with self._lock:
+            key = (var, interval, data_type, data_source, policy_key(quality))
+            held = self._frames.get(key)
+            if held is not None:
+                replaced = held['SITEID'].isin(sites) & \
+                    (held['DATETIME'] >= lo) & (held['DATETIME'] < hi)
+                frame = pd.concat([held[~replaced], frame], ignore_index=True)
+            self._frames[key] = frame
+            for site in sites:
+                series = (site, var, interval, data_type, data_source, policy_key(quality))
+                self._coverage[series] = merge_ranges(
+                    self._coverage.get(series, []) + [(start.toordinal(), end.toordinal())])
+
+    def read(self, sites: Sequence[str], start: datetime.date, end: datetime.date, var: str,
+             interval: str, data_type: str,
+             data_source: str = 'state',
+             quality: Any = None) -> Tuple[pd.DataFrame, List[str]]:
+        '''
+        Returns the rows held for `sites` over `start`..`end`, and the sites they cover. Sites
+        whose coverage does not include the whole window are left out of both.
+        '''
+        covered = self.covered_sites([str(site) for site in sites], start, end, var, interval,
+                                     data_type, data_source, quality)
+        with self._lock:
+            held = self._frames.get((var, interval, data_type, data_source,
+                                     policy_key(quality)))
+        if held is None or not covered:
+            return pd.DataFrame(columns=DATA_COLUMNS), covered
+        lo, hi = window(start, end)
+        selected = held['SITEID'].isin(covered) & \
+            (held['DATETIME'] >= lo) & (held['DATETIME'] < hi)
+        return to_rows_frame(held[selected].sort_values(['SITEID', 'DATETIME'], kind='stable')), \
+            covered
+
+    def clear(self) -> None:
+        with self._lock:
+            self._frames.clear()
+            self._coverage.clear()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    site TEXT NOT NULL, var TEXT NOT NULL, interval TEXT NOT NULL, data_type TEXT NOT NULL,
+    data_source TEXT NOT NULL, policy TEXT NOT NULL, date TEXT NOT NULL,
+    source TEXT NOT NULL, subject TEXT, value REAL, quality INTEGER
+);
+CREATE INDEX IF NOT EXISTS observations_series
+    ON observations (site, var, interval, data_type, data_source, policy, date);
+CREATE TABLE IF NOT EXISTS coverage (
+    site TEXT NOT NULL, var TEXT NOT NULL, interval TEXT NOT NULL, data_type TEXT NOT NULL,
+    data_source TEXT NOT NULL, policy TEXT NOT NULL, start INTEGER NOT NULL,
+    end INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coverage_series
+    ON coverage (site, var, interval, data_type, data_source, policy);
+"""
+
+# Observation timestamps are stored in full, so hourly rows are kept apart and a window is a
+# lexicographic range of the stored text
+SQLITE_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+SERIES_WHERE = ('site = ? AND var = ? AND interval = ? AND data_type = ? AND data_source = ? '
+                'AND policy = ?')
+
+
+
+class SQLiteStore:
+    '''
+    A store, as `MemoryStore`, kept in one SQLite file which several processes (notebooks,
+    batch jobs, API workers) can share.
+
+    Observations are indexed by series (site, var, interval, data_type, data_source,
+    quality policy) and timestamp, so a window of one series is an indexed range read. Every
+    row is kept, so several values with one timestamp (e.g. hourly values extracted per day)
+    are all read back. The database runs in WAL mode: any number of processes read while one
+    writes, and writers queue for up to `timeout` seconds. Each
+    `write` replaces the window it covers and records its coverage in a single transaction.
+    Connections are opened per thread and per process, so a store may be shared by threads
+    and passed to forked workers.
+    '''
+
+    def __init__(self, path: str, timeout: float = 60) -> None:
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self.connection().executescript(SQLITE_SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            local.connection, local.pid = connection, os.getpid()
+        return local.connection
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {'path': self.path, 'timeout': self.timeout}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state['path'], state['timeout'])
+
+    def _ranges(self, connection: sqlite3.Connection, series: SeriesKey) -> List[Tuple[int, int]]:
+        return connection.execute(f'SELECT start, end FROM coverage WHERE {SERIES_WHERE}',
+                                  series).fetchall()
+
+    def coverage(self, site: str, var: str, interval: str, data_type: str,
+                 data_source: str = 'state',
+                 quality: Any = None) -> List[Tuple[datetime.date, datetime.date]]:
+        ranges = self._ranges(self.connection(), (site, var, interval, data_type, data_source,
+                                                  policy_key(quality)))
+        return [(datetime.date.fromordinal(lo), datetime.date.fromordinal(hi))
+                for lo, hi in merge_ranges(ranges)]
+
+    def covered_sites(self, sites: Sequence[str], start: datetime.date, end: datetime.date,
+                      var: str, interval: str, data_type: str,
+                      data_source: str = 'state', quality: Any = None) -> List[str]:
+        connection = self.connection()
+        series = (var, interval, data_type, data_source, policy_key(quality))
+        return [site for site in sites
+                if covers(self._ranges(connection, (site,) + series), start, end)]
+
+    def write(self, frame: pd.DataFrame, sites: Sequence[str], start: datetime.date,
+              end: datetime.date, var: str, interval: str, data_type: str,
+              data_source: str = 'state', quality: Any = None) -> None:
+        '''
+        Stores the rows of `frame` (pulled for `sites` over `start`..`end`), replacing any rows
+        already held for those sites in that window.
+        '''
+        frame = pd.DataFrame(frame, columns=DATA_COLUMNS)
+        dates = pd.DatetimeIndex(pd.to_datetime(pd.Series(frame['DATETIME'], dtype=object)))
+        values = pd.to_numeric(frame['VALUE'], errors='coerce').astype(float)
+        policy = policy_key(quality)
+        rows = [(str(site), var, interval, data_type, data_source, policy, date, str(source),
+                 subject, None if value != value else value,
+                 None if pd.isna(code) else int(code))
+                for source, site, subject, date, value, code in zip(
+                    frame['DATASOURCEID'], frame['SITEID'], frame['SUBJECTID'],
+                    dates.strftime(SQLITE_TIME_FORMAT), values, frame['QUALITYCODE'])]
+        sites = [str(site) for site in sites]
+        bounds = (start.isoformat(), (end + ONE_DAY).isoformat())
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for site in sites:
+                series = (site, var, interval, data_type, data_source, policy)
+                connection.execute(f'DELETE FROM observations WHERE {SERIES_WHERE} '
+                                   'AND date >= ? AND date < ?', series + bounds)
+                ranges = merge_ranges(self._ranges(connection, series)
+                                      + [(start.toordinal(), end.toordinal())])
+                connection.execute(f'DELETE FROM coverage WHERE {SERIES_WHERE}', series)
+                connection.executemany('INSERT INTO coverage VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                       [series + r for r in ranges])
+            connection.executemany(
+                'INSERT INTO observations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def read(self, sites: Sequence[str], start: datetime.date, end: datetime.date, var: str,
+             interval: str, data_type: str,
+             data_source: str = 'state',
+             quality: Any = None) -> Tuple[pd.DataFrame, List[str]]:
+        '''
+        Returns the rows held for `sites` over `start`..`end`, and the sites they cover. Sites
+        whose coverage does not include the whole window are left out of both.
+        '''
+        covered = self.covered_sites([str(site) for site in sites], start, end, var, interval,
+                                     data_type, data_source, quality)
+        connection = self.connection()
+        rows = []
+        for site in sorted(covered):
+            rows += connection.execute(
+                'SELECT source, site, subject, date, value, quality FROM observations '
+                f'WHERE {SERIES_WHERE} AND date >= ? AND date < ? ORDER BY date, rowid',
+                (site, var, interval, data_type, data_source, policy_key(quality),
+                 start.isoformat(), (end + ONE_DAY).isoformat())).fetchall()
+        frame = pd.DataFrame(rows, columns=DATA_COLUMNS)
+        if not len(frame):
+            return frame, covered
+        frame['VALUE'] = frame['VALUE'].astype(float)
+        return to_rows_frame(frame), covered
+
+    def clear(self) -> None:
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        connection.execute('DELETE FROM observations')
+        connection.execute('DELETE FROM coverage')
+        connection.execute('COMMIT')
+
+
+class CachedResult:
+    '''
+    One result held by a `ResultCache`: its rows sorted by site and date, with string columns
+    as categoricals, the row range of each site and the day ranges each site covers.
+    '''
+
+    def __init__(self, frame: pd.DataFrame, sites: Sequence[str], start: datetime.date,
+                 end: datetime.date) -> None:
+        frame = pd.DataFrame(frame, columns=DATA_COLUMNS).copy()
+        frame['SITEID'] = frame['SITEID'].astype(str)
+        frame['DATETIME'] = pd.to_datetime(pd.Series(frame['DATETIME'], dtype=object))
+        frame['VALUE'] = pd.to_numeric(frame['VALUE'], errors='coerce')
+        frame = frame.sort_values(['SITEID', 'DATETIME'], kind='stable').reset_index(drop=True)
+        for name in CATEGORICAL_COLUMNS:
+            if name in frame:
+                frame[name] = frame[name].astype('category')
+        self.ranges = {str(site): [(start.toordinal(), end.toordinal())] for site in sites}
+        self._index(frame)
+
+    def _index(self, frame: pd.DataFrame) -> None:
+        self.frame = frame
+        self.dates = frame['DATETIME'].to_numpy(dtype='datetime64[ns]')
+        ids = frame['SITEID'].astype(str).to_numpy()
+        bounds = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1], True]) if len(ids) else []
+        self.rows = {ids[lo]: (lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])}
+        self.nbytes = int(frame.memory_usage(deep=True).sum())
+
+    @property
+    def sites(self) -> FrozenSet[str]:
+        return frozenset(self.ranges)
+
+    def covers(self, site: str, start: datetime.date, end: datetime.date) -> bool:
+        return covers(self.ranges.get(site, []), start, end)
+
+    def positions(self, site: str, start: datetime.date, end: datetime.date) -> Any:
+        lo, hi = self.rows.get(site, (0, 0))
+        dates = self.dates[lo:hi]
+        first = lo + np.searchsorted(dates, np.datetime64(start, 'ns'), side='left')
+        last = lo + np.searchsorted(dates, np.datetime64(end + ONE_DAY, 'ns'), side='left')
+        return np.arange(first, last)
+
+    def exclude(self, sites: Sequence[str], start: datetime.date, end: datetime.date) -> None:
+        '''
+        Drops the rows and coverage of `sites` over `start`..`end`, keeping the rest of their
+        windows, and recomputes `nbytes`.
+        '''
+        sites = [site for site in sites if site in self.ranges]
+        if not sites:
+            return
+        start_day, end_day = start.toordinal(), end.toordinal()
+        for site in sites:
+            kept = []
+            for lo, hi in self.ranges[site]:
+                if lo < start_day:
+                    kept.append((lo, min(hi, start_day - 1)))
+                if hi > end_day:
+                    kept.append((max(lo, end_day + 1), hi))
+            if kept:
+                self.ranges[site] = kept
+            else:
+                del self.ranges[site]
+        dropped = np.zeros(len(self.frame), dtype=bool)
+        for site in sites:
+            dropped[self.positions(site, start, end)] = True
+        if dropped.any():
+            self._index(self.frame[~dropped].reset_index(drop=True))
+
+
+class ResultCache:
+    '''
+    A process-level store of recent pull results, bounded to `max_bytes` (an int or a size
+    such as '256MB') with least-recently-used eviction.
+
+    Each `write` is held whole, as sorted columnar data with the row range of every site, so
+    any later request for a subset of its gauges over a window inside its own is answered
+    by slicing, without filtering the whole result. A write takes the dates it covers out of
+    older results for the same gauges, which keep answering for the rest of their windows.
+    Gauges not held are pulled upstream as usual. `stats` reports hit ratios by request and by gauge.
+    '''
+
+    def __init__(self, max_bytes: Union[int, str] = '256MB') -> None:
+        self.max_bytes = parse_size(max_bytes)
+        self._results: OrderedDict[int, Tuple[Tuple[str, str, str, str, str], CachedResult]] = \
+            OrderedDict()
+        self._next_id = 0
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._counts = {'requests': 0, 'hits': 0, 'partial_hits': 0, 'misses': 0,
+                        'gauges_requested': 0, 'gauges_served': 0, 'evictions': 0}
+
+    def _find(self, key: Tuple[str, str, str, str, str], site: str, start: datetime.date,
+              end: datetime.date) -> Optional[int]:
+        # Newest first, so a refreshed result wins over an older one
+        for result_id in reversed(self._results):
+            result_key, result = self._results[result_id]
+            if result_key == key and result.covers(site, start, end):
+                return result_id
+        return None
+
+    def coverage(self, site: str, var: str, interval: str, data_type: str,
+                 data_source: str = 'state',
+                 quality: Any = None) -> List[Tuple[datetime.date, datetime.date]]:
+        series = (var, interval, data_type, data_source, policy_key(quality))
+        with self._lock:
+            ranges = [held for key, result in self._results.values() if key == series
+                      for held in result.ranges.get(site, [])]
+        return [(datetime.date.fromordinal(lo), datetime.date.fromordinal(hi))
+                for lo, hi in merge_ranges(ranges)]
+
+    def covered_sites(self, sites: Sequence[str], start: datetime.date, end: datetime.date,
+                      var: str, interval: str, data_type: str,
+                      data_source: str = 'state', quality: Any = None) -> List[str]:
+        key = (var, interval, data_type, data_source, policy_key(quality))
+        with self._lock:
+            return [site for site in sites if self._find(key, site, start, end) is not None]
+
+    def write(self, frame: pd.DataFrame, sites: Sequence[str], start: datetime.date,
+              end: datetime.date, var: str, interval: str, data_type: str,
+              data_source: str = 'state', quality: Any = None) -> None:
+        '''
+        Holds the rows of `frame` (pulled for `sites` over `start`..`end`), in place of any held
+        for those sites over that window, evicting the least recently used results while over
+        budget. A result larger than the whole budget is not held.
+        '''
+        result = CachedResult(frame, sites, start, end)
+        key = (var, interval, data_type, data_source, policy_key(quality))
+        with self._lock:
+            # Older results keep answering for these sites outside the new window only
+            for result_id, (held_key, held) in list(self._results.items()):
+                if held_key != key:
+                    continue
+                self._bytes -= held.nbytes
+                held.exclude(list(result.sites), start, end)
+                if held.sites:
+                    self._bytes += held.nbytes
+                else:
+                    del self._results[result_id]
+            if result.nbytes > self.max_bytes:
+                return
+            self._results[self._next_id] = (key, result)
+            self._next_id += 1
+            self._bytes += result.nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._results.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self._counts['evictions'] += 1
+
+    def read(self, sites: Sequence[str], start: datetime.date, end: datetime.date, var: str,
+             interval: str, data_type: str,
+             data_source: str = 'state',
+             quality: Any = None) -> Tuple[pd.DataFrame, List[str]]:
+        '''
+        Returns the rows held for `sites` over `start`..`end`, and the sites they cover. Sites
+        not inside one held result are left out of both.
+        '''
+        key = (var, interval, data_type, data_source, policy_key(quality))
+        sites = [str(site) for site in sites]
+        parts, covered = [], []
+        with self._lock:
+            for site in sites:
+                result_id = self._find(key, site, start, end)
+                if result_id is None:
+                    continue
+                self._results.move_to_end(result_id)
+                result = self._results[result_id][1]
+                parts.append(result.frame.iloc[result.positions(site, start, end)])
+                covered.append(site)
+            self._counts['requests'] += 1
+            self._counts['gauges_requested'] += len(sites)
+            self._counts['gauges_served'] += len(covered)
+            outcome = 'hits' if len(covered) == len(sites) else \
+                'partial_hits' if covered else 'misses'
+            self._counts[outcome] += 1
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return pd.DataFrame(columns=DATA_COLUMNS), covered
+        frame = pd.concat(parts, ignore_index=True)
+        for name in CATEGORICAL_COLUMNS:
+            if name in frame:
+                frame[name] = frame[name].astype(object)
+        return to_rows_frame(frame), covered
+
+    def stats(self) -> Dict[str, Any]:
+        '''
+        Counts of reads which were served whole (`hits`), in part (`partial_hits`) or not at
+        all (`misses`), the share of requests and of requested gauges served, and the bytes
+        and results held.
+        '''
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._counts)
+            stats['hit_ratio'] = stats['hits'] / stats['requests'] if stats['requests'] else 0.0
+            stats['gauge_hit_ratio'] = stats['gauges_served'] / stats['gauges_requested'] \
+                if stats['gauges_requested'] else 0.0
+            stats['bytes'] = self._bytes
+            stats['results'] = len(self._results)
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+            self._bytes = 0
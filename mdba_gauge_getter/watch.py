@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import logging
+import datetime
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from ._lazy import LazyModule
+from . import gauge_getter
+from .routing import SOURCE_GROUPS
+
+
+pd = LazyModule('pandas')
+
+log = logging.getLogger(__name__)
+
+
+def same(known: Optional[Tuple[Any, Any]], observed: Tuple[Any, Any]) -> bool:
+    '''
+    Whether a row's (value, quality code) is unchanged, treating missing values as equal.
+    '''
+    if known is None:
+        return False
+    return all(a == b or (a != a and b != b) for a, b in zip(known, observed))
+
+
+class GaugeWatcher:
+    '''
+    Polls a set of gauges for new data. For each gauge the watcher remembers the latest date
+    it has received, and each poll only asks for data from `overlap_days` before that date,
+    so provisional values revised upstream are picked up without downloading the whole
+    window again. Gauges not seen yet are requested over the last `lookback_days`.
+
+    Gauges are routed as `gauge_pull` routes them, and each source's gauges are polled
+    together from the earliest of their windows, so every poll batches a portal's sites into
+    shared requests. Timestamps are pulled at full resolution (`timestamps='datetime'`) and
+    rows are told apart by source, site and timestamp, so hourly values and gauges served by
+    two portals are tracked separately. `callback` is called with a DataFrame of only the rows
+    which are new or whose value or quality code has changed since they were last seen, with
+    DATETIME a timezone-aware column.
+    '''
+
+    def __init__(self, gauges: List[str], var: str = 'F', interval: str = 'day',
+                 callback: Optional[Callable[[pd.DataFrame], Any]] = None,
+                 period: float = 900, data_type: str = 'mean', data_source: str = 'state',
+                 lookback_days: int = 7, overlap_days: int = 2, quality: Any = None) -> None:
+        self.gauges = list(dict.fromkeys(str(g) for g in gauges))
+        self.var = var
+        self.interval = interval
+        self.callback = callback
+        self.period = period
+        self.data_type = data_type
+        self.data_source = data_source
+        self.lookback_days = lookback_days
+        self.overlap_days = overlap_days
+        self.quality = quality
+        self.last_seen: Dict[str, datetime.date] = {}
+        # (value, quality code) by (source, site, timestamp) of every row still inside a
+        # gauge's overlap window
+        self._known: Dict[Tuple[str, str, Any], Tuple[Any, Any]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.polls = 0
+
+    def window_start(self, gauge: str, today: datetime.date) -> datetime.date:
+        if gauge in self.last_seen:
+            start = self.last_seen[gauge] - datetime.timedelta(days=self.overlap_days)
+        else:
+            start = today - datetime.timedelta(days=self.lookback_days)
+        return min(start, today)
+
+    def windows(self, today: datetime.date) -> Dict[str, Tuple[datetime.date, List[str]]]:
+        '''
+        Gauges to poll grouped by the source they are routed to, each group with the earliest
+        window start among its gauges.
+        '''
+        from .sources import sources # pylint: disable=import-outside-toplevel
+        routed = gauge_getter.route_gauges(self.gauges, self.data_source)
+        groups: Dict[str, Tuple[datetime.date, List[str]]] = {}
+        for source in sources():
+            gauges = source.route(routed)
+            if gauges:
+                groups[source.name] = (min(self.window_start(g, today) for g in gauges), gauges)
+        return groups
+
+    def changes(self, frame: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Selects the rows of a poll which are new or revised, and remembers them.
+        '''
+        if frame is None or not len(frame):
+            return pd.DataFrame(columns=gauge_getter.DATA_COLUMNS)
+        keys = list(zip(frame['DATASOURCEID'].astype(str), frame['SITEID'].astype(str),
+                        frame['DATETIME']))
+        observed = list(zip(frame['VALUE'], frame['QUALITYCODE']))
+        changed = [not same(self._known.get(key), obs) for key, obs in zip(keys, observed)]
+        for key, obs in zip(keys, observed):
+            self._known[key] = obs
+            _, site, timestamp = key
+            date = timestamp.date()
+            if site not in self.last_seen or date > self.last_seen[site]:
+                self.last_seen[site] = date
+        self._prune()
+        return frame[changed].reset_index(drop=True)
+
+    def _prune(self) -> None:
+        overlap = datetime.timedelta(days=self.overlap_days)
+        self._known = {(source, site, timestamp): obs
+                       for (source, site, timestamp), obs in self._known.items()
+                       if site not in self.last_seen
+                       or timestamp.date() >= self.last_seen[site] - overlap}
+
+    def poll(self, today: Optional[datetime.date] = None) -> pd.DataFrame:
+        '''
+        Polls every gauge once, calls `callback` with any new or revised rows, and returns them.
+        '''
+        today = today or datetime.date.today()
+        frames = []
+        for name, (start, gauges) in self.windows(today).items():
+            log.info(f'Polling {len(gauges)} gauges at {name} from {start}')
+            context = gauge_getter.PullContext(self.quality, timestamps='datetime')
+            frames.append(gauge_getter.pull_timestamped(
+                {SOURCE_GROUPS.get(name, name): gauges}, start, today, self.var, self.interval,
+                self.data_type, 'long', context).reset_index()[gauge_getter.DATA_COLUMNS])
+        frames = [frame for frame in frames if len(frame)]
+        frame = pd.concat(frames, ignore_index=True) if frames else None
+        new = self.changes(frame)
+        self.polls += 1
+        log.info(f'Poll {self.polls}: {len(new)} new or revised rows')
+        if len(new) and self.callback is not None:
+            self.callback(new)
+        return new
+
+    def run(self, iterations: Optional[int] = None) -> None:
+        '''
+        Polls every `period` seconds until `stop` is called, or `iterations` polls are done.
+        A failed poll is logged and retried at the next period.
+        '''
+        done = 0
+        while not self._stop.is_set() and (iterations is None or done < iterations):
+            try:
+                self.poll()
+            except Exception as e: # pylint: disable=broad-except
+                log.error(f'Poll failed, retrying in {self.period}s: {e}')
+            done += 1
+            if iterations is None or done < iterations:
+                self._stop.wait(self.period)
+
+    def start(self) -> 'GaugeWatcher':
+        '''
+        Starts polling on a background thread.
+        '''
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='gauge-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def watch_gauges(gauges: List[str], var: str = 'F', interval: str = 'day',
+                 callback: Optional[Callable[[pd.DataFrame], Any]] = None, period: float = 900,
+                 **kwargs: Any) -> GaugeWatcher:
+    '''
+    Starts polling `gauges` every `period` seconds in the background, passing only new or
+    revised rows to `callback`. Returns the `GaugeWatcher`; call its `stop` method to finish.
+    Other keyword arguments are passed to `GaugeWatcher`.
+    '''
+    return GaugeWatcher(gauges, var, interval, callback, period, **kwargs).start()
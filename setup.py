@@ -37,6 +37,10 @@ setuptools.setup(
         "requests",
         "bomwater",
     ],
+    extras_require={
+        "arrow": ["pyarrow"],
+        "xarray": ["xarray", "netCDF4"],
+    },
     package_data={"": ["data/*.csv"]},
     python_requires=">=3.7",
 )
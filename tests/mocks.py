@@ -25,6 +25,11 @@ class MockRequestLib:
         self.status_code = 200
         self.response_data = json.dumps({'success': True}).encode()
         self.calls = []
+        self.posts = []
+        self.headers = {}
+
+    def Session(self):
+        return self
 
     def get(self, url) -> requests.Response:
         self.calls.append(url)
@@ -33,6 +38,13 @@ class MockRequestLib:
         ret._content = self.response_data
         return ret
 
+    def post(self, url, data=None, headers=None) -> requests.Response:
+        self.posts.append((url, data))
+        ret = requests.Response()
+        ret.status_code = self.status_code
+        ret._content = self.response_data
+        return ret
+
 
 class MockCallStateAPI:
     def __init__(self):
@@ -48,10 +60,24 @@ class MockProcessGaugePulls:
     def __init__(self):
         self.calls = []
 
-    def process_gauge_pull(self, *args):
+    def process_gauge_pull(self, *args, **kwargs):
         self.calls.append(args)
         return [args]
 
+class MockPullVar:
+    def __init__(self):
+        self.calls = []
+
+    def pull_var(self, gauges_by_state, start, end, var, interval, data_type, **kwargs):
+        self.calls.append(var)
+        return [['NSW', site, 'WATER', start, f'{var}-{site}', 1]
+                for site in gauges_by_state['NSW']]
+
+    def pull_vars(self, gauges_by_state, start, end, var_list, interval, data_type, **kwargs):
+        return [self.pull_var(gauges_by_state, start, end, var, interval, data_type)
+                for var in var_list]
+
+
 class MockPandasDataFrame:
     def __init__(self):
         self.columns = None
@@ -92,7 +118,7 @@ class MockGaugePullBOM:
     def __init__(self):
         self.calls = []
 
-    def gauge_pull_bom(self, *args):
+    def gauge_pull_bom(self, *args, **kwargs):
         self.calls.append(args)
         return dict()
 
@@ -111,7 +137,7 @@ class MockExtractData:
     def __init__(self):
         self.calls = []
 
-    def extract_data(self, state, data):
+    def extract_data(self, state, data, context=None):
         self.calls.append([state, data])
         return [[state, data]]
 
@@ -0,0 +1,86 @@
+import json
+import datetime
+import pytest
+from mdba_gauge_getter import gauge_getter, sources
+from mocks import MockRequestLib
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+START = datetime.date(2020, 1, 1)
+END = datetime.date(2020, 1, 2)
+
+EXPORT = {
+    'Datasets': [
+        {'LocationIdentifier': 'A4261002', 'Unit': 'ML/d'},
+        {'LocationIdentifier': 'A4260999', 'Unit': 'ML/d'},
+    ],
+    'Rows': [
+        {'Timestamp': '2020-01-01T00:00:00+09:30', 'Points': [{'Value': 10.5}, {'Value': 1.0}]},
+        {'Timestamp': '2020-01-02T00:00:00+09:30', 'Points': [{'Value': 11.5}, {}]},
+    ],
+}
+
+
+@pytest.fixture
+def portal():
+    source = sources.get_source('SA')
+    real = gauge_getter.requests, gauge_getter.COALESCE_REQUESTS, source.max_sites_per_request
+    mock = MockRequestLib()
+    mock.response_data = json.dumps(EXPORT).encode()
+    gauge_getter.requests = mock
+    gauge_getter.reset_sessions()
+    gauge_getter.COALESCE_REQUESTS = False
+    yield mock
+    gauge_getter.requests, gauge_getter.COALESCE_REQUESTS, source.max_sites_per_request = real
+    gauge_getter.reset_sessions()
+
+
+def test_aquarius_url():
+    url = gauge_getter.aquarius_url(['A4261002', 'A4260999'], START, END)
+    assert 'Datasets[0].DatasetName=Discharge.Total%20barrage%20flow%40A4261002' in url
+    assert 'Datasets[1].DatasetName=Discharge.Total%20barrage%20flow%40A4260999' in url
+    assert 'Datasets[1].Calculation=Instantaneous' in url
+    assert 'StartTime=2020-01-01&EndTime=2020-01-02' in url
+
+
+def test_aquarius_columns():
+    batch = gauge_getter.aquarius_columns(EXPORT)
+    assert list(batch['SITEID']) == ['A4261002', 'A4261002', 'A4260999']
+    assert list(batch['VALUE']) == [10.5, 11.5, 1.0]
+    assert list(batch['DATETIME'].astype('datetime64[D]').tolist()) == [START, END, START]
+    assert list(batch['QUALITYCODE']) == ['ML/d'] * 3
+
+    with pytest.raises(ValueError):
+        gauge_getter.aquarius_columns({**EXPORT, 'Rows': [{'Timestamp': 'x', 'Points': [{}]}]})
+
+
+def test_gauge_pull_aq_batches_datasets(portal):
+    rows = gauge_getter.gauge_pull_aq(['A4261002', 'A4260999'], START, END)
+    assert len(portal.calls) == 1
+    assert rows[0] == ['SA', 'A4261002', 'WATER', START, 10.5, 'ML/d']
+    assert len(rows) == 3
+
+    sources.get_source('SA').max_sites_per_request = 1
+    counts = gauge_getter.gauge_pull_aq(['A4261002', 'A4260999'], START, END, sink=lambda b: None)
+    assert len(portal.calls) == 3 and counts == [3, 3]
+
+
+def test_gauge_pull_aq_splits_ragged_exports(portal):
+    get = portal.get
+
+    def export(url):
+        if 'Datasets[1]' in url:
+            rows = [{**row, 'Points': row['Points'][:1]} for row in EXPORT['Rows']]
+            portal.response_data = json.dumps({**EXPORT, 'Rows': rows}).encode()
+        else:
+            index = 0 if 'A4261002' in url else 1
+            rows = [{**row, 'Points': row['Points'][index:index + 1]} for row in EXPORT['Rows']]
+            portal.response_data = json.dumps({'Datasets': EXPORT['Datasets'][index:index + 1],
+                                               'Rows': rows}).encode()
+        return get(url)
+
+    portal.get = export
+    rows = gauge_getter.gauge_pull_aq(['A4261002', 'A4260999'], START, END)
+    assert len(portal.calls) == 3
+    assert [(row[1], row[4]) for row in rows] == [('A4261002', 10.5), ('A4261002', 11.5),
+                                                  ('A4260999', 1.0)]
@@ -0,0 +1,71 @@
+import datetime
+import numpy as np
+import pytest
+from mdba_gauge_getter import gauge_getter
+from mocks import MockCallStateAPI
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+pa = pytest.importorskip('pyarrow')
+
+from mdba_gauge_getter.arrow import ArrowBuilder # pylint: disable=wrong-import-position
+
+
+def make_batch(source, sites, quality):
+    n = len(sites)
+    return {
+        'DATASOURCEID': np.full(n, source, dtype=object),
+        'SITEID': np.array(sites, dtype=object),
+        'SUBJECTID': np.full(n, 'WATER', dtype=object),
+        'DATETIME': gauge_getter.kisters_days([20000131000000 + i * 1000000 for i in range(n)]),
+        'VALUE': np.arange(n, dtype='float64'),
+        'QUALITYCODE': np.array(quality),
+    }
+
+
+def test_builder_schema_and_values():
+    builder = ArrowBuilder()
+    builder.append(make_batch('NSW', ['A', 'B', 'A'], [130, 130, 2]))
+    builder.append(make_batch('SA', ['C'], ['ML/d']))
+    table = builder.result()
+
+    assert table.num_rows == 4
+    assert pa.types.is_dictionary(table.schema.field('SITEID').type)
+    assert pa.types.is_dictionary(table.schema.field('DATASOURCEID').type)
+    assert table.schema.field('DATETIME').type == pa.date32()
+    assert table.column('SITEID').to_pylist() == ['A', 'B', 'A', 'C']
+    assert table.column('DATETIME').to_pylist()[:2] == [datetime.date(2000, 1, 31),
+                                                         datetime.date(2000, 2, 1)]
+    assert table.column('VALUE').to_pylist() == [0.0, 1.0, 2.0, 0.0]
+    assert table.column('QUALITYCODE').to_pylist() == [130, 130, 2, None]
+
+
+def test_builder_float_quality():
+    # As pandas holds BOM codes once a missing code promotes the column to float
+    builder = ArrowBuilder()
+    builder.append(make_batch('BOM', ['A', 'B', 'C'], [10.0, np.nan, 90.0]))
+    assert builder.result().column('QUALITYCODE').to_pylist() == [10, None, 90]
+
+
+def test_builder_empty():
+    assert ArrowBuilder().result().num_rows == 0
+    assert 'VAR' in ArrowBuilder().result(var_column=True).schema.names
+
+
+def test_gauge_pull_arrow():
+    real = gauge_getter.call_state_api, gauge_getter.extract_columns, \
+        gauge_getter.sort_gauges_by_state
+    gauge_getter.call_state_api = MockCallStateAPI().call_state_api
+    gauge_getter.extract_columns = lambda state, data, context=None: make_batch(state, ['1', '3'], [130, 130])
+    gauge_getter.sort_gauges_by_state = lambda gauges: {
+        'NSW': ['1', '3'], 'QLD': [], 'VIC': [], 'SA': [], 'rest': []}
+    try:
+        day = datetime.date(2000, 1, 31)
+        table = gauge_getter.gauge_pull(['1', '3'], day, day, var=['F', 'L'], output='arrow')
+        with pytest.raises(ValueError):
+            gauge_getter.gauge_pull(['1'], day, day, output='arrow', var_format='wide')
+    finally:
+        gauge_getter.call_state_api, gauge_getter.extract_columns, \
+            gauge_getter.sort_gauges_by_state = real
+    assert table.column('VAR').to_pylist() == ['F', 'F', 'L', 'L']
+    assert table.column('SITEID').to_pylist() == ['1', '3', '1', '3']
@@ -0,0 +1,91 @@
+import asyncio
+import datetime
+import threading
+import time
+import pytest
+from mdba_gauge_getter import gauge_getter
+from mdba_gauge_getter.coalesce import RequestCoalescer
+from mocks import MockRequestLib
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    c = RequestCoalescer()
+    release = threading.Event()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        release.wait(5)
+        return {'value': 42}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(c.call('key', upstream)))
+               for _ in range(5)]
+    for t in threads:
+        t.start()
+    while c.requests < 5:
+        pass
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert results == [{'value': 42}] * 5
+    assert c.stats() == {'requests': 5, 'upstream': 1, 'saved': 4}
+
+    # Nothing is retained once the call has completed
+    c.call('key', upstream)
+    assert len(calls) == 2
+
+
+def test_exception_is_shared_and_not_retained():
+    c = RequestCoalescer()
+
+    def failing():
+        raise ValueError('upstream failed')
+
+    with pytest.raises(ValueError):
+        c.call('key', failing)
+    assert c.call('key', lambda: 'ok') == 'ok'
+
+
+def test_coroutines_share_one_upstream_call():
+    c = RequestCoalescer()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'result'
+
+    async def main():
+        return await asyncio.gather(*[c.acall('key', upstream) for _ in range(3)])
+
+    assert asyncio.run(main()) == ['result'] * 3
+    assert len(calls) == 1
+    assert c.saved == 2
+
+
+def test_call_state_api_is_coalesced():
+    real_requests = gauge_getter.requests
+    gauge_getter.requests = MockRequestLib()
+    gauge_getter.reset_sessions()
+    seen = []
+
+    def fake_call(key, fn):
+        seen.append(key)
+        return fn()
+
+    original = gauge_getter.coalescer.call
+    gauge_getter.coalescer.call = fake_call
+    try:
+        day = datetime.date(2000, 1, 1)
+        gauge_getter.call_state_api('NSW', ['A'], day, day, 'CP', 'F', 'day', 'mean')
+    finally:
+        gauge_getter.coalescer.call = original
+        mock_requests, gauge_getter.requests = gauge_getter.requests, real_requests
+        gauge_getter.reset_sessions()
+    assert seen[0][0] == 'kisters'
+    assert seen[0][1] == mock_requests.calls[-1]
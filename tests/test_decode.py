@@ -0,0 +1,85 @@
+import json
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from mdba_gauge_getter import gauge_getter
+from mdba_gauge_getter.decode import pack_batch, unpack_batch, decode_kisters, \
+    shutdown_decode_pools, batch_rows, Decoder
+from mdba_gauge_getter.quality import QualityFilter
+from mocks import MockRequestLib
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+RESPONSE = {'error_num': 0, 'return': {'traces': [
+    {'site': '1', 'trace': [{'q': 130, 't': 20000101000000, 'v': '1.5'},
+                            {'q': 255, 't': 20000102000000, 'v': '2.5'}]},
+    {'site': '3', 'trace': [{'q': 130, 't': 20000101000000, 'v': '3.5'}]},
+]}}
+
+
+@pytest.fixture
+def mock_portal():
+    real = gauge_getter.requests, gauge_getter.sort_gauges_by_state, gauge_getter.COALESCE_REQUESTS
+    mock = MockRequestLib()
+    mock.response_data = json.dumps(RESPONSE).encode()
+    gauge_getter.requests = mock
+    gauge_getter.reset_sessions()
+    gauge_getter.COALESCE_REQUESTS = False
+    gauge_getter.sort_gauges_by_state = lambda gauges: {
+        'NSW': list(gauges), 'QLD': [], 'VIC': [], 'SA': [], 'rest': []}
+    yield mock
+    gauge_getter.requests, gauge_getter.sort_gauges_by_state, gauge_getter.COALESCE_REQUESTS = real
+    gauge_getter.reset_sessions()
+    shutdown_decode_pools()
+
+
+def test_pack_batch_round_trip():
+    batch = gauge_getter.make_batch('NSW', np.array(['1', '3', '1'], dtype=object),
+                                    pd.to_datetime(['2000-01-01'] * 3).to_numpy(),
+                                    np.array([1.0, 2.0, 3.0]), np.array([130, 130, 140]))
+    packed = pack_batch(batch)
+    assert packed['SITEID'][0] == 'dictionary' and packed['SITEID'][1] == ['1', '3']
+    unpacked = unpack_batch(packed)
+    for name, column in batch.items():
+        assert list(unpacked[name]) == list(column)
+    assert batch_rows(unpacked)[0] == ['NSW', '1', 'WATER', datetime.date(2000, 1, 1), 1.0, 130]
+
+
+def test_decode_kisters():
+    packed, dropped = decode_kisters('NSW', json.dumps(RESPONSE).encode(), {'NSW': [130]})
+    assert list(unpack_batch(packed)['VALUE']) == [1.5, 3.5]
+    assert dropped == [(('NSW', 255), 1)]
+    with pytest.raises(json.decoder.JSONDecodeError):
+        decode_kisters('NSW', b'<html>', None)
+
+
+def test_gauge_pull_decode_processes(mock_portal):
+    start, end = datetime.date(2000, 1, 1), datetime.date(2000, 1, 2)
+    gauges = [str(g) for g in range(12)]
+    df = gauge_getter.gauge_pull(gauges, start, end, decode_processes=2,
+                                 quality={'state': [130]})
+    # Three requests of up to five sites, each answered with the same three observations
+    assert len(mock_portal.calls) == 3
+    assert list(df['VALUE']) == [1.5, 3.5] * 3
+    assert df['DATETIME'][0] == start
+    assert df.attrs['quality_dropped'] == {'NSW': {255: 3}}
+
+    columns = gauge_getter.gauge_pull(gauges, start, end, decode_processes=2, max_memory='1MB')
+    assert list(columns['VALUE']) == [1.5, 2.5, 3.5] * 3
+
+    # Decoding in the pool or in this process gives the same frame
+    local = gauge_getter.gauge_pull(gauges, start, end, quality={'state': [130]})
+    pd.testing.assert_frame_equal(local, df)
+
+
+def test_decoder_drains_as_it_goes():
+    decoder = Decoder(1, QualityFilter(), max_pending=2)
+    decoded = []
+    for _ in range(6):
+        decoder.submit('NSW', json.dumps(RESPONSE).encode())
+        decoded += decoder.results(block=False)
+        assert len(decoder._pending) <= 2 # pylint: disable=protected-access
+    decoded += decoder.results()
+    assert len(decoded) == 6 and not decoder._pending # pylint: disable=protected-access
+    shutdown_decode_pools()
@@ -7,12 +7,13 @@ import pytest
 import logging
 import warnings
 import requests
+import numpy as np
 import pandas as pd
 import bom_water
 from mdba_gauge_getter import gauge_getter
 from mocks import MockRequestLib, MockCallStateAPI, \
     MockPandasDataFrame, MockGaugePullBOM, MockExtractData, \
-    mock_sort_gauges_by_state, mock_tqdm, MOCK_CSV, MockProcessGaugePulls
+    mock_sort_gauges_by_state, mock_tqdm, MOCK_CSV, MockProcessGaugePulls, MockPullVar
 
 # pylint: disable=missing-function-docstring,missing-module-docstring
 logging.basicConfig()
@@ -27,6 +28,10 @@ REAL_REFERENCES = {
     'gauge_data_uri': gauge_getter.gauge_data_uri,
     'gauge_pull': gauge_getter.gauge_pull,
     'process_gauge_pull': gauge_getter.process_gauge_pull,
+    'pull_var': gauge_getter.pull_var,
+    'pull_vars': gauge_getter.pull_vars,
+    'call_state_api': gauge_getter.call_state_api,
+    'extract_columns': gauge_getter.extract_columns,
 
 }
 
@@ -40,13 +45,19 @@ def reset():
     for k, v in REAL_REFERENCES.items():
         setattr(gauge_getter, k, v)
     gauge_getter.requests = MockRequestLib()
+    gauge_getter.reset_sessions()
     if hasattr(gauge_getter, 'gauges'): # TODO-DeprecatedContent - Delete this block
         gauge_getter.gauges = None
     if hasattr(gauge_getter, 'lstObservation'): # TODO-DeprecatedContent - Delete this block
         gauge_getter.lstObservation = []
     gauge_getter.tqdm = mock_tqdm # TODO-DeprecatedContent - Delete this line
+    # Requests are made one at a time, so the order of mocked calls can be asserted
+    workers, gauge_getter.PULL_WORKERS = gauge_getter.PULL_WORKERS, 1
     yield # This is where the function executes
     # We're now out of the function
+    gauge_getter.PULL_WORKERS = workers
+    gauge_getter.requests = REAL_REFERENCES['requests']
+    gauge_getter.reset_sessions()
 
 def test_init():
     gauge_getter.init()
@@ -146,21 +157,84 @@ def test_extract_data():
                 {
                     'site': 'site1',
                     'trace': [
-                        {'q': 901, 't': '20210101010101', 'v': 'trace1_v'},
-                        {'q': 902, 't': '20220202010101', 'v': 'trace2_v'},
-                        {'q': 903, 't': '20230303010101', 'v': 'trace3_v'},
-                        {'q': 1001, 't': '20230303010101', 'v': 'trace3_v'},
+                        {'q': 901, 't': '20210101010101', 'v': '1.5'},
+                        {'q': 902, 't': '20220202010101', 'v': '2.5'},
+                        {'q': 903, 't': '20230303010101', 'v': 'not a number'},
+                        {'q': 1001, 't': '20230303010101', 'v': '4.5'},
                     ]
                 }
             ]
         }
     }
     ret = gauge_getter.extract_data('test-state', wrapper)
-    assert ret == [
-        ['test-state', 'site1', 'WATER', datetime.date(2021, 1, 1), 'trace1_v', 901],
-        ['test-state', 'site1', 'WATER', datetime.date(2022, 2, 2), 'trace2_v', 902],
-        ['test-state', 'site1', 'WATER', datetime.date(2023, 3, 3), 'trace3_v', 903]
+    # Rows are built from the columnar batch, so VALUE is a float (NaN where unparseable)
+    assert ret[:2] == [
+        ['test-state', 'site1', 'WATER', datetime.date(2021, 1, 1), 1.5, 901],
+        ['test-state', 'site1', 'WATER', datetime.date(2022, 2, 2), 2.5, 902],
     ]
+    assert ret[2][:4] == ['test-state', 'site1', 'WATER', datetime.date(2023, 3, 3)]
+    assert np.isnan(ret[2][4]) and ret[2][5] == 903 and len(ret) == 3
+
+def test_extract_columns():
+    wrapper = {
+        '_return': {
+            'traces':  [
+                {
+                    'site': 'site1',
+                    'trace': [
+                        {'q': 901, 't': 20210101010101, 'v': '1.5'},
+                        {'q': 1001, 't': 20220202010101, 'v': '2.5'},
+                        {'q': 130, 't': 20230303010101, 'v': '3.5'},
+                    ]
+                },
+                {'site': 'site2', 'trace': [{'q': 2, 't': 20240404000000, 'v': 4}]},
+            ]
+        }
+    }
+    batch = gauge_getter.extract_columns('NSW', wrapper)
+    assert list(batch['SITEID']) == ['site1', 'site1', 'site2']
+    assert list(batch['DATASOURCEID']) == ['NSW'] * 3
+    assert list(batch['VALUE']) == [1.5, 3.5, 4.0]
+    assert list(batch['QUALITYCODE']) == [901, 130, 2]
+    assert list(pd.DatetimeIndex(batch['DATETIME']).date) == [
+        datetime.date(2021, 1, 1), datetime.date(2023, 3, 3), datetime.date(2024, 4, 4)]
+    # The (possibly shared) response is left untouched
+    assert '_return' in wrapper
+
+    assert len(gauge_getter.extract_columns('NSW', {'return': {}})['SITEID']) == 0
+
+
+def test_gauge_pull_max_memory():
+    mock_call_state_api = MockCallStateAPI()
+    gauge_getter.call_state_api = mock_call_state_api.call_state_api
+    gauge_getter.extract_columns = lambda state, data, context=None: {
+        'DATASOURCEID': np.array([state] * 2, dtype=object),
+        'SITEID': np.array(['1', '3'], dtype=object),
+        'SUBJECTID': np.array(['WATER'] * 2, dtype=object),
+        'DATETIME': pd.to_datetime(['2000-01-31', '2000-02-01']).to_numpy(),
+        'VALUE': np.array([1.0, 2.0]),
+        'QUALITYCODE': np.array([130, 130]),
+    }
+    gauge_getter.sort_gauges_by_state = lambda gauges: {
+        'NSW': ['1', '3'], 'QLD': [], 'VIC': [], 'SA': [], 'rest': []}
+    start = datetime.date(2000, 1, 31)
+    end = datetime.date(2000, 2, 1)
+
+    df = gauge_getter.gauge_pull(['1', '3'], start, end, max_memory=1)
+    assert len(mock_call_state_api.calls) == 1
+    assert list(df.columns) == gauge_getter.DATA_COLUMNS
+    assert list(df['VALUE']) == [1.0, 2.0]
+
+    df = gauge_getter.gauge_pull(['1', '3'], start, end, var=['F', 'L'], max_memory='1MB')
+    assert list(df['VAR']) == ['F', 'F', 'L', 'L']
+
+    parts = []
+    rows = gauge_getter.gauge_pull(['1', '3'], start, end, max_memory=1, sink=parts.append)
+    assert rows == 2 and len(parts) == 1
+
+    with pytest.raises(ValueError):
+        gauge_getter.gauge_pull(['1'], start, end, sink=parts.append)
+
 
 def test_gauge_pull():
     m = MockProcessGaugePulls()
@@ -170,6 +244,7 @@ def test_gauge_pull():
     gauge_getter.extract_data = MockExtractData().extract_data
     gauge_getter.sort_gauges_by_state = mock_sort_gauges_by_state
     gauge_getter.process_gauge_pull = m.process_gauge_pull
+    gauge_getter.gauge_pull_bom = b.gauge_pull_bom
     start = datetime.datetime.strptime('2000-01-31', '%Y-%m-%d').date()
     end = datetime.datetime.strptime('2000-02-01', '%Y-%m-%d').date()
 
@@ -190,13 +265,14 @@ def test_gauge_pull():
     assert calls[0] == (['1', '3'], 'NSW', 'CP', start, end, 'F', 'day', 'mean')
     assert calls[1] == (['4', '5'], 'VIC', 'PUBLISH', start, end, 'F', 'day', 'mean')
     assert calls[2] == (['2', '3', '4'], 'QLD', 'AT', start, end, 'F', 'day', 'mean')
-    assert calls[3] == []
+    # SA gauge 6 is not an Aquarius dataset, so it falls back to BOM
+    assert calls[3] == [(['6'], start, end, 'F', 'day', 'mean')]
 
     calls = gauge_getter.pd.calls
-    assert len(calls) == 2
-    warnings.warn(UserWarning(f'\n#Calls: {len(calls)}\n{calls[0]}\n{calls[1]}'))
-    assert len(calls[1]) == 2
-    data, columns = calls[1]
+    assert len(calls) == 1
+    warnings.warn(UserWarning(f'\n#Calls: {len(calls)}\n{calls[0]}'))
+    assert len(calls[0]) == 2
+    data, columns = calls[0]
     assert columns == ['DATASOURCEID', 'SITEID', 'SUBJECTID', 'DATETIME', 'VALUE', 'QUALITYCODE']
     assert len(data) == 3
     assert data[0] == (
@@ -210,6 +286,41 @@ def test_gauge_pull():
     )
 
 
+def test_gauge_pull_multi_var():
+    m = MockPullVar()
+    gauge_getter.pull_var, gauge_getter.pull_vars = m.pull_var, m.pull_vars
+    gauge_getter.sort_gauges_by_state = mock_sort_gauges_by_state
+    start = datetime.date(2000, 1, 31)
+    end = datetime.date(2000, 2, 1)
+
+    df = gauge_getter.gauge_pull(['1', '3'], start, end, var=['F', 'L', 'F'])
+    assert m.calls == ['F', 'L']
+    assert list(df.columns) == ['DATASOURCEID', 'SITEID', 'SUBJECTID', 'VAR', 'DATETIME',
+                                'VALUE', 'QUALITYCODE']
+    assert list(df['VAR']) == ['F', 'F', 'L', 'L']
+
+    wide = gauge_getter.gauge_pull(['1', '3'], start, end, var=['F', 'L'], var_format='wide')
+    assert len(wide) == 2
+    assert list(wide['VALUE_F']) == ['F-1', 'F-3']
+    assert list(wide['VALUE_L']) == ['L-1', 'L-3']
+    assert list(wide['QUALITYCODE_L']) == [1, 1]
+
+    with pytest.raises(ValueError):
+        gauge_getter.gauge_pull(['1'], start, end, var=['F'], var_format='tall')
+
+
+def test_to_wide_keeps_each_source():
+    day = datetime.date(2000, 1, 31)
+    columns = gauge_getter.DATA_COLUMNS[:3] + ['VAR'] + gauge_getter.DATA_COLUMNS[3:]
+    long_frame = pd.DataFrame([['NSW', '1', 'WATER', 'F', day, 1.0, 130],
+                               ['BOM', '1', 'WATER', 'L', day, 2.0, 10]], columns=columns)
+    wide = gauge_getter.to_wide(long_frame)
+    assert len(wide) == 1
+    row = wide.iloc[0]
+    assert (row['VALUE_F'], row['DATASOURCEID_F']) == (1.0, 'NSW')
+    assert (row['VALUE_L'], row['DATASOURCEID_L']) == (2.0, 'BOM')
+
+
 def test_gauge_pull_bom():
     b = MockGaugePullBOM()
     gauge_getter.pd = MockPandasDataFrame()
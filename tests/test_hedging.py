@@ -0,0 +1,111 @@
+import time
+import threading
+import pytest
+from mdba_gauge_getter import gauge_getter, hedging
+from mdba_gauge_getter.hedging import RequestHedger
+from mdba_gauge_getter.sources import RateLimiter, get_source
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+
+def warmed(**kwargs):
+    hedger = RequestHedger(min_samples=5, min_delay=0.05, **kwargs)
+    for _ in range(20):
+        hedger.call('portal', lambda: time.sleep(0.001))
+    return hedger
+
+
+def slow_then_fast():
+    '''
+    A request whose first copy stalls and whose duplicate answers at once.
+    '''
+    calls = []
+    lock = threading.Lock()
+
+    def fn():
+        with lock:
+            calls.append(len(calls))
+            attempt = calls[-1]
+        time.sleep(0.3 if attempt == 0 else 0.01)
+        return attempt
+    return fn, calls
+
+
+def test_no_hedging_until_latencies_are_known():
+    hedger = RequestHedger(min_samples=5)
+    assert hedger.delay('portal') is None
+    fn, calls = slow_then_fast()
+    assert hedger.call('portal', fn) == 0 and calls == [0]
+
+
+def test_slow_request_is_hedged():
+    hedger = warmed(budget=0.5)
+    assert hedger.delay('portal') == pytest.approx(0.05)
+    fn, calls = slow_then_fast()
+    started = time.monotonic()
+    assert hedger.call('portal', fn) == 1
+    assert time.monotonic() - started < 0.25
+    stats = hedger.stats()['portal']
+    assert (stats['requests'], stats['hedged'], stats['hedge_wins']) == (21, 1, 1)
+
+
+def test_hedges_stay_within_budget():
+    hedger = warmed(budget=0.05)
+    first, _ = slow_then_fast()
+    second, calls = slow_then_fast()
+    hedger.call('portal', first)
+    assert hedger.call('portal', second) == 0 and calls == [0]
+    assert hedger.stats()['portal']['hedged'] == 1
+
+
+def test_hedges_take_a_free_slot():
+    hedger = warmed(budget=0.5)
+    limiter = RateLimiter(1, 0.0)
+    fn, calls = slow_then_fast()
+    with limiter:
+        assert hedger.call('portal', fn, limiter) == 0 and calls == [0]
+
+    limiter = RateLimiter(2, 0.0)
+    fn, calls = slow_then_fast()
+    with limiter:
+        assert hedger.call('portal', fn, limiter) == 1
+        time.sleep(0.05)
+        # The hedge's slot is free again once it has answered
+        assert limiter.acquire(blocking=False)
+
+
+def test_failed_copy_falls_back_to_other():
+    hedger = warmed(budget=0.5)
+    attempts = []
+
+    def fn():
+        attempts.append(None)
+        if len(attempts) == 1:
+            time.sleep(0.2)
+            raise IOError('stalled connection reset')
+        return 'ok'
+    assert hedger.call('portal', fn) == 'ok'
+
+
+def test_call_state_api_is_hedged():
+    calls = []
+    hedger = hedging.enable_hedging()
+    real = gauge_getter.send_kisters
+
+    class Response:
+        status_code = 200
+        content = b'{"return": {"traces": []}}'
+
+    def send_kisters(*args):
+        calls.append(args[0])
+        return Response()
+    gauge_getter.send_kisters = send_kisters
+    try:
+        data = gauge_getter.call_state_api('NSW', ['410001'], gauge_getter.datetime.date(2000, 1, 1),
+                                           gauge_getter.datetime.date(2000, 1, 2), 'CP', 'F',
+                                           'day', 'mean')
+    finally:
+        gauge_getter.send_kisters = real
+        hedging.disable_hedging()
+    assert data == {'return': {'traces': []}} and calls == ['NSW']
+    assert hedger.stats()[get_source('NSW').host]['requests'] == 1
@@ -0,0 +1,77 @@
+import sys
+import threading
+from io import StringIO
+from subprocess import run, PIPE
+from mdba_gauge_getter import gauge_getter
+from mocks import MOCK_CSV
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+
+def test_import_is_lazy():
+    code = ('import sys, mdba_gauge_getter; '
+            'print(",".join(m for m in ("pandas", "numpy", "requests", "bom_water") '
+            'if m in sys.modules))')
+    proc = run([sys.executable, '-c', code], stdout=PIPE, check=True)
+    assert proc.stdout.decode().strip() == ''
+
+
+def test_catalogue_loads_once():
+    calls = []
+    real_init, real_uri = gauge_getter.init, gauge_getter.gauge_data_uri
+
+    def counting_init():
+        calls.append(1)
+        gauge_getter.gauge_data_uri = StringIO(MOCK_CSV)
+        real_init()
+
+    gauge_getter.gauges = None
+    gauge_getter.init = counting_init
+    try:
+        threads = [threading.Thread(target=gauge_getter.get_states_for_gauge, args=('1',))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        gauge_getter.init, gauge_getter.gauge_data_uri = real_init, real_uri
+        gauge_getter.gauges = None
+    assert len(calls) == 1
+
+
+def test_catalogue_is_published_complete(tmp_path):
+    pd = gauge_getter.pd
+    real_uri = gauge_getter.gauge_data_uri
+    (tmp_path / 'gauges.csv').write_text(MOCK_CSV)
+    building, resume = threading.Event(), threading.Event()
+
+    class PausingFrame(pd.DataFrame):
+        def __setitem__(self, key, value):
+            # Hold the first `init` just before the State column is added
+            if key == 'State' and not building.is_set():
+                building.set()
+                resume.wait(5)
+            super().__setitem__(key, value)
+
+    class CataloguePandas:
+        def __getattr__(self, name):
+            return getattr(pd, name)
+
+        def read_csv(self, *args, **kwargs):
+            return PausingFrame(pd.read_csv(*args, **kwargs))
+
+    gauge_getter.gauges = None
+    gauge_getter.gauge_data_uri = str(tmp_path / 'gauges.csv')
+    gauge_getter.pd = CataloguePandas()
+    loader = threading.Thread(target=gauge_getter.init)
+    try:
+        loader.start()
+        assert building.wait(5)
+        # A reader arriving mid-load never sees a catalogue without its State column
+        assert gauge_getter.get_states_for_gauge('1') == {'NSW'}
+    finally:
+        resume.set()
+        loader.join()
+        gauge_getter.pd, gauge_getter.gauge_data_uri = pd, real_uri
+        gauge_getter.gauges = None
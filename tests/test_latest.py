@@ -0,0 +1,63 @@
+import datetime
+import pandas as pd
+import pytest
+from mdba_gauge_getter import gauge_getter
+from mdba_gauge_getter.latest import gauge_latest, clear_latest_cache
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+TODAY = datetime.date(2020, 1, 31)
+
+# The last day each gauge reported
+LAST_DAY = {'1': TODAY, '2': datetime.date(2020, 1, 25), '3': datetime.date(2019, 6, 1)}
+
+
+@pytest.fixture
+def upstream():
+    calls = []
+
+    def gauge_pull(gauges, start, end, var, interval, data_type, data_source, quality=None):
+        calls.append((tuple(gauges), (end - start).days))
+        rows = []
+        for gauge in gauges:
+            day = start
+            while day <= min(end, LAST_DAY[gauge]):
+                rows.append(['NSW', gauge, 'WATER', day, float(day.day), 130])
+                day += datetime.timedelta(days=1)
+        return pd.DataFrame(rows, columns=gauge_getter.DATA_COLUMNS)
+
+    real = gauge_getter.gauge_pull
+    gauge_getter.gauge_pull = gauge_pull
+    clear_latest_cache()
+    yield calls
+    gauge_getter.gauge_pull = real
+    clear_latest_cache()
+
+
+def test_windows_widen_only_for_missing_gauges(upstream):
+    latest = gauge_latest(['1', '2', '3'], today=TODAY)
+    assert upstream == [(('1', '2', '3'), 3), (('2', '3'), 14), (('3',), 60)]
+    assert list(latest['SITEID']) == ['1', '2']
+    assert list(latest['DATETIME']) == [TODAY, datetime.date(2020, 1, 25)]
+    assert list(latest['VALUE']) == [31.0, 25.0]
+
+
+def test_latest_values_are_cached(upstream):
+    gauge_latest(['1'], today=TODAY)
+    latest = gauge_latest(['2', '1'], today=TODAY)
+    assert upstream == [(('1',), 3), (('2',), 3), (('2',), 14)]
+    assert list(latest['SITEID']) == ['2', '1']
+
+    clear_latest_cache()
+    gauge_latest(['1'], today=TODAY, ttl=0)
+    gauge_latest(['1'], today=TODAY)
+    assert upstream[-2:] == [(('1',), 3), (('1',), 3)]
+
+
+def test_equivalent_quality_policies_share_cache(upstream):
+    clear_latest_cache()
+    gauge_latest(['1'], today=TODAY, quality={'state': [(None, 150)], 'BOM': None})
+    gauge_latest(['1'], today=TODAY, quality={'BOM': None, 'state': [[None, 150]]})
+    assert upstream == [(('1',), 3)]
+    gauge_latest(['1'], today=TODAY, quality=[10])
+    assert upstream == [(('1',), 3), (('1',), 3)]
@@ -0,0 +1,114 @@
+import json
+import datetime
+import numpy as np
+import pytest
+from mdba_gauge_getter import gauge_getter
+from mdba_gauge_getter.matrix import MatrixBuilder, date_axis
+from mocks import MockRequestLib
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+START = datetime.date(2000, 1, 1)
+END = datetime.date(2000, 1, 3)
+
+RESPONSE = {'error_num': 0, 'return': {'traces': [
+    {'site': '2', 'trace': [{'q': 130, 't': 20000103000000, 'v': '2.5'},
+                            {'q': 140, 't': 20000101000000, 'v': '2.0'}]},
+    {'site': '1', 'trace': [{'q': 130, 't': 20000101000000, 'v': '1.0'}]},
+]}}
+
+
+@pytest.fixture
+def mock_portal():
+    real = gauge_getter.requests, gauge_getter.sort_gauges_by_state, gauge_getter.COALESCE_REQUESTS
+    mock = MockRequestLib()
+    mock.response_data = json.dumps(RESPONSE).encode()
+    gauge_getter.requests = mock
+    gauge_getter.reset_sessions()
+    gauge_getter.COALESCE_REQUESTS = False
+    gauge_getter.sort_gauges_by_state = lambda gauges: {
+        'NSW': list(gauges), 'QLD': [], 'VIC': [], 'SA': [], 'rest': []}
+    yield mock
+    gauge_getter.requests, gauge_getter.sort_gauges_by_state, gauge_getter.COALESCE_REQUESTS = real
+    gauge_getter.reset_sessions()
+
+
+def test_date_axis():
+    assert list(date_axis(START, END, 'day')) == list(np.arange('2000-01-01', '2000-01-04',
+                                                                dtype='datetime64[D]'))
+    months = date_axis(datetime.date(2000, 1, 15), datetime.date(2000, 3, 2), 'month')
+    assert list(months.astype(str)) == ['2000-01-01', '2000-02-01', '2000-03-01']
+    with pytest.raises(ValueError):
+        date_axis(START, END, 'hour')
+
+
+def test_builder_places_values():
+    builder = MatrixBuilder(['1', '2'], START, END, 'day', ['F', 'L'])
+    builder.append({'SITEID': np.array(['2', '1', '9', '1']),
+                    'DATETIME': np.array(['2000-01-02', '2000-01-03', '2000-01-01',
+                                          '2000-01-05'], dtype='datetime64[ns]'),
+                    'VALUE': np.array([2.0, 1.0, 9.0, 5.0]),
+                    'QUALITYCODE': np.array([10, 20, 30, 40])}, VAR='L')
+    matrix = builder.result()
+    assert matrix.values.shape == (2, 3, 2)
+    assert np.isnan(matrix.values[0]).all()
+    assert matrix.values[1, 1, 1] == 2.0 and matrix.quality[1, 2, 0] == 20
+    assert np.isnan(matrix.values[1]).sum() == 4
+    assert (matrix.quality[1] == -1).sum() == 4
+    assert builder.unplaced == 2
+
+
+def test_builder_floors_dates_to_periods():
+    builder = MatrixBuilder(['1'], datetime.date(2000, 1, 1), datetime.date(2000, 3, 31),
+                            'month', ['F'])
+    builder.append({'SITEID': np.array(['1', '1', '1']),
+                    'DATETIME': np.array(['2000-01-15', '2000-02-29T12:00', '2000-04-01'],
+                                         dtype='datetime64[ns]'),
+                    'VALUE': np.array([1.0, 2.0, 4.0]),
+                    'QUALITYCODE': np.array([10, 10, 10])})
+    np.testing.assert_array_equal(builder.result().values[0, :, 0], [1.0, 2.0, np.nan])
+    assert builder.unplaced == 1
+
+
+def test_unplaced_values_warn(mock_portal, caplog):
+    with caplog.at_level('WARNING'):
+        gauge_getter.gauge_pull(['1'], START, datetime.date(2000, 1, 2), var='F',
+                                output='matrix')
+    assert 'fell outside the matrix axes' in caplog.text
+
+
+def test_matrix_pull(mock_portal):
+    matrix = gauge_getter.gauge_pull(['1', '2', '3'], START, END, var=['F', 'L'],
+                                     output='matrix')
+    assert matrix.variables == ['F', 'L'] and matrix.gauges == ['1', '2', '3']
+    assert len(mock_portal.calls) == 2
+    for index in range(2):
+        np.testing.assert_array_equal(matrix.values[index], [[1.0, 2.0, np.nan],
+                                                             [np.nan, np.nan, np.nan],
+                                                             [np.nan, 2.5, np.nan]])
+        np.testing.assert_array_equal(matrix.quality[index], [[130, 140, -1],
+                                                              [-1, -1, -1],
+                                                              [-1, 130, -1]])
+    frame = matrix.frame('L')
+    assert list(frame.columns) == ['1', '2', '3']
+    assert frame.loc['2000-01-03', '2'] == 2.5
+
+    with pytest.raises(ValueError):
+        gauge_getter.gauge_pull(['1'], START, END, var=['F', 'L'], var_format='wide',
+                                output='matrix')
+
+
+def test_to_xarray(mock_portal, tmp_path):
+    xr = pytest.importorskip('xarray')
+    matrix = gauge_getter.gauge_pull(['1', '2'], START, END, var=['F', 'L'], output='matrix')
+    dataset = matrix.to_xarray()
+    assert set(dataset.data_vars) == {'F', 'F_QUALITYCODE', 'L', 'L_QUALITYCODE'}
+    assert dataset['F'].dims == ('time', 'gauge')
+    assert float(dataset['L'].sel(gauge='2', time='2000-01-03')) == 2.5
+
+    try:
+        matrix.to_netcdf(tmp_path / 'pull.nc')
+    except ValueError as e:
+        pytest.skip(f'No NetCDF engine available: {e}')
+    with xr.open_dataset(tmp_path / 'pull.nc') as written:
+        np.testing.assert_array_equal(written['F'].values, dataset['F'].values)
@@ -0,0 +1,103 @@
+import datetime
+from io import StringIO
+import pytest
+from mdba_gauge_getter import gauge_getter
+from mdba_gauge_getter.negative_cache import NegativeCache
+from mocks import MOCK_CSV
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+START = datetime.date(2000, 1, 1)
+END = datetime.date(2000, 12, 31)
+
+# NSW has flow for gauge 3 only, and no storage volume at all; QLD and BOM have nothing.
+# Gauge 3 is catalogued in both NSW and QLD.
+SERVES = {('NSW', 'F'): {'3'}}
+
+
+@pytest.fixture
+def portals():
+    calls = []
+
+    def process_gauge_pull(sites, state, source, start, end, var, interval, data_type, **opts):
+        if sites:
+            calls.append((state, var, sorted(sites)))
+        return [[state, site, 'WATER', start, 1.0, 130] for site in sites
+                if site in SERVES.get((state, var), set())]
+
+    def gauge_pull_bom(sites, start, end, var, interval, data_type, **opts):
+        if sites:
+            calls.append(('BOM', var, sorted(sites)))
+        return []
+
+    real_uri = gauge_getter.gauge_data_uri
+    real = {name: getattr(gauge_getter, name)
+            for name in ('process_gauge_pull', 'gauge_pull_bom', 'PULL_WORKERS')}
+    gauge_getter.gauges = None
+    gauge_getter.PULL_WORKERS = 1
+    gauge_getter.gauge_data_uri = StringIO(MOCK_CSV)
+    gauge_getter.process_gauge_pull = process_gauge_pull
+    gauge_getter.gauge_pull_bom = gauge_pull_bom
+    yield calls
+    gauge_getter.gauge_data_uri = real_uri
+    gauge_getter.gauges = None
+    for name, fn in real.items():
+        setattr(gauge_getter, name, fn)
+
+
+def test_known_empty_gauges_are_skipped(portals):
+    cache = NegativeCache()
+    first = gauge_getter.gauge_pull(['1', '3'], START, END, negative_cache=cache)
+    assert portals == [('NSW', 'F', ['1', '3']), ('QLD', 'F', ['3']), ('BOM', 'F', ['3'])]
+    assert 'negative_cache_skipped' not in first.attrs
+
+    portals.clear()
+    again = gauge_getter.gauge_pull(['1', '3'], START, datetime.date(2000, 6, 30),
+                                    negative_cache=cache)
+    assert portals == [('NSW', 'F', ['3'])]
+    assert again.attrs['negative_cache_skipped'] == {'NSW': 1, 'QLD': 1}
+    assert list(again['SITEID']) == ['3']
+
+    # A wider window is asked for again
+    portals.clear()
+    gauge_getter.gauge_pull(['1'], START, datetime.date(2001, 1, 1), negative_cache=cache)
+    assert portals[0] == ('NSW', 'F', ['1'])
+
+
+def test_empty_fallback_is_skipped(portals):
+    cache = NegativeCache()
+    gauge_getter.gauge_pull(['1', '3'], START, END, var='SV', negative_cache=cache)
+    assert portals == [('NSW', 'SV', ['1', '3']), ('BOM', 'SV', ['1', '3']), ('QLD', 'SV', ['3']),
+                       ('BOM', 'SV', ['3'])]
+    portals.clear()
+    df = gauge_getter.gauge_pull(['1', '3'], START, END, var='SV', negative_cache=cache)
+    assert portals == [] and df.empty
+    assert df.attrs['negative_cache_skipped'] == {'NSW': 2, 'QLD': 1}
+    assert cache.skipped == {'NSW': 2, 'QLD': 1}
+
+
+def test_entries_expire_and_persist(portals, tmp_path):
+    path = str(tmp_path / 'empty.json')
+    cache = NegativeCache(ttl=0, path=path)
+    gauge_getter.gauge_pull(['1'], START, END, negative_cache=cache)
+    gauge_getter.gauge_pull(['1'], START, END, negative_cache=cache)
+    assert len(portals) == 2 * 2
+
+    cache = NegativeCache(path=path)
+    gauge_getter.gauge_pull(['1'], START, END, negative_cache=cache)
+    assert NegativeCache(path=path).is_empty('NSW', '1', 'F', 'day', START, END)
+
+
+def test_entries_are_kept_per_quality_policy(portals):
+    cache = NegativeCache()
+    gauge_getter.gauge_pull(['1'], START, END, quality=[10], negative_cache=cache)
+    assert cache.is_empty('NSW', '1', 'F', 'day', START, END, quality=[10])
+    assert not cache.is_empty('NSW', '1', 'F', 'day', START, END)
+
+    # Gauge 1 was only found empty under the strict policy, so it is asked for again
+    portals.clear()
+    gauge_getter.gauge_pull(['1'], START, END, negative_cache=cache)
+    assert portals[0] == ('NSW', 'F', ['1'])
+    portals.clear()
+    gauge_getter.gauge_pull(['1'], START, END, quality=[10], negative_cache=cache)
+    assert portals == []
@@ -0,0 +1,95 @@
+import json
+import datetime
+from io import StringIO
+import pytest
+from mdba_gauge_getter import gauge_getter, planner
+from mocks import MOCK_CSV
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+START = datetime.date(2000, 1, 1)
+END = datetime.date(2000, 1, 10)
+
+
+@pytest.fixture(autouse=True)
+def mock_catalogue():
+    real_uri = gauge_getter.gauge_data_uri
+    real = {name: getattr(gauge_getter, name)
+            for name in ('process_gauge_pull', 'gauge_pull_bom', 'gauge_pull_aq')}
+    gauge_getter.gauges = None
+    gauge_getter.gauge_data_uri = StringIO(MOCK_CSV)
+    yield
+    gauge_getter.gauge_data_uri = real_uri
+    gauge_getter.gauges = None
+    for name, fn in real.items():
+        setattr(gauge_getter, name, fn)
+
+
+def test_shard_windows():
+    assert planner.shard_windows(START, END, None) == [(START, END)]
+    assert planner.shard_windows(START, END, 4) == [
+        (datetime.date(2000, 1, 1), datetime.date(2000, 1, 4)),
+        (datetime.date(2000, 1, 5), datetime.date(2000, 1, 8)),
+        (datetime.date(2000, 1, 9), datetime.date(2000, 1, 10)),
+    ]
+    assert planner.periods(START, datetime.date(2001, 2, 1), 'month') == 14
+    assert planner.periods(START, END, 'hour') == 240
+
+
+def test_plan_gauge_pull():
+    plan = planner.plan_gauge_pull(['1', '2', '3', '4', '5', '6', '99'], START, END)
+    units = plan['units']
+    assert [(u['source'], u['sites']) for u in units] == [
+        ('NSW', ['1', '3']), ('VIC', ['4', '5']), ('QLD', ['2', '3', '4']), ('BOM', ['6'])]
+    assert units[0]['host'] == 'realtimedata.waternsw.com.au'
+    assert units[0]['fallback'] == 'BOM' and units[3]['fallback'] is None
+    assert units[0]['estimated_rows'] == 20
+    assert plan['summary']['requests'] == 4
+    assert plan['summary']['hosts']['www.bom.gov.au']['requests'] == 1
+    assert plan['unrouted'] == ['99']
+    assert json.loads(json.dumps(plan)) == plan
+
+    sharded = planner.plan_gauge_pull(['1'], START, END, var=['F', 'L'], shard_days=5)
+    assert [(u['var'], u['start'], u['end']) for u in sharded['units']] == [
+        ('F', '2000-01-01', '2000-01-05'), ('F', '2000-01-06', '2000-01-10'),
+        ('L', '2000-01-01', '2000-01-05'), ('L', '2000-01-06', '2000-01-10')]
+    assert sharded['summary']['estimated_rows'] == 20
+
+    assert gauge_getter.gauge_pull(['1'], START, END, dry_run=True)['summary']['requests'] == 1
+
+
+def test_split_plan():
+    plan = planner.plan_gauge_pull(['1', '2', '3', '4', '5', '6'], START, END, shard_days=2)
+    parts = planner.split_plan(plan, 3)
+    ids = sorted(u['id'] for part in parts for u in part['units'])
+    assert ids == list(range(len(plan['units'])))
+    loads = [part['summary']['estimated_bytes'] for part in parts]
+    assert max(loads) - min(loads) <= max(u['estimated_bytes'] for u in plan['units'])
+
+
+def test_execute_plan():
+    calls = []
+
+    def process_gauge_pull(sites, state, source, start, end, var, interval, data_type, **opts):
+        calls.append((state, tuple(sites), start, end))
+        if state == 'QLD':
+            return []
+        return [[state, site, 'WATER', start, 1.0, 130] for site in sites]
+
+    def gauge_pull_bom(sites, start, end, var, interval, data_type, **opts):
+        calls.append(('BOM', tuple(sites), start, end))
+        return [['BOM', site, 'WATER', start, 2.0, 10] for site in sites]
+
+    gauge_getter.process_gauge_pull = process_gauge_pull
+    gauge_getter.gauge_pull_bom = gauge_pull_bom
+
+    plan = json.loads(json.dumps(planner.plan_gauge_pull(['1', '2'], START, END, var=['F', 'L'])))
+    df = planner.execute_plan(plan)
+    assert list(df.columns) == gauge_getter.DATA_COLUMNS[:3] + ['VAR'] + gauge_getter.DATA_COLUMNS[3:]
+    # QLD returned nothing for gauge 2, so that unit fell back to BOM
+    assert list(zip(df['DATASOURCEID'], df['SITEID'], df['VAR'])) == [
+        ('NSW', '1', 'F'), ('BOM', '2', 'F'), ('NSW', '1', 'L'), ('BOM', '2', 'L')]
+    assert calls[0] == ('NSW', ('1',), START, END)
+
+    with pytest.raises(ValueError):
+        planner.execute_plan({**plan, 'version': 0})
@@ -0,0 +1,75 @@
+import json
+import datetime
+from io import StringIO
+import pytest
+from mdba_gauge_getter import gauge_getter, sources
+from mdba_gauge_getter.prefetch import PrefetchScheduler, load_prefetch_config, warm
+from mdba_gauge_getter.stores import MemoryStore
+from mocks import MOCK_CSV
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+TODAY = datetime.date(2000, 1, 10)
+
+CONFIG = {'jobs': [{'name': 'morning', 'gauges': ['1', 2, '5'], 'var': ['F', 'L'], 'days': 5,
+                    'at': ['05:30', '12:00']},
+                   {'gauges': ['3'], 'days': 2, 'at': '23:00'}]}
+
+
+@pytest.fixture(autouse=True)
+def mock_pull():
+    calls = []
+
+    def process_gauge_pull(sites, state, source, start, end, var, interval, data_type, **opts):
+        calls.append((state, tuple(sites), var))
+        return [[state, site, 'WATER', end, 1.0, 130] for site in sites]
+
+    real_uri = gauge_getter.gauge_data_uri
+    real = gauge_getter.process_gauge_pull
+    gauge_getter.gauges = None
+    gauge_getter.gauge_data_uri = StringIO(MOCK_CSV)
+    gauge_getter.process_gauge_pull = process_gauge_pull
+    limiters = {source.name: source.background_limiter for source in sources.sources()}
+    for source in sources.sources():
+        source.background_limiter = sources.RateLimiter(1, 0.0)
+    yield calls
+    for source in sources.sources():
+        source.background_limiter = limiters[source.name]
+    gauge_getter.gauge_data_uri = real_uri
+    gauge_getter.gauges = None
+    gauge_getter.process_gauge_pull = real
+
+
+def test_load_prefetch_config(tmp_path):
+    path = tmp_path / 'prefetch.json'
+    path.write_text(json.dumps(CONFIG))
+    jobs = load_prefetch_config(str(path))
+    assert [job['name'] for job in jobs] == ['morning', 'job-1']
+    assert jobs[0]['gauges'] == ['1', '2', '5'] and jobs[1]['var'] == ['F']
+    assert jobs[1]['at'] == [datetime.time(23, 0)]
+    with pytest.raises(ValueError):
+        load_prefetch_config({'jobs': [{'gauges': ['1']}]})
+
+
+def test_warm_serves_later_pulls_from_store(mock_pull):
+    store = MemoryStore()
+    job = load_prefetch_config(CONFIG)[0]
+    assert warm(job, store, TODAY) == 6
+    assert sorted(mock_pull) == sorted([('NSW', ('1',), 'F'), ('QLD', ('2',), 'F'),
+                                        ('VIC', ('5',), 'F'), ('NSW', ('1',), 'L'),
+                                        ('QLD', ('2',), 'L'), ('VIC', ('5',), 'L')])
+    mock_pull.clear()
+    df = gauge_getter.gauge_pull(['1', '2', '5'], TODAY - datetime.timedelta(days=3), TODAY,
+                                 var=['F', 'L'], store=store)
+    assert mock_pull == []
+    assert sorted(set(df['SITEID'])) == ['1', '2', '5']
+
+
+def test_scheduler_runs_due_jobs_once(mock_pull):
+    scheduler = PrefetchScheduler(CONFIG, MemoryStore())
+    morning = datetime.datetime(2000, 1, 10, 6, 0)
+    assert scheduler.run_pending(datetime.datetime(2000, 1, 10, 5, 0)) == []
+    assert scheduler.run_pending(morning) == ['morning']
+    assert scheduler.run_pending(morning + datetime.timedelta(hours=1)) == []
+    assert scheduler.run_pending(datetime.datetime(2000, 1, 10, 23, 30)) == ['morning', 'job-1']
+    assert scheduler.run_pending(datetime.datetime(2000, 1, 11, 5, 45)) == ['morning']
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from mdba_gauge_getter import gauge_getter
+from mdba_gauge_getter.quality import QualityFilter, quality_mask
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+
+def test_quality_mask():
+    codes = np.array([10, 90, 130, 150, 255, 999])
+    assert list(quality_mask(codes, None)) == [True] * 6
+    assert list(quality_mask(codes, [10, 90])) == [True, True, False, False, False, False]
+    assert list(quality_mask(codes, [(100, 200), 999])) == [False, False, True, True, False, True]
+    assert list(quality_mask(codes, [(None, 90), (255, None)])) == \
+        [True, True, False, False, True, True]
+    assert not quality_mask(codes, []).any()
+
+
+def test_quality_filter_policy():
+    default = QualityFilter()
+    assert default.allowed('NSW') == [(None, 998)]
+    assert default.allowed('BOM') is None
+
+    policy = QualityFilter({'state': [(None, 150)], 'VIC': [1], 'BOM': [10]})
+    assert policy.allowed('NSW') == [(None, 150)]
+    assert policy.allowed('VIC') == [1]
+    assert policy.allowed('BOM') == [10]
+    assert policy.allowed('SA') is None
+
+    assert QualityFilter([130]).allowed('BOM') == [130]
+    assert QualityFilter({'default': [1]}).allowed('QLD') == [1]
+
+
+def test_quality_filter_counts_drops():
+    quality = QualityFilter({'NSW': [(None, 150)]})
+    keep = quality.mask('NSW', np.array([130, 130, 160, 255, 255, 255]))
+    assert list(keep) == [True, True, False, False, False, False]
+    quality.mask('BOM', np.array([10, 90]))
+    assert quality.report() == {'NSW': {160: 1, 255: 3}}
+
+
+def test_extract_with_policy():
+    data = {'return': {'traces': [{'site': '1', 'trace': [
+        {'q': 130, 't': '20210101000000', 'v': '1.5'},
+        {'q': 160, 't': 'not-a-date', 'v': '2.5'},
+        {'q': 255, 't': 'not-a-date', 'v': '3.5'},
+    ]}]}}
+    context = gauge_getter.PullContext({'state': [(None, 150)]})
+    # Rejected rows never have their timestamps parsed
+    assert len(gauge_getter.extract_data('NSW', data, context)) == 1
+    assert list(gauge_getter.extract_columns('NSW', data, context)['VALUE']) == [1.5]
+    assert context.report() == {'quality_dropped': {'NSW': {160: 2, 255: 2}}}
+
+
+def test_bom_quality():
+    ts = pd.DataFrame({'Value': [1.0, 2.0, 3.0], 'Quality': [10, 90, 140]},
+                      index=pd.date_range('2000-01-01', periods=3))
+    assert gauge_getter.bom_quality(ts) is ts
+
+    context = gauge_getter.PullContext({'BOM': [(None, 90)]})
+    assert list(gauge_getter.bom_quality(ts, context)['Value']) == [1.0, 2.0]
+    assert context.report() == {'quality_dropped': {'BOM': {140: 1}}}
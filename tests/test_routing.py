@@ -0,0 +1,112 @@
+import datetime
+from io import StringIO
+from types import SimpleNamespace
+import pytest
+from mdba_gauge_getter import gauge_getter
+from mdba_gauge_getter import routing as routing_module
+from mdba_gauge_getter.routing import RoutingTable
+from mocks import MOCK_CSV
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+START = datetime.date(2000, 1, 1)
+END = datetime.date(2000, 1, 2)
+
+# The gauges each portal actually serves. Gauge 3 is catalogued in NSW and QLD, gauge 4 in
+# QLD and VIC, and gauge 1 is catalogued in NSW but only BOM has it.
+SERVES = {'NSW': {'3'}, 'QLD': {'2'}, 'VIC': {'4', '5'}}
+
+
+@pytest.fixture
+def portals():
+    calls = []
+
+    def process_gauge_pull(sites, state, source, start, end, var, interval, data_type, **opts):
+        if sites:
+            calls.append((state, sorted(sites)))
+        return [[state, site, 'WATER', start, 1.0, 130] for site in sites
+                if site in SERVES[state]]
+
+    def gauge_pull_bom(sites, start, end, var, interval, data_type, **opts):
+        if sites:
+            calls.append(('BOM', sorted(sites)))
+        return [['BOM', site, 'WATER', start, 2.0, 10] for site in sites]
+
+    real_uri = gauge_getter.gauge_data_uri
+    real = {name: getattr(gauge_getter, name) for name in ('process_gauge_pull', 'gauge_pull_bom')}
+    gauge_getter.gauges = None
+    gauge_getter.gauge_data_uri = StringIO(MOCK_CSV)
+    gauge_getter.process_gauge_pull = process_gauge_pull
+    gauge_getter.gauge_pull_bom = gauge_pull_bom
+    yield calls
+    gauge_getter.gauge_data_uri = real_uri
+    gauge_getter.gauges = None
+    for name, fn in real.items():
+        setattr(gauge_getter, name, fn)
+
+
+def test_routes_are_learned_and_used(portals, tmp_path):
+    path = str(tmp_path / 'routes.json')
+    routing = RoutingTable(path)
+    first = gauge_getter.gauge_pull(['1', '2', '3', '4', '5'], START, END, routing=routing)
+    assert sorted(portals) == [('NSW', ['1', '3']), ('QLD', ['2', '3', '4']),
+                               ('VIC', ['4', '5'])]
+    assert sorted(first['SITEID']) == ['2', '3', '4', '5']
+
+    # Reloaded from disk, gauges 3 and 4 now go only to the portal which answered for them
+    portals.clear()
+    routing = RoutingTable(path)
+    again = gauge_getter.gauge_pull(['1', '2', '3', '4', '5'], START, END, routing=routing)
+    assert sorted(portals) == [('NSW', ['1', '3']), ('QLD', ['2']), ('VIC', ['4', '5'])]
+    assert sorted(again['SITEID']) == sorted(first['SITEID'])
+
+    portals.clear()
+    routing.override('1', 'BOM')
+    gauge_getter.gauge_pull(['1', '3'], START, END, routing=routing)
+    assert sorted(portals) == [('BOM', ['1']), ('NSW', ['3'])]
+    assert routing.source_for('1', 'L', 'day') == 'BOM'
+
+
+def test_stale_routes_are_reprobed():
+    routing = RoutingTable(reprobe_days=30)
+    routing.learn([('3', 'NSW'), ('3', 'NSW'), ('3', 'QLD')], 'F', 'day',
+                  today=datetime.date(2000, 1, 1))
+    assert routing.source_for('3', 'F', 'day', datetime.date(2000, 1, 30)) == 'NSW'
+    assert routing.source_for('3', 'F', 'day', datetime.date(2000, 1, 31)) is None
+    assert routing.source_for('3', 'L', 'day', datetime.date(2000, 1, 2)) is None
+
+
+def test_repeated_pulls_reprobe(portals, monkeypatch):
+    class Clock(datetime.date):
+        current = START
+
+        @classmethod
+        def today(cls):
+            return cls.current
+
+    monkeypatch.setattr(routing_module, 'datetime', SimpleNamespace(date=Clock))
+    routing = RoutingTable(reprobe_days=30)
+    probes = []
+    for day in range(0, 120, 7):
+        Clock.current = START + datetime.timedelta(days=day)
+        portals.clear()
+        gauge_getter.gauge_pull(['3'], START, END, routing=routing)
+        if ('QLD', ['3']) in portals:
+            probes.append(day)
+    # Pulls confirming the route do not restamp it, so it is reprobed once it is 30 days old
+    assert probes == [0, 35, 70, 105]
+
+
+def test_apply():
+    routing = RoutingTable()
+    routing.override('3', 'QLD')
+    routing.override('1', 'BOM', 'F', 'day')
+    routing.override('A4261002', 'SA')
+    gauges_by_state = {'NSW': ['1', '3'], 'VIC': [], 'QLD': ['2', '3'], 'SA': ['6'],
+                       'rest': ['A4261002'], 'BOM': ['6']}
+    assert routing.apply(gauges_by_state, 'F', 'day') == {
+        'NSW': [], 'VIC': [], 'QLD': ['3', '2'], 'SA': ['6'], 'rest': ['A4261002'],
+        'BOM': ['1', '6']}
+    assert routing.apply(gauges_by_state, 'L', 'day')['NSW'] == ['1']
+    with pytest.raises(ValueError):
+        routing.override('1', 'WA')
@@ -0,0 +1,54 @@
+from io import StringIO
+import pandas as pd
+import pytest
+from mdba_gauge_getter import gauge_getter
+from mdba_gauge_getter.search import GaugeNameIndex, tokenize
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+CATALOGUE = pd.DataFrame({
+    'gauge_name': ['CULGOA @ WHYENBAH', 'CULGOA @ WHYENBAH', 'CULGOA RIVER @ BROWN LAGOON',
+                   'MURRAY @ LOCK 1 DOWNSTREAM', 'MURRUMBIDGEE @ WAGGA WAGGA'],
+    'gauge_number': ['422204A', '422204A', '422006', 'A4260903', '410001'],
+    'gauge_owner': ['NSW - WaterNSW', 'QLD - DNRME', 'NSW - WaterNSW', 'SA - DEW',
+                    'NSW - WaterNSW'],
+    'State': ['NSW', 'QLD', 'NSW', 'SA', 'NSW'],
+})
+
+
+@pytest.fixture(autouse=True)
+def restore_catalogue():
+    yield
+    gauge_getter.gauges = None
+
+
+def test_tokenize():
+    assert tokenize('Culgoa @ Whyenbah') == ['CULGOA', 'WHYENBAH']
+    assert tokenize('LOCK-1') == ['LOCK', '1']
+
+
+def test_exact_match_ranks_first_and_returns_all_states():
+    results = GaugeNameIndex(CATALOGUE).search('CULGOA @ WHYENBAH')
+    assert [r['gauge_number'] for r in results[:2]] == ['422204A', '422204A']
+    assert {r['State'] for r in results[:2]} == {'NSW', 'QLD'}
+    assert results[0]['score'] == 1.0
+    assert results[2]['gauge_number'] == '422006'
+    assert results[2]['score'] < 1.0
+
+
+def test_prefix_number_and_fuzzy_matches():
+    index = GaugeNameIndex(CATALOGUE)
+    # Equal prefix scores, so the shorter name ranks first
+    assert [r['gauge_number'] for r in index.search('murr')] == ['410001', 'A4260903']
+    assert index.search('4222')[0]['gauge_number'] == '422204A'
+    assert index.search('murumbidgee')[0]['gauge_number'] == '410001'
+    assert index.search('lock 1', limit=1)[0]['gauge_owner'] == 'SA - DEW'
+    assert index.search('zzzz') == []
+    assert index.search('') == []
+
+
+def test_search_gauges_builds_once():
+    gauge_getter.gauges = CATALOGUE
+    first = gauge_getter.catalogue_index('name', GaugeNameIndex)
+    assert gauge_getter.search_gauges('wagga')[0]['gauge_number'] == '410001'
+    assert gauge_getter.catalogue_index('name', GaugeNameIndex) is first
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import multiprocessing
+import datetime
+from io import StringIO
+import pytest
+from mdba_gauge_getter import gauge_getter, planner, sharding, sources
+from mocks import MOCK_CSV
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+START = datetime.date(2000, 1, 1)
+END = datetime.date(2000, 1, 10)
+
+
+def process_gauge_pull(sites, state, source, start, end, var, interval, data_type, **opts):
+    return [[state, site, 'WATER', start, float(len(site)), 130] for site in sites]
+
+
+def gauge_pull_bom(sites, start, end, var, interval, data_type, **opts):
+    return [['BOM', site, 'WATER', start, 2.0, 10] for site in sites]
+
+
+@pytest.fixture(autouse=True)
+def mock_pull():
+    real_uri = gauge_getter.gauge_data_uri
+    real = {name: getattr(gauge_getter, name) for name in ('process_gauge_pull', 'gauge_pull_bom')}
+    gauge_getter.gauges = None
+    gauge_getter.gauge_data_uri = StringIO(MOCK_CSV)
+    gauge_getter.process_gauge_pull = process_gauge_pull
+    gauge_getter.gauge_pull_bom = gauge_pull_bom
+    limiters = {source.name: source.limiter for source in sources.sources()}
+    for source in sources.sources():
+        source.limiter = sources.RateLimiter(source.limiter.max_concurrency, 0.0)
+    yield
+    for source in sources.sources():
+        source.limiter = limiters[source.name]
+    gauge_getter.gauge_data_uri = real_uri
+    gauge_getter.gauges = None
+    for name, fn in real.items():
+        setattr(gauge_getter, name, fn)
+
+
+def make_plan():
+    return planner.plan_gauge_pull(['1', '2', '3', '4', '5', '6'], START, END, shard_days=3)
+
+
+def test_shard_plan():
+    plan = make_plan()
+    shards = sharding.shard_plan(plan, units_per_shard=3)
+    assert all(len({u['host'] for u in shard['units']}) == 1 for shard in shards)
+    assert all(len(shard['units']) <= 3 for shard in shards)
+    assert sorted(u['id'] for s in shards for u in s['units']) == list(range(len(plan['units'])))
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_run_sharded(tmp_path, processes):
+    # Worker processes see this module's mocks only when forked
+    if processes and 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip('fork is not available')
+    context = multiprocessing.get_context('fork') if processes else None
+    plan = make_plan()
+    df = sharding.run_sharded(plan, str(tmp_path), processes=processes, units_per_shard=2,
+                              mp_context=context)
+    expected = planner.execute_plan(plan)
+    key = ['DATASOURCEID', 'SITEID', 'DATETIME']
+    assert df.sort_values(key).reset_index(drop=True).equals(
+        expected.sort_values(key).reset_index(drop=True))
+    assert sharding.queue_status(str(tmp_path)) == {
+        'pending': 0, 'running': 0, 'done': len(sharding.shard_plan(plan, 2)), 'failed': 0}
+
+
+def test_failed_and_stale_shards(tmp_path):
+    root = str(tmp_path)
+    names = sharding.enqueue_plan(make_plan(), root, units_per_shard=100)
+    # A worker on another node claims a shard, then dies
+    assert sharding.claim(root) == names[0]
+    with pytest.raises(RuntimeError):
+        sharding.merge_parts(root)
+
+    gauge_getter.gauge_pull_bom = None # makes the BOM shard fail
+    stats = sharding.run_worker(root, worker_id='test')
+    assert stats['failed'] == 1 and stats['done'] == len(names) - 2
+    assert os.path.exists(sharding.queue_path(root, 'failed', f'{names[-1]}.error'))
+
+    gauge_getter.gauge_pull_bom = gauge_pull_bom
+    assert sharding.requeue_stale(root, 3600, include_failed=True) == [names[-1]]
+    assert sharding.requeue_stale(root, 0) == [names[0]]
+    sharding.main(['worker', root])
+    df = sharding.merge_parts(root)
+    assert sorted(df['SITEID'].unique()) == ['1', '2', '3', '4', '5', '6']
+
+
+def test_requeued_shard_is_taken_over(tmp_path):
+    root = str(tmp_path)
+    names = sharding.enqueue_plan(make_plan(), root, units_per_shard=100)
+    assert sharding.claim(root) == names[0]
+    # The shard is thought stale and requeued while its first worker is still running it
+    assert sharding.requeue_stale(root, 0) == [names[0]]
+    assert not sharding.finish_shard(root, names[0], 'done', 'slow')
+    stats = sharding.run_worker(root, worker_id='test')
+    assert stats['done'] == len(names) and stats['taken_over'] == 0
+    assert sharding.queue_status(root)['done'] == len(names)
+
+
+def test_running_shards_are_kept_fresh(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    names = sharding.enqueue_plan(make_plan(), root, units_per_shard=100)
+    execute_plan = planner.execute_plan
+    requeued = []
+
+    def slow_plan(shard, quality=None):
+        if not requeued:
+            time.sleep(0.3)
+            # The shard has run longer than `older_than`, but its worker has touched it since
+            requeued.append(sharding.requeue_stale(root, 0.2))
+        return execute_plan(shard, quality=quality)
+
+    monkeypatch.setattr(planner, 'execute_plan', slow_plan)
+    stats = sharding.run_worker(root, worker_id='test', heartbeat_interval=0.05)
+    assert requeued == [[]] and stats['done'] == len(names) and stats['taken_over'] == 0
+
+
+def test_enqueue_from_command_line(tmp_path, capsys):
+    plan_file = tmp_path / 'plan.json'
+    plan_file.write_text(json.dumps(planner.plan_gauge_pull(['99'], START, END)))
+    root = str(tmp_path / 'queue')
+    sharding.main(['enqueue', root, str(plan_file)])
+    sharding.main(['status', root])
+    assert json.loads(capsys.readouterr().out)['pending'] == 0
+    assert list(sharding.merge_parts(root).columns) == gauge_getter.DATA_COLUMNS
@@ -0,0 +1,189 @@
+import time
+import datetime
+import threading
+from io import StringIO
+import pytest
+from mdba_gauge_getter import gauge_getter, planner, sources
+from mocks import MOCK_CSV
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+DAY = datetime.date(2000, 1, 1)
+
+
+@pytest.fixture(autouse=True)
+def mock_catalogue():
+    real_uri = gauge_getter.gauge_data_uri
+    gauge_getter.gauges = None
+    gauge_getter.gauge_data_uri = StringIO(MOCK_CSV)
+    yield
+    gauge_getter.gauge_data_uri = real_uri
+    gauge_getter.gauges = None
+
+
+def test_registry():
+    assert [s.name for s in sources.sources()][:5] == ['NSW', 'VIC', 'QLD', 'BOM', 'SA']
+    nsw = sources.get_source('NSW')
+    assert nsw.url == 'https://realtimedata.waternsw.com.au/cgi/webservice.exe'
+    assert nsw.data_source == 'CP' and nsw.fallback == 'BOM'
+    assert sources.get_source('QLD').url.endswith('/cgi/webservice.pl')
+    assert nsw.max_sites_per_request == 5
+    assert nsw.batches(['1', '2', '3', '4', '5', '6']) == [['1', '2', '3', '4', '5'], ['6']]
+    with pytest.raises(KeyError):
+        sources.get_source('WA')
+
+
+def test_declared_capabilities():
+    assert sources.get_source('QLD').supports('DO', 'day', 'mean')
+    bom = sources.get_source('BOM')
+    assert bom.supports('F', 'h', 'mean')
+    assert not bom.supports('DO', 'day', 'mean')
+    assert not bom.supports('P', 'hour', 'tot')
+    assert not sources.get_source('SA').supports('L', 'day', 'mean')
+
+
+def test_bom_procedure():
+    assert gauge_getter.bom_procedure('F', 'hour', 'max') == \
+        ('Water_Course_Discharge', 'Pat4_C_B_1_HourlyMean')
+    assert gauge_getter.bom_procedure('SL', 'd', 'minimum') == \
+        ('Storage_Level', 'Pat7_C_B_1_DailyMin')
+    assert gauge_getter.bom_procedure('P', 'day', 'mean') == ('Rainfall', 'Pat2_C_B_1_DailyTot09')
+    assert gauge_getter.bom_procedure('WT', 'year', 'mean') == \
+        ('Water_Temperature', 'Pat1_C_B_1_YearlyMean')
+    with pytest.raises(NotImplementedError):
+        gauge_getter.bom_procedure('WT', 'hour', 'mean')
+    with pytest.raises(AttributeError):
+        gauge_getter.bom_procedure('DO', 'day', 'mean')
+
+
+def test_plan_skips_unsupported():
+    plan = planner.plan_gauge_pull(['1', '6'], DAY, DAY, var='DO')
+    assert [u['source'] for u in plan['units']] == ['NSW']
+    assert plan['unsupported'] == [{'source': 'BOM', 'var': 'DO', 'sites': ['6']}]
+
+
+def test_rate_limiter():
+    limiter = sources.RateLimiter(max_concurrency=2, min_interval=0.05)
+    active, peak, starts = [0], [0], []
+    lock = threading.Lock()
+
+    def task(_):
+        with limiter:
+            with lock:
+                starts.append(time.monotonic())
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.15)
+            with lock:
+                active[0] -= 1
+
+    class Source:
+        pass
+    source = Source()
+    source.limiter = sources.RateLimiter(8, 0.0)
+    sources.schedule(range(6), lambda _: source, task, workers=4)
+    assert peak[0] == 2
+    starts.sort()
+    assert all(b - a >= 0.045 for a, b in zip(starts, starts[1:]))
+
+
+def test_background_gives_way_to_interactive():
+    limiter = sources.RateLimiter(1, 0.0)
+    order = []
+
+    def take(name, background):
+        limiter.acquire(background=background)
+        order.append(name)
+        limiter.release()
+
+    limiter.acquire()
+    waiting = [threading.Thread(target=take, args=('background', True)),
+               threading.Thread(target=take, args=('interactive', False))]
+    for thread in waiting:
+        thread.start()
+        time.sleep(0.05)
+    assert not limiter.acquire(blocking=False)
+    limiter.release()
+    for thread in waiting:
+        thread.join()
+    assert order == ['interactive', 'background']
+
+
+def test_background_work_holds_the_shared_limiter():
+    class Source:
+        pass
+    source = Source()
+    source.limiter = sources.RateLimiter(1, 0.0)
+    source.background_limiter = sources.RateLimiter(1, 0.0)
+    started = threading.Event()
+
+    def task(_):
+        started.set()
+        time.sleep(0.2)
+
+    worker = threading.Thread(target=sources.schedule,
+                              args=([0], lambda _: source, task), kwargs={'background': True})
+    worker.start()
+    assert started.wait(1)
+    assert not source.limiter.acquire(blocking=False)
+    worker.join()
+    assert source.limiter.acquire(blocking=False)
+
+
+def test_execute_plan_concurrently():
+    real = gauge_getter.process_gauge_pull, gauge_getter.gauge_pull_bom
+    gauge_getter.process_gauge_pull = lambda sites, state, *args, **opts: \
+        [[state, site, 'WATER', DAY, 1.0, 130] for site in sites]
+    gauge_getter.gauge_pull_bom = lambda sites, *args, **opts: \
+        [['BOM', site, 'WATER', DAY, 1.0, 10] for site in sites]
+    try:
+        plan = planner.plan_gauge_pull(['1', '2', '4', '5', '6'], DAY, DAY)
+        df = planner.execute_plan(plan, workers=4)
+    finally:
+        gauge_getter.process_gauge_pull, gauge_getter.gauge_pull_bom = real
+    # Rows come back in plan order whatever order the units finished in
+    assert list(df['DATASOURCEID']) == ['NSW', 'VIC', 'VIC', 'QLD', 'QLD', 'BOM']
+
+
+def test_pull_var_asks_registered_sources():
+    class Portal(sources.SourceAdapter):
+        variables = frozenset({'F'})
+
+        def route(self, gauges_by_state):
+            return gauges_by_state.get('rest', [])
+
+        def fetch(self, sites, start, end, var, interval, data_type, **opts):
+            calls.append(sites)
+            return [['WA', site, 'WATER', start, 1.0, 1] for site in sites]
+
+    calls = []
+    sources.register_source(Portal('WA', 'wa.example', max_sites=2))
+    try:
+        rows = gauge_getter.pull_var(gauge_getter.route_gauges(['a', 'b', 'c']), DAY, DAY)
+    finally:
+        del sources._sources['WA'] # pylint: disable=protected-access
+    assert sorted(calls) == [['a', 'b'], ['c']]
+    assert [row[1] for row in rows] == ['a', 'b', 'c']
+
+
+def test_pull_vars_schedules_requests_together():
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def process_gauge_pull(sites, state, source, start, end, var, interval, data_type, **opts):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.2)
+        with lock:
+            active[0] -= 1
+        return [[state, site, 'WATER', start, 1.0, 130] for site in sites]
+
+    real = gauge_getter.process_gauge_pull, gauge_getter.PULL_WORKERS
+    gauge_getter.process_gauge_pull, gauge_getter.PULL_WORKERS = process_gauge_pull, 2
+    try:
+        df = gauge_getter.gauge_pull(['1'], DAY, DAY, var=['F', 'L'])
+    finally:
+        gauge_getter.process_gauge_pull, gauge_getter.PULL_WORKERS = real
+    assert peak[0] == 2
+    assert list(df['VAR']) == ['F', 'L']
@@ -0,0 +1,93 @@
+import datetime
+from io import StringIO
+import numpy as np
+import pandas as pd
+import pytest
+from mdba_gauge_getter import gauge_getter
+from mdba_gauge_getter.spatial import GaugeIndex, haversine_km, points_in_polygon
+from mocks import MOCK_CSV
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+
+def load_mock_catalogue():
+    gauge_getter.gauges = None
+    gauge_getter.gauge_data_uri = StringIO(MOCK_CSV)
+    return gauge_getter.load_gauges()
+
+
+@pytest.fixture(autouse=True)
+def restore_catalogue():
+    real_uri = gauge_getter.gauge_data_uri
+    yield
+    gauge_getter.gauge_data_uri = real_uri
+    gauge_getter.gauges = None
+
+
+def brute_force_radius(catalogue, lat, lon, km):
+    d = haversine_km(lat, lon, catalogue['lat'].to_numpy(), catalogue['long'].to_numpy())
+    return list(dict.fromkeys(catalogue['gauge_number'][d <= km]))
+
+
+def test_catalogue_keeps_coordinates():
+    catalogue = load_mock_catalogue()
+    assert {'lat', 'long', 'gauge_owner', 'State'} <= set(catalogue.columns)
+
+
+def test_bbox_and_radius():
+    index = GaugeIndex(load_mock_catalogue(), cell_size=0.5)
+    assert index.bbox(1.0, -3.5, 3.2, -1.0) == ['1', '2', '3']
+    assert index.bbox(100, 10, 101, 11) == []
+    assert index.radius(-1.111, 1.111, 1.0) == ['1']
+    assert index.radius(-4.15, 4.15, 20) == ['4']
+
+
+def test_nearest_and_polygon():
+    index = GaugeIndex(load_mock_catalogue(), cell_size=0.5)
+    assert index.nearest(-5.0, 5.0, 2) == ['5', '4']
+    assert index.nearest(-5.0, 5.0, 0) == []
+    square = [(0.0, 0.0), (3.2, 0.0), (3.2, -3.2), (0.0, -3.2)]
+    assert index.polygon(square) == ['1', '2', '3']
+    assert index.region({'type': 'Polygon', 'coordinates': [square]}) == ['1', '2', '3']
+    assert index.region({'lat': -6.111, 'lon': 6.111, 'nearest': 1}) == ['6']
+    with pytest.raises(ValueError):
+        index.region({'circle': 1})
+
+
+def test_matches_brute_force():
+    rng = np.random.default_rng(0)
+    catalogue = pd.DataFrame({
+        'gauge_number': [str(i) for i in range(2000)],
+        'lat': rng.uniform(-40, -10, 2000),
+        'long': rng.uniform(115, 155, 2000),
+    })
+    index = GaugeIndex(catalogue)
+    for lat, lon, km in [(-30, 140, 150), (-35.5, 149, 400), (-10, 115, 50)]:
+        assert sorted(index.radius(lat, lon, km)) == sorted(brute_force_radius(catalogue, lat, lon, km))
+    d = haversine_km(-30, 140, catalogue['lat'].to_numpy(), catalogue['long'].to_numpy())
+    boxes = [(140, -30, 142, -28), (150, -20, 155, -10), (0, 0, 1, 1)]
+    assert index.bbox_many(boxes) == [index.bbox(*b) for b in boxes]
+    assert index.nearest(-30, 140, 5) == list(catalogue['gauge_number'][np.argsort(d)[:5]])
+
+
+def test_points_in_polygon():
+    triangle = [(0, 0), (4, 0), (0, 4)]
+    inside = points_in_polygon(np.array([1.0, 3.0, -1.0]), np.array([1.0, 3.0, 1.0]), triangle)
+    assert list(inside) == [True, False, False]
+
+
+def test_gauge_pull_region():
+    load_mock_catalogue()
+    pulled = []
+    real = gauge_getter.route_gauges
+    gauge_getter.route_gauges = lambda gauges, data_source: pulled.append(gauges) or {
+        'NSW': [], 'QLD': [], 'VIC': [], 'SA': [], 'rest': []}
+    try:
+        day = datetime.date(2000, 1, 1)
+        gauge_getter.gauge_pull(None, day, day, region={'bbox': (4.0, -5.5, 5.5, -4.0)})
+        with pytest.raises(ValueError):
+            gauge_getter.gauge_pull(['1'], day, day, region={'bbox': (0, 0, 1, 1)})
+    finally:
+        gauge_getter.route_gauges = real
+    assert pulled == [['4', '5']]
+    assert gauge_getter.gauge_index() is gauge_getter.gauge_index()
@@ -0,0 +1,63 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from mdba_gauge_getter.spill import SpillBuffer, parse_size, batch_len
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+
+def make_batch(site, n):
+    return {
+        'DATASOURCEID': np.full(n, 'NSW', dtype=object),
+        'SITEID': np.full(n, site, dtype=object),
+        'SUBJECTID': np.full(n, 'WATER', dtype=object),
+        'DATETIME': pd.date_range('2000-01-01', periods=n).to_numpy(),
+        'VALUE': np.arange(n, dtype='float64'),
+        'QUALITYCODE': np.full(n, 130),
+    }
+
+
+def test_parse_size():
+    assert parse_size(1024) == 1024
+    assert parse_size('2KB') == 2048
+    assert parse_size('1.5 MB') == 1536 * 1024
+    assert parse_size('1GB') == 1024 ** 3
+    assert parse_size('100') == 100
+
+
+def test_batch_len():
+    assert batch_len({}) == 0
+    assert batch_len(make_batch('A', 7)) == 7
+
+
+def test_spills_and_merges_in_order():
+    with SpillBuffer('4KB') as buffer:
+        for i in range(20):
+            buffer.append(make_batch(f'site{i}', 50))
+        assert buffer.spills > 0
+        tmpdir = buffer._tmpdir
+        assert os.listdir(tmpdir)
+        # The buffer never holds much more than one batch beyond its budget
+        assert buffer.peak_bytes < 4096 + 5000
+        df = buffer.result()
+    assert not os.path.exists(tmpdir)
+    assert len(df) == 1000
+    assert list(df['SITEID'].unique()) == [f'site{i}' for i in range(20)]
+    assert df['SITEID'].dtype == 'category'
+    assert df['VALUE'].dtype == 'float64'
+
+
+def test_sink_receives_parts():
+    parts = []
+    buffer = SpillBuffer(1, sink=parts.append)
+    buffer.append(make_batch('A', 3), VAR='F')
+    buffer.append(make_batch('B', 2), VAR='L')
+    assert buffer.result() is None
+    assert [len(p) for p in parts] == [3, 2]
+    assert list(parts[1]['VAR']) == ['L', 'L']
+
+
+def test_invalid_budget():
+    with pytest.raises(ValueError):
+        SpillBuffer(0)
@@ -0,0 +1,234 @@
+import datetime
+import multiprocessing
+import pandas as pd
+import pytest
+from mdba_gauge_getter import gauge_getter
+from mdba_gauge_getter.stores import MemoryStore, ResultCache, SQLiteStore, merge_ranges
+from mdba_gauge_getter.derive import derivation_sources, resample
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+JAN1 = datetime.date(2000, 1, 1)
+FEB29 = datetime.date(2000, 2, 29)
+
+
+def daily(site, start, end, value=1.0):
+    days = pd.date_range(start, end).date
+    return [['NSW', site, 'WATER', day, value + i, 130] for i, day in enumerate(days)]
+
+
+@pytest.fixture(params=['memory', 'cache', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStore()
+    if request.param == 'cache':
+        return ResultCache()
+    return SQLiteStore(str(tmp_path / 'observations.db'))
+
+
+@pytest.fixture
+def upstream():
+    calls = []
+
+    def pull_var(gauges_by_state, start, end, var, interval, data_type, **kwargs):
+        sites = gauges_by_state['NSW']
+        calls.append((tuple(sites), interval, data_type))
+        # Gauge 9 has no data
+        sites = [site for site in sites if site != '9']
+        if interval in ('month', 'm'):
+            return [['NSW', site, 'WATER', start, 99.0, 130] for site in sites]
+        return [row for site in sites for row in daily(site, start, end)]
+
+    real = gauge_getter.pull_var, gauge_getter.route_gauges
+    gauge_getter.pull_var = pull_var
+    gauge_getter.route_gauges = lambda gauges, source: {
+        'NSW': list(gauges), 'VIC': [], 'QLD': [], 'SA': [], 'rest': []}
+    yield calls
+    gauge_getter.pull_var, gauge_getter.route_gauges = real
+
+
+def test_merge_ranges():
+    assert merge_ranges([(5, 9), (1, 3), (4, 4), (12, 14)]) == [(1, 9), (12, 14)]
+
+
+def test_store(store):
+    frame = pd.DataFrame(daily('1', JAN1, FEB29), columns=gauge_getter.DATA_COLUMNS)
+    store.write(frame, ['1', '2'], JAN1, FEB29, 'F', 'day', 'mean')
+    held, covered = store.read(['1', '2', '3'], datetime.date(2000, 1, 10),
+                               datetime.date(2000, 1, 12), 'F', 'day', 'mean')
+    # Gauge 2 returned nothing, which is remembered; gauge 3 was never pulled
+    assert covered == ['1', '2']
+    assert list(held['VALUE']) == [10.0, 11.0, 12.0]
+    assert held['DATETIME'][0] == datetime.date(2000, 1, 10)
+    assert store.read(['1'], JAN1, datetime.date(2000, 3, 1), 'F', 'day', 'mean')[1] == []
+
+    store.write(pd.DataFrame(daily('1', JAN1, JAN1, value=50.0), columns=gauge_getter.DATA_COLUMNS),
+                ['1'], JAN1, JAN1, 'F', 'day', 'mean')
+    if isinstance(store, ResultCache):
+        # Results are held as pulled: each window is read from the one result holding it
+        assert list(store.read(['1'], JAN1, JAN1, 'F', 'day', 'mean')[0]['VALUE']) == [50.0]
+        held, _ = store.read(['1'], datetime.date(2000, 1, 2), datetime.date(2000, 1, 3),
+                             'F', 'day', 'mean')
+        assert list(held['VALUE']) == [2.0, 3.0]
+        assert store.coverage('1', 'F', 'day', 'mean') == [(JAN1, FEB29)]
+        return
+    held, _ = store.read(['1'], JAN1, datetime.date(2000, 1, 2), 'F', 'day', 'mean')
+    assert list(held['VALUE']) == [50.0, 2.0]
+
+
+def test_store_keeps_sub_daily_rows(store):
+    hours = pd.date_range('2000-01-02', periods=24, freq='h')
+    rows = [['NSW', '1', 'WATER', hour.date(), float(i), 130] for i, hour in enumerate(hours)]
+    store.write(pd.DataFrame(rows, columns=gauge_getter.DATA_COLUMNS), ['1'], JAN1,
+                datetime.date(2000, 1, 2), 'F', 'hour', 'mean')
+    held, covered = store.read(['1'], JAN1, datetime.date(2000, 1, 2), 'F', 'hour', 'mean')
+    assert covered == ['1'] and list(held['VALUE']) == [float(i) for i in range(24)]
+
+
+def test_store_keeps_data_sources_apart(store):
+    frame = pd.DataFrame(daily('1', JAN1, JAN1), columns=gauge_getter.DATA_COLUMNS)
+    store.write(frame, ['1'], JAN1, JAN1, 'F', 'day', 'mean', 'bom')
+    assert store.read(['1'], JAN1, JAN1, 'F', 'day', 'mean')[1] == []
+    assert store.read(['1'], JAN1, JAN1, 'F', 'day', 'mean', 'bom')[1] == ['1']
+
+
+def test_store_keeps_quality_policies_apart(store):
+    frame = pd.DataFrame(daily('1', JAN1, JAN1), columns=gauge_getter.DATA_COLUMNS)
+    store.write(frame, ['1'], JAN1, JAN1, 'F', 'day', 'mean', quality=[130])
+    assert store.read(['1'], JAN1, JAN1, 'F', 'day', 'mean')[1] == []
+    assert store.read(['1'], JAN1, JAN1, 'F', 'day', 'mean', quality=[130])[1] == ['1']
+
+
+def write_site(path, site):
+    frame = pd.DataFrame(daily(site, JAN1, FEB29), columns=gauge_getter.DATA_COLUMNS)
+    SQLiteStore(path).write(frame, [site], JAN1, FEB29, 'F', 'day', 'mean')
+
+
+def test_sqlite_store_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'observations.db')
+    store = SQLiteStore(path)
+    workers = [multiprocessing.Process(target=write_site, args=(path, site))
+               for site in ('1', '2', '3', '4')]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    held, covered = store.read(['4', '1', '2', '3'], JAN1, FEB29, 'F', 'day', 'mean')
+    assert covered == ['4', '1', '2', '3'] and len(held) == 240
+    assert list(held['SITEID'].unique()) == ['1', '2', '3', '4']
+    assert store.coverage('1', 'F', 'day', 'mean') == [(JAN1, FEB29)]
+
+
+def test_result_cache_serves_subsets():
+    cache = ResultCache()
+    frame = pd.DataFrame(daily('1', JAN1, FEB29) + daily('2', JAN1, FEB29),
+                         columns=gauge_getter.DATA_COLUMNS)
+    cache.write(frame, ['1', '2'], JAN1, FEB29, 'F', 'day', 'mean')
+    held, covered = cache.read(['2'], datetime.date(2000, 2, 1), datetime.date(2000, 2, 3),
+                               'F', 'day', 'mean')
+    assert covered == ['2'] and list(held['VALUE']) == [32.0, 33.0, 34.0]
+    assert held['SITEID'][0] == '2' and held['DATETIME'][0] == datetime.date(2000, 2, 1)
+    assert cache.read(['1', '3'], JAN1, FEB29, 'F', 'day', 'mean')[1] == ['1']
+    assert cache.read(['1'], JAN1, FEB29, 'F', 'day', 'max')[1] == []
+    stats = cache.stats()
+    assert (stats['hits'], stats['partial_hits'], stats['misses']) == (1, 1, 1)
+    assert stats['hit_ratio'] == pytest.approx(1 / 3)
+    assert stats['gauge_hit_ratio'] == pytest.approx(2 / 4)
+
+
+def test_result_cache_evicts_least_recently_used():
+    frames = {site: pd.DataFrame(daily(site, JAN1, FEB29), columns=gauge_getter.DATA_COLUMNS)
+              for site in ('1', '2', '3')}
+    size = ResultCache()
+    size.write(frames['1'], ['1'], JAN1, FEB29, 'F', 'day', 'mean')
+    cache = ResultCache(int(size.stats()['bytes'] * 2.5))
+    cache.write(frames['1'], ['1'], JAN1, FEB29, 'F', 'day', 'mean')
+    cache.write(frames['2'], ['2'], JAN1, FEB29, 'F', 'day', 'mean')
+    cache.read(['1'], JAN1, JAN1, 'F', 'day', 'mean')
+    cache.write(frames['3'], ['3'], JAN1, FEB29, 'F', 'day', 'mean')
+    assert cache.covered_sites(['1', '2', '3'], JAN1, FEB29, 'F', 'day', 'mean') == ['1', '3']
+    assert cache.stats()['evictions'] == 1 and cache.stats()['results'] == 2
+
+
+def test_result_cache_replaces_only_overlapping_dates():
+    cache = ResultCache()
+    frame = pd.DataFrame(daily('1', JAN1, FEB29) + daily('2', JAN1, FEB29),
+                         columns=gauge_getter.DATA_COLUMNS)
+    cache.write(frame, ['1', '2'], JAN1, FEB29, 'F', 'day', 'mean')
+    before = cache.stats()['bytes']
+    jan10 = datetime.date(2000, 1, 10)
+    cache.write(pd.DataFrame(daily('1', jan10, jan10, value=50.0),
+                             columns=gauge_getter.DATA_COLUMNS),
+                ['1'], jan10, jan10, 'F', 'day', 'mean')
+    # Gauge 1 is still served from the older result either side of the rewritten day
+    assert cache.covered_sites(['1'], JAN1, datetime.date(2000, 1, 9),
+                               'F', 'day', 'mean') == ['1']
+    assert cache.covered_sites(['1'], datetime.date(2000, 1, 11), FEB29,
+                               'F', 'day', 'mean') == ['1']
+    assert list(cache.read(['1'], jan10, jan10, 'F', 'day', 'mean')[0]['VALUE']) == [50.0]
+    assert cache.read(['2'], JAN1, FEB29, 'F', 'day', 'mean')[1] == ['2']
+    held = [result for _, result in cache._results.values()] # pylint: disable=protected-access
+    older = max(held, key=lambda result: len(result.frame))
+    assert len(older.frame) == 119 and older.nbytes < before
+    assert cache.stats()['bytes'] == sum(result.nbytes for result in held)
+
+
+def test_derivation_sources():
+    assert derivation_sources('year', 'max') == [('day', 'max'), ('month', 'max')]
+    assert derivation_sources('y', 'mean') == [('day', 'mean')]
+    assert derivation_sources('month', 'avg') == [('day', 'mean')]
+    assert derivation_sources('day', 'max') == []
+    assert derivation_sources('hour', 'mean') == []
+
+
+def test_resample():
+    frame = pd.DataFrame(daily('1', JAN1, FEB29) + daily('2', JAN1, datetime.date(2000, 1, 2)),
+                         columns=gauge_getter.DATA_COLUMNS)
+    frame.loc[3, 'QUALITYCODE'] = 150
+    monthly = resample(frame, 'month', 'max')
+    assert list(zip(monthly['SITEID'], monthly['DATETIME'], monthly['VALUE'],
+                    monthly['QUALITYCODE'])) == [
+        ('1', datetime.date(2000, 1, 1), 31.0, 150),
+        ('1', datetime.date(2000, 2, 1), 60.0, 130),
+        ('2', datetime.date(2000, 1, 1), 2.0, 130)]
+    assert list(resample(frame, 'year', 'mean')['VALUE']) == [30.5, 1.5]
+
+
+def test_gauge_pull_with_store(upstream, store):
+    first = gauge_getter.gauge_pull(['1', '2'], JAN1, FEB29, store=store)
+    assert len(first) == 120 and upstream == [(('1', '2'), 'day', 'mean')]
+
+    again = gauge_getter.gauge_pull(['1'], JAN1, datetime.date(2000, 1, 31), store=store)
+    assert len(again) == 31 and len(upstream) == 1
+
+    monthly = gauge_getter.gauge_pull(['1', '3'], JAN1, FEB29, interval='month', store=store,
+                                      derive=True)
+    # Gauge 1 is derived from its stored daily means, gauge 3 has to go upstream
+    assert upstream[-1] == (('3',), 'month', 'mean')
+    assert list(zip(monthly['SITEID'], monthly['VALUE'], monthly['DERIVED'])) == [
+        ('1', 16.0, 'day:mean'), ('1', 46.0, 'day:mean'), ('3', 99.0, None)]
+
+    # Gauge 3's monthly value is now held, and is served as is
+    monthly = gauge_getter.gauge_pull(['3'], JAN1, FEB29, interval='month', store=store,
+                                      derive=True)
+    assert len(upstream) == 2 and list(monthly['DERIVED']) == [None]
+
+    with pytest.raises(ValueError):
+        gauge_getter.gauge_pull(['1'], JAN1, FEB29, derive=True)
+
+
+def test_gauge_pull_with_store_asks_again(upstream, store):
+    gauge_getter.gauge_pull(['1'], JAN1, FEB29, store=store)
+    # Gauge 9 returns nothing, so it is not held as covered and the next pull asks again
+    gauge_getter.gauge_pull(['9'], JAN1, FEB29, store=store)
+    gauge_getter.gauge_pull(['9'], JAN1, FEB29, store=store)
+    assert upstream == [(('1',), 'day', 'mean')] + [(('9',), 'day', 'mean')] * 2
+
+    # Rows screened with another quality policy are not served
+    gauge_getter.gauge_pull(['1'], JAN1, FEB29, store=store, quality=[130])
+    assert upstream[-1] == (('1',), 'day', 'mean') and len(upstream) == 4
+
+    # Mid-month windows are not derived from part of a month, but pulled
+    monthly = gauge_getter.gauge_pull(['1'], datetime.date(2000, 1, 15), FEB29,
+                                      interval='month', store=store, derive=True)
+    assert upstream[-1] == (('1',), 'month', 'mean') and list(monthly['DERIVED']) == [None]
@@ -0,0 +1,88 @@
+import json
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from mdba_gauge_getter import gauge_getter
+from mdba_gauge_getter.decode import decode_kisters, unpack_batch, shutdown_decode_pools
+from mocks import MockRequestLib
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+START = datetime.date(2000, 1, 1)
+END = datetime.date(2000, 1, 2)
+AEST = gauge_getter.TIMESTAMP_TIMEZONE
+
+RESPONSE = {'error_num': 0, 'return': {'traces': [
+    {'site': '2', 'trace': [{'q': 130, 't': 20000101093000, 'v': '2.5'},
+                            {'q': 130, 't': 20000101000000, 'v': '2.0'}]},
+    {'site': '1', 'trace': [{'q': 130, 't': 20000101000000, 'v': '1.0'},
+                            {'q': 130, 't': 20000101231545, 'v': '1.5'}]},
+]}}
+
+DATETIME = gauge_getter.PullContext(timestamps='datetime')
+
+
+@pytest.fixture
+def mock_portal():
+    real = gauge_getter.requests, gauge_getter.sort_gauges_by_state, gauge_getter.COALESCE_REQUESTS
+    mock = MockRequestLib()
+    mock.response_data = json.dumps(RESPONSE).encode()
+    gauge_getter.requests = mock
+    gauge_getter.reset_sessions()
+    gauge_getter.COALESCE_REQUESTS = False
+    gauge_getter.sort_gauges_by_state = lambda gauges: {
+        'NSW': list(gauges), 'QLD': [], 'VIC': [], 'SA': [], 'rest': []}
+    yield mock
+    gauge_getter.requests, gauge_getter.sort_gauges_by_state, gauge_getter.COALESCE_REQUESTS = real
+    gauge_getter.reset_sessions()
+    shutdown_decode_pools()
+
+
+def test_kisters_times():
+    times = gauge_getter.kisters_times([20000101093015, '20001231235959'])
+    assert list(times) == [np.datetime64('2000-01-01T09:30:15', 'ns'),
+                           np.datetime64('2000-12-31T23:59:59', 'ns')]
+    assert list(gauge_getter.kisters_days([20000101093015])) == [np.datetime64('2000-01-01', 'ns')]
+
+
+def test_sources_keep_time_of_day():
+    batch = gauge_getter.extract_columns('NSW', RESPONSE, DATETIME)
+    assert batch['DATETIME'][0] == np.datetime64('2000-01-01T09:30:00', 'ns')
+    packed, _ = decode_kisters('NSW', json.dumps(RESPONSE).encode(), None, 'datetime')
+    assert list(unpack_batch(packed)['DATETIME']) == list(batch['DATETIME'])
+
+    # bom_water returns naive UTC timestamps
+    ts = pd.DataFrame({'Value[cumec]': [1.0], 'Quality': [10]},
+                      index=pd.DatetimeIndex(['2000-01-01T00:00:00'], name='Timestamp'))
+    bom = gauge_getter.bom_columns('410001', ts, 'F', DATETIME)
+    assert bom['DATETIME'][0] == np.datetime64('2000-01-01T10:00:00', 'ns')
+    assert gauge_getter.bom_columns('410001', ts, 'F')['DATETIME'][0] == \
+        np.datetime64('2000-01-01', 'ns')
+
+    export = {'Datasets': [{'LocationIdentifier': 'A4261002', 'Unit': 'ML/d'}],
+              'Rows': [{'Timestamp': '2000-01-01T06:00:00+09:30', 'Points': [{'Value': 1.0}]}]}
+    sa = gauge_getter.aquarius_columns(export, DATETIME)
+    assert sa['DATETIME'][0] == np.datetime64('2000-01-01T06:30:00', 'ns')
+
+
+@pytest.mark.parametrize('options', [{}, {'max_memory': '1MB'}, {'decode_processes': 2}])
+def test_gauge_pull_datetime(mock_portal, options):
+    df = gauge_getter.gauge_pull(['1', '2'], START, END, timestamps='datetime', **options)
+    assert list(df.index.names) == ['SITEID', 'DATETIME']
+    assert str(df.index.get_level_values('DATETIME').tz) == str(AEST)
+    assert df.index.is_monotonic_increasing
+    assert list(df['VALUE']) == [1.0, 1.5, 2.0, 2.5]
+    morning = df.loc['2'].loc[pd.Timestamp('2000-01-01 06:00', tz=AEST):]
+    assert list(morning['VALUE']) == [2.5]
+
+
+def test_gauge_pull_datetime_wide(mock_portal):
+    df = gauge_getter.gauge_pull(['1'], START, END, var=['F', 'L'], var_format='wide',
+                                 timestamps='datetime')
+    assert list(df['VALUE_F']) == [1.0, 1.5, 2.0, 2.5]
+    assert df.index.get_level_values('DATETIME')[1] == pd.Timestamp('2000-01-01 23:15:45', tz=AEST)
+    with pytest.raises(ValueError):
+        gauge_getter.gauge_pull(['1'], START, END, timestamps='hour')
+    with pytest.raises(ValueError):
+        gauge_getter.gauge_pull(['1'], START, END, timestamps='datetime', output='arrow')
@@ -0,0 +1,121 @@
+import gzip
+import json
+import datetime
+import threading
+import requests
+import pytest
+from mdba_gauge_getter import gauge_getter
+from mocks import MockRequestLib
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+DAY = datetime.date(2000, 1, 1)
+
+
+@pytest.fixture
+def portal():
+    real = gauge_getter.requests, gauge_getter.COALESCE_REQUESTS, dict(gauge_getter.STATE_TRANSPORT)
+    mock = MockRequestLib()
+    mock.HTTPError = requests.HTTPError
+    mock.RequestException = requests.RequestException
+    gauge_getter.requests = mock
+    gauge_getter.reset_sessions()
+    gauge_getter.COALESCE_REQUESTS = False
+    gauge_getter._post_supported.clear() # pylint: disable=protected-access
+    gauge_getter.reset_transport_stats()
+    yield mock
+    gauge_getter.requests, gauge_getter.COALESCE_REQUESTS, transport = real
+    gauge_getter.reset_sessions()
+    gauge_getter.STATE_TRANSPORT.update(transport)
+    gauge_getter._post_supported.clear() # pylint: disable=protected-access
+
+
+def call(state='NSW'):
+    return gauge_getter.call_state_api(state, ['A', 'B'], DAY, DAY, 'CP', 'F', 'day', 'mean')
+
+
+def test_session_requests_compression(portal):
+    assert gauge_getter.get_session().headers['Accept-Encoding'] == 'gzip, deflate'
+
+
+def test_session_per_thread(portal):
+    portal.Session = MockRequestLib
+    main = gauge_getter.get_session()
+    assert gauge_getter.get_session() is main
+    other = []
+    thread = threading.Thread(target=lambda: other.append(gauge_getter.get_session()))
+    thread.start()
+    thread.join()
+    assert other[0] is not main
+    gauge_getter.reset_sessions()
+    assert gauge_getter.get_session() is not main
+
+
+def test_get_is_default(portal):
+    assert call() == {'success': True}
+    assert len(portal.calls) == 1 and not portal.posts
+    assert gauge_getter.transport_stats()['get'] == 1
+
+
+def test_post(portal):
+    gauge_getter.STATE_TRANSPORT['QLD'] = 'post'
+    assert call('QLD') == {'success': True}
+    url, body = portal.posts[0]
+    assert url == 'https://water-monitoring.information.qld.gov.au/cgi/webservice.pl'
+    assert json.loads(body)['params']['site_list'] == 'A,B'
+    assert not portal.calls
+
+    portal.status_code = 500
+    with pytest.raises(requests.HTTPError):
+        call('QLD')
+    assert not portal.calls
+
+
+def test_auto_falls_back_to_get(portal):
+    gauge_getter.STATE_TRANSPORT['NSW'] = 'auto'
+    portal.status_code = 405
+    with pytest.raises(requests.HTTPError):
+        call()
+    assert len(portal.posts) == 1 and len(portal.calls) == 1
+
+    portal.status_code = 200
+    call()
+    # The portal is remembered as not accepting POST
+    assert len(portal.posts) == 1 and len(portal.calls) == 2
+    assert gauge_getter.transport_stats()['post_fallbacks'] == 1
+
+
+def test_bytes_saved():
+    body = json.dumps({'values': list(range(1000))}).encode()
+    response = requests.Response()
+    response._content = body # pylint: disable=protected-access
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Length'] = str(len(gzip.compress(body)))
+    gauge_getter.reset_transport_stats()
+    gauge_getter.record_transfer('post', response)
+    stats = gauge_getter.transport_stats()
+    assert stats['compressed'] == 1 and stats['decoded_bytes'] == len(body)
+    assert stats['bytes_saved'] == len(body) - len(gzip.compress(body)) > 0
+
+
+def test_auto_keeps_post_after_transient_errors(portal):
+    gauge_getter.STATE_TRANSPORT['NSW'] = 'auto'
+    portal.status_code = 503
+    with pytest.raises(requests.HTTPError):
+        call()
+    assert len(portal.posts) == 1 and len(portal.calls) == 1
+
+    real_post = portal.post
+    def timeout(url, data=None, headers=None):
+        portal.posts.append((url, data))
+        raise requests.Timeout('timed out')
+    portal.post = timeout
+    portal.status_code = 200
+    assert call() == {'success': True}
+    assert len(portal.posts) == 2 and len(portal.calls) == 2
+
+    # Neither failure switched the portal to GET
+    portal.post = real_post
+    call()
+    assert len(portal.posts) == 3 and len(portal.calls) == 2
+    assert gauge_getter.transport_stats()['post_fallbacks'] == 0
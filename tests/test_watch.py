@@ -0,0 +1,110 @@
+import time
+import datetime
+import pandas as pd
+import pytest
+from mdba_gauge_getter import gauge_getter
+from mdba_gauge_getter.watch import GaugeWatcher, watch_gauges
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+TODAY = datetime.date(2020, 1, 10)
+
+
+AEST = gauge_getter.TIMESTAMP_TIMEZONE
+
+# Gauges 1 and 2 are catalogued in NSW, gauge 3 in NSW and QLD
+CATALOGUE = {'NSW': {'1', '2', '3'}, 'QLD': {'3'}}
+
+
+def local(day, hour=0):
+    return pd.Timestamp(datetime.datetime.combine(day, datetime.time(hour)), tz=AEST)
+
+
+@pytest.fixture
+def upstream():
+    '''
+    Portals holding one value per gauge per day (or per hour) up to the current day, counting
+    requests.
+    '''
+    portal = {'calls': [], 'values': {}, 'today': TODAY}
+
+    def pull_timestamped(gauges_by_state, start, end, var, interval, data_type, var_format,
+                         context=None):
+        assert context.timestamps == 'datetime'
+        rows = []
+        for state, gauges in gauges_by_state.items():
+            portal['calls'].append((state, tuple(gauges), start, end))
+            for gauge in gauges:
+                day = start
+                while day <= min(end, portal['today']):
+                    for hour in range(24 if interval == 'hour' else 1):
+                        time = datetime.datetime.combine(day, datetime.time(hour))
+                        value = portal['values'].get((state, gauge, time),
+                                                     float(day.day) + hour / 100)
+                        rows.append([state, gauge, 'WATER', time, value, 130])
+                    day += datetime.timedelta(days=1)
+        return gauge_getter.index_by_time(pd.DataFrame(rows, columns=gauge_getter.DATA_COLUMNS))
+
+    real = gauge_getter.pull_timestamped, gauge_getter.route_gauges
+    gauge_getter.pull_timestamped = pull_timestamped
+    gauge_getter.route_gauges = lambda gauges, source: {
+        'NSW': [g for g in gauges if g in CATALOGUE['NSW']],
+        'QLD': [g for g in gauges if g in CATALOGUE['QLD']], 'VIC': [], 'SA': [], 'rest': []}
+    yield portal
+    gauge_getter.pull_timestamped, gauge_getter.route_gauges = real
+
+
+def test_poll_is_incremental(upstream):
+    received = []
+    watcher = GaugeWatcher(['1', '2'], callback=received.append, lookback_days=3,
+                           overlap_days=1)
+    first = watcher.poll(TODAY)
+    assert upstream['calls'] == [('NSW', ('1', '2'), datetime.date(2020, 1, 7), TODAY)]
+    assert len(first) == 8 and len(received) == 1
+    assert first['DATETIME'][0] == local(datetime.date(2020, 1, 7))
+
+    # Nothing has changed upstream, so nothing is passed on
+    assert len(watcher.poll(TODAY)) == 0 and len(received) == 1
+    assert upstream['calls'][-1] == ('NSW', ('1', '2'), datetime.date(2020, 1, 9), TODAY)
+
+    # A new day arrives and yesterday's provisional value for gauge 2 is revised
+    tomorrow = TODAY + datetime.timedelta(days=1)
+    upstream['today'] = tomorrow
+    upstream['values'][('NSW', '2', datetime.datetime.combine(TODAY, datetime.time()))] = 99.0
+    new = watcher.poll(tomorrow)
+    assert list(zip(new['SITEID'], new['DATETIME'], new['VALUE'])) == [
+        ('1', local(tomorrow), 11.0), ('2', local(TODAY), 99.0), ('2', local(tomorrow), 11.0)]
+    assert watcher.last_seen == {'1': tomorrow, '2': tomorrow}
+
+
+def test_gauges_are_polled_per_source(upstream):
+    watcher = GaugeWatcher(['1'], lookback_days=3, overlap_days=1)
+    watcher.poll(TODAY)
+    watcher.gauges.append('3')
+    watcher.poll(TODAY)
+    # Gauges 1 and 3 share NSW's request, from gauge 3's earlier window
+    assert upstream['calls'][1:] == [('NSW', ('1', '3'), datetime.date(2020, 1, 7), TODAY),
+                                     ('QLD', ('3',), datetime.date(2020, 1, 7), TODAY)]
+
+
+def test_rows_are_told_apart_by_source_and_time(upstream):
+    watcher = GaugeWatcher(['3'], interval='hour', lookback_days=1, overlap_days=1)
+    # 24 hourly values a day from each of NSW and QLD
+    assert len(watcher.poll(TODAY)) == 2 * 24 * 2
+    assert len(watcher.poll(TODAY)) == 0
+    upstream['values'][('QLD', '3', datetime.datetime.combine(TODAY, datetime.time(5)))] = -1.0
+    new = watcher.poll(TODAY)
+    assert list(zip(new['DATASOURCEID'], new['DATETIME'], new['VALUE'])) == [
+        ('QLD', local(TODAY, 5), -1.0)]
+
+
+def test_watch_gauges_runs_in_background(upstream):
+    upstream['today'] = datetime.date.today()
+    received = []
+    watcher = watch_gauges(['1'], callback=received.append, period=0.05)
+    deadline = time.time() + 5
+    while watcher.polls < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    watcher.stop(timeout=5)
+    assert watcher.polls >= 3
+    assert len(received) == 1